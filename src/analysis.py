@@ -1,15 +1,17 @@
 from sklearn.metrics import rand_score, adjusted_rand_score, normalized_mutual_info_score, silhouette_score, \
     silhouette_samples
-from models import SubtypesData, NanPercentage, Metrics, RandScore, AdjustedRandScore, \
+from pipeline_steps import ComputeFeatureStatistics
+from models import SubtypesData, Metrics, RandScore, AdjustedRandScore, \
     NormalizedMutualInfoScore, SilhouetteScore
 from sklearn.preprocessing import MinMaxScaler
 from plotly.graph_objs import Figure
+import plotly.graph_objects as go
 import plotly.express as px
 import pandas as pd
 import numpy as np
 
 
-def get_nan_percentage(data: pd.DataFrame) -> list[NanPercentage]:
+def get_nan_percentage(data: pd.DataFrame) -> pd.Series:
     """Return the percentage of NaN values for each column in the given dataframe.
 
     Parameter
@@ -19,16 +21,13 @@ def get_nan_percentage(data: pd.DataFrame) -> list[NanPercentage]:
 
     Returns
     -------
-    list[NanPercentage]
-        The list of NanPercentage objects.
+    pd.Series
+        The fraction of NaN values of each column, read from the feature statistics of the dataframe.
     """
 
-    nan_counts = list(zip(data.columns, data.isna().sum()))
+    statistics = ComputeFeatureStatistics().get_statistics(data=data)
 
-    nan_percs = [NanPercentage(column=col, percentage=count / len(data))
-                 for col, count in nan_counts]
-
-    return nan_percs
+    return statistics.features['nan_fraction'].rename('percentage')
 
 
 def plot_subtypes_distribution(data: SubtypesData) -> Figure:
@@ -113,6 +112,17 @@ def get_metrics(true_labels: pd.Series, predicted_labels: pd.Series, similarity_
     return metrics
 
 
+def metrics_to_record(metrics: Metrics) -> dict[str, float]:
+    """
+    This function flattens the given metrics into a record with one value per score.
+    """
+
+    data = metrics.model_dump()
+    del data['label']
+
+    return {score: value['value'] for score, value in data.items()}
+
+
 def get_metrics_comparison_plot(metrics: list[Metrics]) -> Figure:
     """
     This function plots a comparison of the given metrics.
@@ -226,7 +236,69 @@ def get_metrics_comparison_by_score_plot(metrics: list[Metrics]) -> Figure:
     return fig
 
 
-def get_silhouette_score_plot(predicted_labels, similarity_data: pd.DataFrame) -> Figure:
+def get_silhouette_plot_data(scores: np.ndarray, predicted_labels, gap_lines_n: int = 10,
+                             max_bars: int | None = None) -> pd.DataFrame:
+    """
+    This function lays out the bars of the silhouette plot: the samples sorted by cluster and by descending score, with
+    gap rows between the clusters.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        The silhouette score of each sample.
+    predicted_labels : array-like
+        The predicted labels of the samples.
+    gap_lines_n : int
+        The number of empty rows after each cluster.
+    max_bars : int, optional
+        The maximum number of bars, gaps excluded. When there are more samples, the sorted scores of each cluster are
+        split in quantile bins, with a number of bins proportional to the size of the cluster, and each bin is shown as
+        a bar with its mean score. Default is one bar per sample.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per bar, with the position of the (first) sample of the bar, the score, the cluster and the number of
+        samples of the bar. Gap rows have sample and cluster -1, score 0 and no samples.
+
+    The function works as follows:
+    1. The samples are sorted once by cluster and by descending score.
+    2. The bin of each sample within its cluster is computed from its rank in the cluster.
+    3. The row of each bin is computed by offsetting the bin with the bins and the gaps of the previous clusters.
+    4. The scores are averaged per row with np.bincount.
+    """
+
+    scores = np.asarray(scores, dtype=float)
+    clusters, codes, sizes = np.unique(np.asarray(predicted_labels), return_inverse=True, return_counts=True)
+    n = len(scores)
+
+    order = np.lexsort((-scores, codes))
+    sorted_scores, sorted_codes = scores[order], codes[order]
+    ranks = np.arange(n) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+
+    if max_bars is None or n <= max_bars:
+        bins = sizes
+    else:
+        bins = np.clip(sizes * max_bars // n, 1, sizes)
+    bin_offsets = np.cumsum(bins) - bins
+
+    rows = bin_offsets[sorted_codes] + ranks * bins[sorted_codes] // sizes[sorted_codes] + sorted_codes * gap_lines_n
+    rows_n = bins.sum() + len(clusters) * gap_lines_n
+
+    counts = np.bincount(rows, minlength=rows_n)
+    totals = np.bincount(rows, weights=sorted_scores, minlength=rows_n)
+
+    first = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    sample = np.full(rows_n, -1)
+    sample[rows[first]] = order[first]
+    cluster = np.full(rows_n, -1, dtype=clusters.dtype if clusters.dtype.kind in 'iu' else object)
+    cluster[rows[first]] = clusters[sorted_codes[first]]
+
+    return pd.DataFrame({'Sample': sample, 'Score': totals / np.maximum(counts, 1), 'Cluster': cluster,
+                         'Samples': counts})
+
+
+def get_silhouette_score_plot(predicted_labels, similarity_data: pd.DataFrame, max_bars: int | None = 2000) -> Figure:
     """
     This function plots the silhouette scores for the given predicted labels and similarity data.
 
@@ -236,6 +308,9 @@ def get_silhouette_score_plot(predicted_labels, similarity_data: pd.DataFrame) -
         The predicted labels of the data.
     similarity_data : pd.DataFrame
         The similarity data used to calculate the silhouette scores.
+    max_bars : int, optional
+        The maximum number of bars: with more samples, each bar shows the mean score of a quantile bin of its cluster,
+        see get_silhouette_plot_data. None plots a bar for each sample. Default is 2000.
 
     Returns
     -------
@@ -247,11 +322,12 @@ def get_silhouette_score_plot(predicted_labels, similarity_data: pd.DataFrame) -
     2. It then calculates the distances matrix from the normalized similarity data.
     3. The diagonal of the distances matrix is filled with zeros.
     4. The silhouette scores are calculated using the distances matrix and the predicted labels.
-    5. A DataFrame is created from the silhouette scores, with each row representing a sample and each column representing a score or a cluster.
-    6. A gap is added between the clusters in the DataFrame.
-    7. A bar plot is created using plotly, with the x-axis representing the samples, the y-axis representing the scores, and the color representing the scores.
-    8. The layout of the plot is updated to place the title in the center, to remove the tick labels from the x-axis, and to remove the line width from the bars.
-    9. The Figure object representing the plot is returned.
+    5. The bars are laid out with get_silhouette_plot_data, sorted by cluster and score and with a gap between the
+       clusters.
+    6. A bar plot is created, with the x-axis representing the bars, the y-axis representing the scores, and the
+       color representing the scores.
+    7. The layout of the plot is updated to place the title in the center, to remove the tick labels from the x-axis, and to remove the line width from the bars.
+    8. The Figure object representing the plot is returned.
     """
 
     scaler = MinMaxScaler()
@@ -262,21 +338,15 @@ def get_silhouette_score_plot(predicted_labels, similarity_data: pd.DataFrame) -
     np.fill_diagonal(distances_matrix, 0)
 
     scores = silhouette_samples(distances_matrix, predicted_labels)
-    data = pd.DataFrame({'Sample': range(len(scores)), 'Score': scores, 'Cluster': predicted_labels})
-
-    gapped_data = pd.DataFrame()
-    gap_lines_n = 10
-    gap = pd.DataFrame({'Sample': [-1] * gap_lines_n, 'Score': [0] * gap_lines_n, 'Cluster': [-1] * gap_lines_n})
-    for cluster in sorted(data['Cluster'].unique()):
-        cluster_data = data[data['Cluster'] == cluster]
-        cluster_data = pd.concat([cluster_data, gap]).reset_index(drop=True)
-
-        gapped_data = pd.concat([gapped_data, cluster_data]).reset_index(drop=True)
-
-    fig = px.bar(gapped_data, x=gapped_data.index, y='Score', title='Silhouette scores', color='Score',
-                 hover_data=['Cluster'])
-    fig.update_layout(title_x=0.5, bargap=0)
-    fig.update_traces(marker_line_width=0)
+    gapped_data = get_silhouette_plot_data(scores, predicted_labels, max_bars=max_bars)
+
+    fig = Figure(go.Bar(x=gapped_data.index, y=gapped_data['Score'],
+                        marker={'color': gapped_data['Score'], 'coloraxis': 'coloraxis', 'line': {'width': 0}},
+                        customdata=gapped_data[['Cluster', 'Samples']].to_numpy(),
+                        hovertemplate='Score=%{y}<br>Cluster=%{customdata[0]}<br>Samples=%{customdata[1]}'
+                                      '<extra></extra>'))
+    fig.update_layout(title='Silhouette scores', title_x=0.5, bargap=0, yaxis_title='Score',
+                      coloraxis={'colorscale': px.colors.sequential.Plasma, 'colorbar': {'title': 'Score'}})
     fig.update_xaxes(showticklabels=False, title=None)
 
     return fig
@@ -0,0 +1,96 @@
+from scipy.spatial.distance import cdist
+import numpy as np
+
+
+class RandomProjectionForest:
+    """
+    Approximate nearest neighbors search with a forest of random projection trees.
+
+    Each tree recursively splits the samples at the median of their projection on a random direction, until the leaves
+    hold at most leaf_size samples. The neighbors of a sample are searched, with exact distances, among the samples
+    sharing one of its leaves. More trees give a higher recall at a higher cost: trees_n is the recall knob.
+    """
+
+    def __init__(self, trees_n: int = 8, leaf_size: int = 64, random_state: int = 0):
+        self.trees_n = trees_n
+        self.leaf_size = leaf_size
+        self.random_state = random_state
+
+    def _leaves(self, samples: np.ndarray, leaf_size: int, rng: np.random.Generator) -> list[np.ndarray]:
+        leaves = []
+        stack = [np.arange(len(samples))]
+
+        while stack:
+            node = stack.pop()
+            if len(node) <= leaf_size:
+                leaves.append(node)
+                continue
+
+            projection = samples[node] @ rng.normal(size=samples.shape[1])
+            order = np.argsort(projection, kind='stable')
+            half = len(node) // 2
+            stack += [node[order[:half]], node[order[half:]]]
+
+        return leaves
+
+    def kneighbors(self, samples: np.ndarray, K: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        This method finds the approximate K nearest neighbors of each sample, by squared euclidean distance.
+
+        Parameters
+        ----------
+        samples : np.ndarray
+            The (n, d) samples matrix.
+        K : int
+            The number of neighbors to be found, the sample itself included.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            The (n, K) indices and distances of the neighbors of each sample, sorted by ascending distance.
+
+        The method works as follows:
+        1. For each tree, the samples are split in leaves holding between leaf_size / 2 and leaf_size samples, with
+           leaf_size raised to at least 2 * K so every leaf holds K candidates.
+        2. The K nearest samples of each sample within its leaf are found with exact distances.
+        3. The candidates of all the trees are merged, duplicates are dropped, and the K nearest ones are kept.
+        """
+
+        rng = np.random.default_rng(self.random_state)
+        n = len(samples)
+        K = min(K, n)
+        leaf_size = max(self.leaf_size, 2 * K)
+
+        candidates_indices = np.empty((n, self.trees_n * K), dtype=int)
+        candidates_distances = np.empty((n, self.trees_n * K))
+
+        for tree in range(self.trees_n):
+            columns = slice(tree * K, (tree + 1) * K)
+            for leaf in self._leaves(samples, leaf_size=leaf_size, rng=rng):
+                distances = cdist(samples[leaf], samples[leaf], metric='sqeuclidean')
+                nearest = np.argpartition(distances, K - 1, axis=1)[:, :K]
+                candidates_indices[leaf, columns] = leaf[nearest]
+                candidates_distances[leaf, columns] = np.take_along_axis(distances, nearest, axis=1)
+
+        order = np.argsort(candidates_indices, axis=1, kind='stable')
+        candidates_indices = np.take_along_axis(candidates_indices, order, axis=1)
+        candidates_distances = np.take_along_axis(candidates_distances, order, axis=1)
+        candidates_distances[:, 1:][candidates_indices[:, 1:] == candidates_indices[:, :-1]] = np.inf
+
+        nearest = np.argpartition(candidates_distances, K - 1, axis=1)[:, :K]
+        indices = np.take_along_axis(candidates_indices, nearest, axis=1)
+        distances = np.take_along_axis(candidates_distances, nearest, axis=1)
+
+        order = np.argsort(distances, axis=1, kind='stable')
+
+        return np.take_along_axis(indices, order, axis=1), np.take_along_axis(distances, order, axis=1)
+
+
+def get_recall(approximate_indices: np.ndarray, exact_indices: np.ndarray) -> float:
+    """
+    This function returns the fraction of the exact nearest neighbors found by the approximate search.
+    """
+
+    hits = [len(np.intersect1d(approximate, exact)) for approximate, exact in zip(approximate_indices, exact_indices)]
+
+    return sum(hits) / exact_indices.size
@@ -0,0 +1,102 @@
+from approximate_neighbours import RandomProjectionForest, get_recall
+from experiment import load_experiment, evaluate_experiment, get_true_labels
+from pipeline_steps import EncodeCategoricalData, ZScoreScaler, SimilarityMatrices
+from analysis import metrics_to_record
+from scipy.spatial.distance import cdist
+from models import Data
+from loguru import logger
+from sys import stdout
+import pandas as pd
+import numpy as np
+import argparse
+import os.path
+import os
+
+
+def get_exact_neighbours(data: Data, K: int) -> np.ndarray:
+    """
+    This function returns the indices of the exact K nearest neighbors of each sample (itself included), computed on
+    the same scaled samples as SimilarityMatrices.
+    """
+
+    samples = ZScoreScaler()(data=EncodeCategoricalData()(data=data)).to_numpy(dtype=float)
+    distances = cdist(samples, samples, metric='sqeuclidean')
+    np.fill_diagonal(distances, -np.inf)
+
+    return np.argpartition(distances, K - 1, axis=1)[:, :K]
+
+
+def get_approximate_report(modalities: list[Data], true_labels: pd.Series, trees_n_values: list[int], K: int = 20,
+                           t: int = 20, clusters_n: int = 3) -> pd.DataFrame:
+    """
+    This function compares the approximate nearest neighbors backend with the exact one, for each number of trees.
+
+    Parameters
+    ----------
+    modalities : list[Data]
+        The aligned modalities.
+    true_labels : pd.Series
+        The encoded true subtypes, aligned with the modalities.
+    trees_n_values : list[int]
+        The numbers of trees of the random projection forest to be evaluated.
+    K, t : int
+        The SNF parameters.
+    clusters_n : int
+        The number of clusters to be detected.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per number of trees and method, with the recall of the K nearest neighbors of each modality, the
+        metrics of the approximate backend and their difference from the metrics of the exact backend.
+    """
+
+    K_max = max(K, 50)
+    exact_neighbours = [get_exact_neighbours(data, K=K + 1) for data in modalities]
+    exact_metrics = {m.label: metrics_to_record(m)
+                     for m in evaluate_experiment(modalities, true_labels=true_labels, K=K, t=t, clusters_n=clusters_n)}
+
+    records = []
+    for trees_n in trees_n_values:
+        logger.info(f'Evaluating the approximate backend with {trees_n} trees...')
+        forest = RandomProjectionForest(trees_n=trees_n)
+        recalls = {}
+        for data, exact in zip(modalities, exact_neighbours):
+            samples = ZScoreScaler()(data=EncodeCategoricalData()(data=data)).to_numpy(dtype=float)
+            approximate, _ = forest.kneighbors(samples, K=K + 1)
+            recalls[f'{data.name} recall'] = get_recall(approximate, exact)
+
+        similarity_step = SimilarityMatrices(K=K, K_max=K_max, backend='approximate', trees_n=trees_n)
+        metrics = evaluate_experiment(modalities, true_labels=true_labels, K=K, t=t, clusters_n=clusters_n,
+                                      similarity_step=similarity_step)
+
+        for m in metrics:
+            record = metrics_to_record(m)
+            drift = {f'{score} drift': value - exact_metrics[m.label][score] for score, value in record.items()}
+            records.append({'trees_n': trees_n, 'label': m.label} | recalls | record | drift)
+
+    return pd.DataFrame(records)
+
+
+if __name__ == '__main__':
+    logger.remove()
+    logger.add(stdout, level='INFO', colorize=True,
+               format='<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[data_type]} | <level>{message}</level>')
+    logger.configure(extra={'data_type': 'None'})
+
+    parser = argparse.ArgumentParser(description='Compare the approximate nearest neighbors backend with the exact one.')
+    parser.add_argument('--trees-n', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--retain-k', type=int, default=100)
+    parser.add_argument('--K', type=int, default=20)
+    parser.add_argument('--t', type=int, default=20)
+    parser.add_argument('--clusters-n', type=int, default=3)
+    parser.add_argument('--report', type=str, default='../results/approximate_neighbours.csv')
+    args = parser.parse_args()
+
+    proteins_data, mirna_data, mrna_data, _, subtypes_data = load_experiment(retain_k=args.retain_k)
+    report = get_approximate_report([proteins_data, mirna_data, mrna_data], true_labels=get_true_labels(subtypes_data),
+                                    trees_n_values=args.trees_n, K=args.K, t=args.t, clusters_n=args.clusters_n)
+
+    os.makedirs(os.path.dirname(args.report), exist_ok=True)
+    report.to_csv(args.report, index=False)
+    print(report.to_string())
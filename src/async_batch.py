@@ -0,0 +1,261 @@
+from batch import discover_cohorts, load_dataset, evaluate_cohort
+from concurrent.futures import ThreadPoolExecutor
+from precision import PRECISIONS, set_precision
+from resources import set_threads
+from settings import RESULTS_STORE_PATH
+from loguru import logger
+from sys import stdout
+import pandas as pd
+import argparse
+import asyncio
+import time
+import os.path
+import os
+
+
+def get_busy_intervals(intervals: list[tuple[float, float]]) -> list[tuple[float, float]]:
+    """
+    This function merges the given (start, end) intervals into the disjoint intervals they cover.
+    """
+
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+def get_overlap_seconds(first: list[tuple[float, float]], second: list[tuple[float, float]]) -> float:
+    """
+    This function returns the seconds covered by both the given lists of disjoint intervals.
+    """
+
+    return sum(max(0.0, min(end, other_end) - max(start, other_start))
+               for start, end in first for other_start, other_end in second)
+
+
+class UtilizationMonitor:
+    """
+    Recorder of the time spent by the driver in each stage, to measure how much of the I/O and of the compute are
+    overlapped.
+
+    The intervals of the 'load' and 'compute' stages are the busy time of the disk and of the CPU; 'blocked' is the time
+    the prefetcher waits for room in the queue (backpressure) and 'starved' the time the computation waits for data.
+    """
+
+    stages = ['load', 'compute', 'blocked', 'starved']
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.records: list[dict] = []
+
+    def record(self, stage: str, cohort: str | None, start: float, end: float):
+        self.records.append({'stage': stage, 'cohort': cohort, 'start': start - self.origin,
+                             'end': end - self.origin})
+
+    def get_timeline(self) -> pd.DataFrame:
+        """
+        This method returns one row per recorded interval, with its stage, cohort, start and end in seconds since the
+        monitor was created.
+        """
+
+        return pd.DataFrame(self.records, columns=['stage', 'cohort', 'start', 'end'])
+
+    def get_summary(self) -> dict[str, float]:
+        """
+        This method returns the utilization metrics of the run.
+
+        Returns
+        -------
+        dict[str, float]
+            The wall seconds of the run; the busy seconds of each stage; the utilization of the I/O and of the
+            compute (busy over wall seconds); the overlap seconds, during which both were busy, and the overlap
+            fraction, over the shorter of the two; the speedup over running the stages one after the other.
+        """
+
+        timeline = self.get_timeline()
+        busy = {stage: get_busy_intervals(list(zip(timeline.loc[timeline['stage'] == stage, 'start'],
+                                                   timeline.loc[timeline['stage'] == stage, 'end'])))
+                for stage in self.stages}
+        seconds = {stage: sum(end - start for start, end in intervals) for stage, intervals in busy.items()}
+
+        wall_seconds = timeline['end'].max() - timeline['start'].min() if len(timeline) else 0.0
+        overlap_seconds = get_overlap_seconds(busy['load'], busy['compute'])
+        shorter = min(seconds['load'], seconds['compute'])
+
+        return ({'wall_seconds': wall_seconds}
+                | {f'{stage}_seconds': value for stage, value in seconds.items()}
+                | {'load_utilization': seconds['load'] / wall_seconds if wall_seconds else 0.0,
+                   'compute_utilization': seconds['compute'] / wall_seconds if wall_seconds else 0.0,
+                   'overlap_seconds': overlap_seconds,
+                   'overlap_fraction': overlap_seconds / shorter if shorter else 0.0,
+                   'speedup': (seconds['load'] + seconds['compute']) / wall_seconds if wall_seconds else 0.0})
+
+
+async def prefetch_cohorts(cohorts: dict[str, dict[str, str]], queue: asyncio.Queue, executor: ThreadPoolExecutor,
+                           monitor: UtilizationMonitor):
+    """
+    This coroutine reads and parses the datasets of the cohorts one cohort after the other, each dataset in its own
+    executor thread, and puts them in the given queue. It waits when the queue is full, so at most queue.maxsize + 1
+    cohorts are held in memory ahead of the computation. A None is put when all the cohorts have been loaded.
+    """
+
+    loop = asyncio.get_running_loop()
+
+    for cohort, paths in cohorts.items():
+        start = time.perf_counter()
+        try:
+            datasets = await asyncio.gather(*[loop.run_in_executor(executor, load_dataset, dataset, path)
+                                              for dataset, path in paths.items()])
+        except Exception as exception:
+            logger.error(f'Cohort {cohort} failed to load: {exception!r}')
+            continue
+        loaded = time.perf_counter()
+        monitor.record('load', cohort, start, loaded)
+
+        await queue.put((cohort, dict(zip(paths, datasets)), loaded - start))
+        monitor.record('blocked', cohort, loaded, time.perf_counter())
+
+    await queue.put(None)
+
+
+async def compute_cohorts(queue: asyncio.Queue, executor: ThreadPoolExecutor, monitor: UtilizationMonitor,
+                          **parameters) -> list[dict]:
+    """
+    This coroutine evaluates the cohorts taken from the given queue with evaluate_cohort, in the given executor, until
+    it gets a None, and returns the records of all of them.
+    """
+
+    loop = asyncio.get_running_loop()
+    records = []
+
+    while True:
+        start = time.perf_counter()
+        item = await queue.get()
+        monitor.record('starved', None, start, time.perf_counter())
+        if item is None:
+            break
+
+        cohort, datasets, load_seconds = item
+        start = time.perf_counter()
+        try:
+            records += await loop.run_in_executor(executor, lambda: evaluate_cohort(cohort, datasets,
+                                                                                    load_seconds=load_seconds,
+                                                                                    **parameters))
+            logger.info(f'Cohort {cohort} completed.')
+        except Exception as exception:
+            logger.error(f'Cohort {cohort} failed: {exception!r}')
+        monitor.record('compute', cohort, start, time.perf_counter())
+
+    return records
+
+
+async def drive_cohorts(cohorts: dict[str, dict[str, str]], prefetch_n: int = 1, io_workers: int = 5,
+                        **parameters) -> tuple[list[dict], UtilizationMonitor]:
+    """
+    This coroutine evaluates the given cohorts one at a time, while the datasets of the next ones are read and parsed
+    concurrently.
+
+    Parameters
+    ----------
+    cohorts : dict[str, dict[str, str]]
+        The paths of the datasets of each cohort, as returned by discover_cohorts.
+    prefetch_n : int
+        The maximum number of loaded cohorts waiting to be evaluated, i.e. the size of the queue between the two stages.
+    io_workers : int
+        The number of threads reading and parsing the datasets of a cohort.
+    **parameters
+        The parameters of the experiment, forwarded to evaluate_cohort.
+
+    Returns
+    -------
+    tuple[list[dict], UtilizationMonitor]
+        The records of all the cohorts, see evaluate_cohort, and the monitor of the run.
+    """
+
+    queue = asyncio.Queue(maxsize=prefetch_n)
+    monitor = UtilizationMonitor()
+
+    with ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='load') as io_executor, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix='compute') as compute_executor:
+        _, records = await asyncio.gather(prefetch_cohorts(cohorts, queue, io_executor, monitor),
+                                          compute_cohorts(queue, compute_executor, monitor, **parameters))
+
+    return records, monitor
+
+
+def run_async_batch(data_path: str, output_path: str, prefetch_n: int = 1, io_workers: int = 5,
+                    **parameters) -> tuple[pd.DataFrame, dict[str, float]]:
+    """
+    This function runs the experiment over every cohort found under the given directory with drive_cohorts, and
+    writes the metrics of all the cohorts in a single table, as run_batch does.
+
+    Parameters
+    ----------
+    data_path : str
+        The root directory containing the cohorts datasets.
+    output_path : str
+        The path of the CSV file where the consolidated metrics are written. The timeline of the stages is written
+        next to it, with the '_timeline' suffix.
+    prefetch_n, io_workers : int
+        See drive_cohorts.
+    **parameters
+        The parameters of the experiment, forwarded to evaluate_cohort.
+
+    Returns
+    -------
+    tuple[pd.DataFrame, dict[str, float]]
+        The consolidated metrics and the utilization metrics, see UtilizationMonitor.get_summary.
+    """
+
+    cohorts = discover_cohorts(data_path)
+    records, monitor = asyncio.run(drive_cohorts(cohorts, prefetch_n=prefetch_n, io_workers=io_workers,
+                                                 **parameters))
+
+    results = pd.DataFrame(records, columns=['cohort', 'patients_n', 'method', 'rand_score', 'adjusted_rand_score',
+                                             'normalized_mutual_info_score', 'silhouette_score'])
+    results = results.sort_values(['cohort', 'method']).reset_index(drop=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    results.to_csv(output_path, index=False)
+    monitor.get_timeline().to_csv(f'{os.path.splitext(output_path)[0]}_timeline.csv', index=False)
+    logger.info(f'Metrics of {results["cohort"].nunique()} cohorts saved to {output_path}.')
+
+    summary = monitor.get_summary()
+    logger.info(f'Utilization: {", ".join(f"{key}: {value:.2f}" for key, value in summary.items())}')
+
+    return results, summary
+
+
+if __name__ == '__main__':
+    logger.remove()
+    logger.add(stdout, level='INFO', colorize=True,
+               format='<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[data_type]} | <level>{message}</level>')
+    logger.configure(extra={'data_type': 'None'})
+
+    parser = argparse.ArgumentParser(description='Run the experiment over all the TCGA cohorts on local disk, loading '
+                                                 'the next cohorts while the current one is evaluated.')
+    parser.add_argument('--data', type=str, default='../data')
+    parser.add_argument('--output', type=str, default='../results/pan_cancer_metrics.csv')
+    parser.add_argument('--prefetch', type=int, default=1, help='Maximum number of loaded cohorts waiting.')
+    parser.add_argument('--io-workers', type=int, default=5)
+    parser.add_argument('--retain-k', type=int, default=100)
+    parser.add_argument('--K', type=int, default=20)
+    parser.add_argument('--t', type=int, default=20)
+    parser.add_argument('--clusters-n', type=int, default=3)
+    parser.add_argument('--subtype-column', type=str, default='Subtype_Integrative')
+    parser.add_argument('--precision', type=str, choices=list(PRECISIONS), default='float64')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--store', type=str, default=RESULTS_STORE_PATH)
+    args = parser.parse_args()
+    set_precision(args.precision)
+    set_threads(args.threads)
+
+    _, summary = run_async_batch(data_path=args.data, output_path=args.output, prefetch_n=args.prefetch,
+                                 io_workers=args.io_workers, retain_k=args.retain_k, K=args.K, t=args.t,
+                                 clusters_n=args.clusters_n, subtype_column=args.subtype_column,
+                                 store_path=args.store)
+    print(pd.Series(summary).to_string())
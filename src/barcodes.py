@@ -0,0 +1,182 @@
+from settings import BARCODE_CACHE_SIZE
+from collections import OrderedDict
+from loguru import logger
+import pandas as pd
+import numpy as np
+import hashlib
+import weakref
+
+BARCODE_FIELDS = ['project', 'tss', 'participant', 'sample_type', 'vial', 'portion', 'analyte']
+
+BARCODE_REGEX = (r'^(?P<patient>(?P<project>[A-Z]+)-(?P<tss>[A-Z0-9]{2})-(?P<participant>[A-Z0-9]{4}))'
+                 r'(?:-(?P<sample_type>\d{2})(?P<vial>[A-Z])?(?:-(?P<portion>\d{2})(?P<analyte>[A-Z])?)?)?')
+
+PRIMARY_TUMOR = 1
+
+
+def _parse_fixed_width(barcodes: np.ndarray) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """
+    This function parses the TCGA barcodes laid out at the standard fixed positions, on their bytes.
+
+    It returns the mask of the barcodes that follow the layout, and the fields of all the barcodes (meaningful only
+    where the mask is set).
+    """
+
+    try:
+        encoded = barcodes.astype('S')
+    except UnicodeEncodeError:
+        encoded = np.char.encode(barcodes.astype(str), 'ascii', errors='replace')
+    width = max(encoded.dtype.itemsize, 20)
+    chars = encoded.astype(f'S{width}').view(np.uint8).reshape(len(encoded), width)
+    lengths = (chars != 0).sum(axis=1)
+
+    def is_digit(column: int) -> np.ndarray:
+        return (chars[:, column] >= ord('0')) & (chars[:, column] <= ord('9'))
+
+    def is_letter(column: int) -> np.ndarray:
+        return (chars[:, column] >= ord('A')) & (chars[:, column] <= ord('Z'))
+
+    def is_dash(column: int) -> np.ndarray:
+        return chars[:, column] == ord('-')
+
+    def to_int(start: int) -> np.ndarray:
+        return ((chars[:, start].astype(np.int16) - ord('0')) * 10 + chars[:, start + 1] - ord('0')).astype(np.int16)
+
+    has_sample, has_vial = lengths > 12, lengths > 15
+    has_portion, has_analyte = lengths > 16, lengths > 19
+
+    valid = (lengths >= 12) & (chars[:, :5] == np.frombuffer(b'TCGA-', dtype=np.uint8)).all(axis=1) & is_dash(7)
+    for column in [5, 6, 8, 9, 10, 11]:
+        valid &= is_digit(column) | is_letter(column)
+    valid &= ~has_sample | (is_dash(12) & is_digit(13) & is_digit(14))
+    valid &= ~has_vial | is_letter(15)
+    valid &= ~has_portion | (is_dash(16) & is_digit(17) & is_digit(18))
+    valid &= ~has_analyte | is_letter(19)
+
+    fields = {'patient': chars[:, :12].copy().view('S12').ravel(),
+              'project': np.full(len(chars), b'TCGA'),
+              'tss': chars[:, 5:7].copy().view('S2').ravel(),
+              'participant': chars[:, 8:12].copy().view('S4').ravel(),
+              'sample_type': np.where(has_sample, to_int(13), -1).astype(np.int16),
+              'vial': np.where(has_vial, chars[:, 15:16].copy().view('S1').ravel(), b''),
+              'portion': np.where(has_portion, to_int(17), -1).astype(np.int16),
+              'analyte': np.where(has_analyte, chars[:, 19:20].copy().view('S1').ravel(), b'')}
+
+    return valid, fields
+
+
+def parse_barcodes(barcodes: pd.Index) -> pd.DataFrame:
+    """
+    This function parses the given TCGA barcodes (e.g. TCGA-85-4361-01A-11P-A000-07) with vectorized operations.
+
+    Parameters
+    ----------
+    barcodes : pd.Index
+        The barcodes to be parsed. They can be truncated after any field, e.g. patient IDs as TCGA-85-4361.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per barcode, in the same order, with the patient ID (the first 12 characters) and the fields in
+        BARCODE_FIELDS. Sample type and portion are integers, -1 when missing; the other fields are categoricals.
+        Barcodes that cannot be parsed have the whole barcode as patient ID and missing fields.
+
+    The function works as follows:
+    1. The barcodes following the standard TCGA layout are parsed on their bytes, slicing the fields at their fixed
+       positions.
+    2. The other barcodes (e.g. of other projects) are parsed with BARCODE_REGEX.
+    3. The text fields are converted to categoricals.
+    """
+
+    values = np.asarray(barcodes, dtype=object)
+    valid, fields = _parse_fixed_width(values)
+
+    if not valid.all():
+        others = pd.Series(values[~valid], dtype=str).str.extract(BARCODE_REGEX)
+        for field, column in fields.items():
+            if field in ['sample_type', 'portion']:
+                column[~valid] = pd.to_numeric(others[field]).fillna(-1).to_numpy()
+            else:
+                fields[field] = column.astype(str).astype(object)
+                fields[field][~valid] = others[field].fillna('').to_numpy()
+
+        invalid = fields['patient'] == ''
+        if invalid.any():
+            logger.warning(f'Barcodes not parsed: {invalid.sum()}/{len(values)}')
+            fields['patient'][invalid] = values[invalid]
+
+    parsed = pd.DataFrame(index=barcodes)
+    for field, column in fields.items():
+        if field in ['sample_type', 'portion']:
+            parsed[field] = column.astype(np.int16)
+            continue
+
+        # Empty strings stand for missing fields, so they are left out of the categories
+        categories, codes = np.unique(column, return_inverse=True)
+        if len(categories) and not categories[0]:
+            categories, codes = categories[1:], codes - 1
+        parsed[field] = pd.Categorical.from_codes(codes, categories=pd.Index(categories.astype(str).astype(object)))
+
+    return parsed
+
+
+class BarcodeIndex:
+    """
+    Cache of the parsed barcodes of the datasets, so each index is parsed only once however many steps use it.
+
+    The parsed barcodes are looked up by identity of the index first, which is free, and then by content, which
+    requires hashing the barcodes but still avoids parsing them again (e.g. for a copy of a dataset). Only the
+    max_size most recently used indexes are kept by content; the ones looked up by identity are released with them.
+    """
+
+    def __init__(self, max_size: int = BARCODE_CACHE_SIZE):
+        self.max_size = max_size
+        self._barcodes: OrderedDict[str, pd.DataFrame] = OrderedDict()
+        self._identities: dict[int, tuple[weakref.ref, pd.DataFrame]] = {}
+
+    @staticmethod
+    def get_key(barcodes: pd.Index) -> str:
+        digest = hashlib.sha1(pd.util.hash_pandas_object(barcodes, index=False).to_numpy().tobytes())
+        return f'{len(barcodes)}-{digest.hexdigest()[:16]}'
+
+    def parse(self, barcodes: pd.Index) -> pd.DataFrame:
+        """
+        This method returns the parsed barcodes of the given index, see parse_barcodes.
+        """
+
+        identity = id(barcodes)
+        reference, parsed = self._identities.get(identity, (None, None))
+        if reference is not None and reference() is barcodes:
+            return parsed
+
+        key = self.get_key(barcodes)
+        if key in self._barcodes:
+            self._barcodes.move_to_end(key)
+            parsed = self._barcodes[key]
+        else:
+            parsed = self._barcodes[key] = parse_barcodes(barcodes)
+            while len(self._barcodes) > self.max_size:
+                self._barcodes.popitem(last=False)
+
+        self._identities[identity] = (weakref.ref(barcodes, lambda _: self._identities.pop(identity, None)), parsed)
+
+        return parsed
+
+    def is_primary_tumor(self, barcodes: pd.Index) -> np.ndarray:
+        """
+        This method returns a boolean mask of the barcodes of TCGA primary tumor samples (sample type 01).
+        """
+
+        parsed = self.parse(barcodes)
+
+        return ((parsed['sample_type'].to_numpy() == PRIMARY_TUMOR) & (parsed['project'] == 'TCGA').to_numpy())
+
+    def get_patients(self, barcodes: pd.Index) -> pd.Index:
+        """
+        This method returns the patient IDs (e.g. TCGA-85-4361) of the given barcodes.
+        """
+
+        return pd.Index(self.parse(barcodes)['patient'].astype(str).to_numpy(dtype=object), name=barcodes.name)
+
+
+BARCODE_INDEX = BarcodeIndex()
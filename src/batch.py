@@ -0,0 +1,279 @@
+from experiment import preprocess_modality, get_modalities_pipelines, select_features, align_datasets, \
+    get_true_labels, evaluate_experiment
+from pipelines import PhenotypePipeline, SubTypesPipeline
+from data_loaders import ProteinsDataLoader, miRNADataLoader, mRNADataLoader, PhenotypeDataLoader, SubtypesDataLoader
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from analysis import metrics_to_record
+from precision import PRECISIONS, set_precision, get_precision
+from resources import set_threads, split_threads
+from feature_statistics import get_data_fingerprint
+from results_store import ResultsStore
+from models import Data
+from settings import RESULTS_STORE_PATH
+from loguru import logger
+from sys import stdout
+import pandas as pd
+import argparse
+import resource
+import time
+import os.path
+import os
+import re
+
+COHORT_REGEX = r'mo_(?P<cohort>[A-Z]+)_'
+
+MODALITIES_LOADERS = {'proteins': ProteinsDataLoader,
+                      'mirna': miRNADataLoader,
+                      'mrna': mRNADataLoader}
+
+ANNOTATIONS_LOADERS = {'phenotype': PhenotypeDataLoader,
+                       'subtypes': SubtypesDataLoader}
+
+
+def discover_cohorts(data_path: str) -> dict[str, dict[str, str]]:
+    """
+    This function discovers the TCGA cohorts available under the given directory.
+
+    Parameters
+    ----------
+    data_path : str
+        The root directory to be searched, recursively.
+
+    Returns
+    -------
+    dict[str, dict[str, str]]
+        For each cohort with all the three modalities, the path of each dataset keyed by 'proteins', 'mirna', 'mrna',
+        'phenotype' and 'subtypes'.
+
+    The function works as follows:
+    1. It walks the directory tree and matches each file name against the filename_regex of each loader.
+    2. The cohort of each omics file is read from its name (e.g. 'mo_PRAD_RPPAArray-20160128.csv' belongs to PRAD).
+    3. The phenotype and subtypes files of a cohort are searched in the directory of its omics files first, then in
+       the root directory.
+    4. Cohorts missing any dataset are logged and skipped.
+    """
+
+    found: dict[str, dict[str, str]] = {}
+    annotations: dict[str, dict[str, str]] = {}
+
+    for directory, _, file_names in sorted(os.walk(data_path)):
+        directory = os.path.normpath(directory)
+        for file_name in sorted(file_names):
+            file_path = os.path.join(directory, file_name)
+
+            for modality, loader in MODALITIES_LOADERS.items():
+                cohort = re.search(COHORT_REGEX, file_name)
+                if re.findall(loader.filename_regex, file_name) and cohort:
+                    found.setdefault(cohort.group('cohort'), {'directory': directory})[modality] = file_path
+
+            for annotation, loader in ANNOTATIONS_LOADERS.items():
+                if re.findall(loader.filename_regex, file_name):
+                    annotations.setdefault(directory, {})[annotation] = file_path
+
+    cohorts = {}
+
+    for cohort, paths in found.items():
+        directory = paths.pop('directory')
+        for annotation in ANNOTATIONS_LOADERS:
+            path = annotations.get(directory, {}).get(annotation,
+                                                      annotations.get(os.path.normpath(data_path), {}).get(annotation))
+            if path is not None:
+                paths[annotation] = path
+
+        missing = (set(MODALITIES_LOADERS) | set(ANNOTATIONS_LOADERS)) - set(paths)
+        if missing:
+            logger.warning(f'Cohort {cohort} skipped, missing datasets: {sorted(missing)}')
+            continue
+
+        cohorts[cohort] = paths
+
+    logger.info(f'Cohorts discovered: {sorted(cohorts)}')
+
+    return cohorts
+
+
+def limit_worker_memory(memory_limit: int | None, precision: str = 'float64', threads: int | None = None):
+    """
+    This function caps the address space of the current worker process, so a cohort exceeding the given memory limit
+    fails with a MemoryError instead of exhausting the node. It also sets the precision and the thread budget of the
+    worker explicitly, so they do not depend on whether the start method of the pool forks or spawns the worker.
+    """
+
+    set_precision(precision)
+    set_threads(threads)
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def load_dataset(dataset: str, path: str) -> Data:
+    """
+    This function reads and parses a dataset of a cohort, keyed as in discover_cohorts, without processing it.
+    """
+
+    loader = (MODALITIES_LOADERS | ANNOTATIONS_LOADERS)[dataset]()
+    return loader.load(file_path=path)
+
+
+def run_cohort(cohort: str, paths: dict[str, str], **parameters) -> list[dict]:
+    """
+    This function runs the whole experiment on a single cohort: it loads its datasets and evaluates them with
+    evaluate_cohort. It is executed by the workers of the process pool.
+
+    Parameters
+    ----------
+    cohort : str
+        The TCGA code of the cohort.
+    paths : dict[str, str]
+        The paths of the datasets of the cohort, as returned by discover_cohorts.
+    **parameters
+        The parameters of the experiment, forwarded to evaluate_cohort.
+
+    Returns
+    -------
+    list[dict]
+        See evaluate_cohort.
+    """
+
+    start = time.perf_counter()
+    datasets = {dataset: load_dataset(dataset, path) for dataset, path in paths.items()}
+
+    return evaluate_cohort(cohort, datasets, load_seconds=time.perf_counter() - start, **parameters)
+
+
+def evaluate_cohort(cohort: str, datasets: dict[str, Data], retain_k: int = 100, K: int = 20, t: int = 20,
+                    clusters_n: int = 3, subtype_column: str = 'Subtype_Integrative',
+                    store_path: str | None = RESULTS_STORE_PATH, load_seconds: float = 0) -> list[dict]:
+    """
+    This function runs the experiment on the already loaded datasets of a single cohort.
+
+    Parameters
+    ----------
+    cohort : str
+        The TCGA code of the cohort.
+    datasets : dict[str, Data]
+        The loaded datasets of the cohort, keyed as in discover_cohorts, see load_dataset.
+    retain_k, K, t, clusters_n : int
+        The parameters of the experiment.
+    subtype_column : str
+        The column of the subtypes dataset to be used as ground truth. Patients without a subtype are discarded.
+    store_path : str, optional
+        The results store the metrics are appended to, see ResultsStore. None to skip recording them.
+    load_seconds : float
+        The seconds spent loading the datasets, recorded in the store with the run.
+
+    Returns
+    -------
+    list[dict]
+        One record for each evaluated method, with the cohort, the number of patients and the metrics.
+    """
+
+    start = time.perf_counter()
+
+    with logger.contextualize(data_type=cohort):
+        modalities = select_features([preprocess_modality(datasets[modality], pipeline=pipeline)
+                                      for modality, pipeline in zip(MODALITIES_LOADERS, get_modalities_pipelines())],
+                                     retain_k=retain_k)
+        phenotype_data = PhenotypePipeline()(data=datasets['phenotype'])
+        subtypes_data = SubTypesPipeline()(data=datasets['subtypes'])
+        subtypes_data = subtypes_data.__class__(subtypes_data[[subtype_column]].dropna())
+
+        *modalities, _, subtypes_data = align_datasets(modalities, phenotype_data, subtypes_data)
+        true_labels = get_true_labels(subtypes_data, subtype_column=subtype_column)
+
+        metrics = evaluate_experiment(modalities, true_labels, K=K, t=t, clusters_n=clusters_n)
+
+        if store_path is not None:
+            ResultsStore(store_path).append(metrics, cohort=cohort,
+                                            parameters={'retain_k': retain_k, 'K': K, 't': t, 'clusters_n': clusters_n,
+                                                        'subtype_column': subtype_column,
+                                                        'precision': get_precision()},
+                                            fingerprints={data.name: get_data_fingerprint(data) for data in modalities},
+                                            timings={'load': load_seconds,
+                                                     'cohort': load_seconds + time.perf_counter() - start})
+
+    return [{'cohort': cohort, 'patients_n': len(true_labels), 'method': m.label, **metrics_to_record(m)}
+            for m in metrics]
+
+
+def run_batch(data_path: str, output_path: str, max_workers: int | None = None, memory_limit: int | None = None,
+              **parameters) -> pd.DataFrame:
+    """
+    This function runs the experiment over every cohort found under the given directory, in a process pool, and writes
+    the metrics of all the cohorts in a single table.
+
+    Parameters
+    ----------
+    data_path : str
+        The root directory containing the cohorts datasets.
+    output_path : str
+        The path of the CSV file where the consolidated metrics are written.
+    max_workers : int, optional
+        The maximum number of cohorts processed concurrently. Default is one per thread of the budget, see
+        resources.split_threads.
+    memory_limit : int, optional
+        The maximum address space, in bytes, of each worker. Default is no limit.
+    **parameters
+        The parameters of the experiment, forwarded to run_cohort.
+
+    Returns
+    -------
+    pd.DataFrame
+        The consolidated metrics.
+    """
+
+    cohorts = discover_cohorts(data_path)
+    records = []
+
+    # Each worker runs a single cohort, so the memory it allocated is released to the system before the next one
+    workers_n, threads = split_threads(max_workers)
+    with ProcessPoolExecutor(max_workers=workers_n, max_tasks_per_child=1, initializer=limit_worker_memory,
+                             initargs=(memory_limit, get_precision(), threads)) as executor:
+        futures = {executor.submit(run_cohort, cohort, paths, **parameters): cohort
+                   for cohort, paths in cohorts.items()}
+
+        for future in as_completed(futures):
+            cohort = futures[future]
+            try:
+                records += future.result()
+                logger.info(f'Cohort {cohort} completed.')
+            except Exception as exception:
+                logger.error(f'Cohort {cohort} failed: {exception!r}')
+
+    results = pd.DataFrame(records, columns=['cohort', 'patients_n', 'method', 'rand_score', 'adjusted_rand_score',
+                                             'normalized_mutual_info_score', 'silhouette_score'])
+    results = results.sort_values(['cohort', 'method']).reset_index(drop=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    results.to_csv(output_path, index=False)
+    logger.info(f'Metrics of {results["cohort"].nunique()} cohorts saved to {output_path}.')
+
+    return results
+
+
+if __name__ == '__main__':
+    logger.remove()
+    logger.add(stdout, level='INFO', colorize=True,
+               format='<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[data_type]} | <level>{message}</level>')
+    logger.configure(extra={'data_type': 'None'})
+
+    parser = argparse.ArgumentParser(description='Run the experiment over all the TCGA cohorts on local disk.')
+    parser.add_argument('--data', type=str, default='../data')
+    parser.add_argument('--output', type=str, default='../results/pan_cancer_metrics.csv')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--memory-limit-gb', type=float, default=None)
+    parser.add_argument('--retain-k', type=int, default=100)
+    parser.add_argument('--K', type=int, default=20)
+    parser.add_argument('--t', type=int, default=20)
+    parser.add_argument('--clusters-n', type=int, default=3)
+    parser.add_argument('--subtype-column', type=str, default='Subtype_Integrative')
+    parser.add_argument('--precision', type=str, choices=list(PRECISIONS), default='float64')
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--store', type=str, default=RESULTS_STORE_PATH)
+    args = parser.parse_args()
+    set_precision(args.precision)
+    set_threads(args.threads)
+
+    run_batch(data_path=args.data, output_path=args.output, max_workers=args.workers,
+              memory_limit=int(args.memory_limit_gb * 1024 ** 3) if args.memory_limit_gb else None,
+              retain_k=args.retain_k, K=args.K, t=args.t, clusters_n=args.clusters_n,
+              subtype_column=args.subtype_column, store_path=args.store)
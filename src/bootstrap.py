@@ -0,0 +1,290 @@
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.preprocessing import MinMaxScaler
+from experiment import load_experiment, cluster_experiment, get_true_labels
+from resources import set_threads, split_threads
+from shared_matrices import SharedMatrix, SharedMatrixRegistry, attach
+from loguru import logger
+from sys import stdout
+import pandas as pd
+import numpy as np
+import argparse
+import os.path
+import os
+
+SCORES = ['rand_score', 'adjusted_rand_score', 'normalized_mutual_info_score', 'silhouette_score']
+
+_distances: np.ndarray | None = None
+
+
+def get_contingency_tables(true_codes: np.ndarray, predicted_codes: np.ndarray, classes_n: int,
+                           clusters_n: int) -> np.ndarray:
+    """
+    This function computes the contingency tables of many replicates at once, with a single np.bincount.
+
+    Parameters
+    ----------
+    true_codes, predicted_codes : np.ndarray
+        The (replicates, n) true and predicted labels of the samples of each replicate, encoded as integers from 0.
+    classes_n, clusters_n : int
+        The number of true and predicted labels.
+
+    Returns
+    -------
+    np.ndarray
+        The (replicates, classes_n, clusters_n) contingency tables.
+    """
+
+    replicates_n = len(predicted_codes)
+    cells_n = classes_n * clusters_n
+    cells = true_codes * clusters_n + predicted_codes + (np.arange(replicates_n) * cells_n)[:, np.newaxis]
+
+    return np.bincount(cells.ravel(), minlength=replicates_n * cells_n).reshape(replicates_n, classes_n, clusters_n)
+
+
+def get_label_scores(contingency: np.ndarray) -> dict[str, np.ndarray]:
+    """
+    This function computes the Rand, adjusted Rand and normalized mutual information scores from a stack of
+    contingency tables, with the same formulas and special cases as scikit-learn.
+
+    Parameters
+    ----------
+    contingency : np.ndarray
+        The (replicates, classes, clusters) contingency tables.
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        The scores of each replicate, keyed by the name of the Metrics field.
+    """
+
+    contingency = contingency.astype(np.int64)
+    n = contingency.sum(axis=(1, 2))
+    classes_sizes, clusters_sizes = contingency.sum(axis=2), contingency.sum(axis=1)
+
+    # Pair confusion matrix, as sklearn.metrics.cluster.pair_confusion_matrix
+    sum_squares = (contingency ** 2).sum(axis=(1, 2))
+    tp = sum_squares - n
+    fp = (clusters_sizes ** 2).sum(axis=1) - sum_squares
+    fn = (classes_sizes ** 2).sum(axis=1) - sum_squares
+    tn = n ** 2 - fp - fn - sum_squares
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        pairs_n = (n ** 2 - n).astype(float)
+        rand = np.where((tp + tn == pairs_n) | (pairs_n == 0), 1.0, (tp + tn) / pairs_n)
+
+        tp, fp, fn, tn = (x.astype(float) for x in (tp, fp, fn, tn))
+        adjusted_rand = np.where((fn == 0) & (fp == 0), 1.0,
+                                 2 * (tp * tn - fn * fp) / ((tp + fn) * (fn + tn) + (tp + fp) * (fp + tn)))
+
+        total = n[:, np.newaxis, np.newaxis].astype(float)
+        joint = contingency / total
+        marginals = (classes_sizes[:, :, np.newaxis] / total) * (clusters_sizes[:, np.newaxis, :] / total)
+        mutual_info = np.where(contingency > 0, joint * np.log(joint / marginals), 0).sum(axis=(1, 2))
+        mutual_info = np.clip(mutual_info, 0, None)
+
+        def entropy(sizes: np.ndarray) -> np.ndarray:
+            p = sizes / n[:, np.newaxis]
+            return -np.where(sizes > 0, p * np.log(p), 0).sum(axis=1)
+
+        normalized_mutual_info = mutual_info / ((entropy(classes_sizes) + entropy(clusters_sizes)) / 2)
+
+    normalized_mutual_info = np.where(mutual_info == 0, 0.0, normalized_mutual_info)
+    classes_n, clusters_n = (classes_sizes > 0).sum(axis=1), (clusters_sizes > 0).sum(axis=1)
+    normalized_mutual_info = np.where((classes_n == clusters_n) & (classes_n <= 1), 1.0, normalized_mutual_info)
+
+    return {'rand_score': rand, 'adjusted_rand_score': adjusted_rand,
+            'normalized_mutual_info_score': normalized_mutual_info}
+
+
+def get_silhouette(distances: np.ndarray, codes: np.ndarray, weights: np.ndarray | None = None) -> float:
+    """
+    This function computes the mean silhouette score of the given labels on a precomputed distance matrix, from the
+    sums of the distances of each sample to each cluster (a single matrix product).
+
+    With weights, each sample stands for as many copies of itself (e.g. a sample drawn several times by a bootstrap
+    replicate). The copies of a sample are left out of its own intra-cluster distance, otherwise their null distances
+    would bias the score upwards.
+
+    Returns NaN when the labels do not define between 2 and n - 1 clusters, where the score is undefined.
+    """
+
+    clusters, codes = np.unique(codes, return_inverse=True)
+    n = len(codes)
+    if not 2 <= len(clusters) <= n - 1:
+        return np.nan
+
+    weights = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+    membership = np.zeros((n, len(clusters)))
+    membership[np.arange(n), codes] = weights
+    sums = distances @ membership
+    sizes = membership.sum(axis=0)
+
+    others_sizes = sizes[codes] - weights
+    intra = sums[np.arange(n), codes] / np.maximum(others_sizes, 1)
+    means = sums / sizes
+    means[np.arange(n), codes] = np.inf
+    inter = means.min(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores = np.nan_to_num((inter - intra) / np.maximum(intra, inter))
+    scores[others_sizes == 0] = 0
+
+    return float((scores * weights).sum() / weights.sum())
+
+
+def _set_worker_distances(distances: SharedMatrix, threads: int):
+    global _distances
+    _distances = attach(distances)
+    set_threads(threads)
+
+
+def _get_silhouettes(samples: np.ndarray | None, codes: np.ndarray) -> np.ndarray:
+    # Executed by the workers: samples holds the resampled positions of each replicate, or None for permutations
+    if samples is None:
+        return np.array([get_silhouette(_distances, replicate_codes) for replicate_codes in codes])
+
+    silhouettes = []
+    for replicate in samples:
+        positions, weights = np.unique(replicate, return_counts=True)
+        silhouettes.append(get_silhouette(_distances[np.ix_(positions, positions)], codes[positions], weights=weights))
+
+    return np.array(silhouettes)
+
+
+def get_metrics_intervals(true_labels: pd.Series, predicted_labels: pd.Series, similarity_data: pd.DataFrame,
+                          replicates_n: int = 2000, permutations_n: int = 2000, confidence: float = 0.95,
+                          random_state: int = 0, max_workers: int | None = None,
+                          chunk_size: int = 250) -> pd.DataFrame:
+    """
+    This function computes bootstrap confidence intervals and permutation p-values for each field of Metrics.
+
+    Parameters
+    ----------
+    true_labels : pd.Series
+        The true labels of the data.
+    predicted_labels : pd.Series
+        The predicted labels of the data.
+    similarity_data : pd.DataFrame
+        The similarity data the silhouette score is computed on, as in get_metrics.
+    replicates_n : int
+        The number of bootstrap replicates, each resampling the patients with replacement.
+    permutations_n : int
+        The number of permutations of the predicted labels used for the p-values.
+    confidence : float
+        The confidence level of the percentile intervals.
+    random_state : int
+        The seed of the resampling.
+    max_workers : int, optional
+        The number of processes computing the silhouette replicates. Default is one per thread of the budget, see
+        resources.split_threads.
+    chunk_size : int
+        The number of replicates of each vectorized batch and of each task of the process pool.
+
+    Returns
+    -------
+    pd.DataFrame
+        For each score: the point estimate, the standard error and the confidence interval from the bootstrap
+        replicates, and the p-value of the null hypothesis that the predicted labels are unrelated to the true labels
+        (or, for the silhouette, to the similarity).
+
+    The function works as follows:
+    1. The label-only scores are computed from contingency tables, built for a whole chunk of replicates at once.
+    2. The silhouette is computed in a process pool, each worker attaching to the distance matrix published in shared
+       memory, over the resampled blocks of the distance matrix or, for the permutations, over permuted labels.
+    3. The intervals are the percentiles of the replicates; the p-values count the permutations scoring at least as
+       the observed labels.
+    """
+
+    true_labels = pd.Series(true_labels)
+    predicted_labels = pd.Series(predicted_labels).reindex(true_labels.index)
+    true_codes, classes = pd.factorize(true_labels)
+    predicted_codes, clusters = pd.factorize(predicted_labels)
+    n = len(true_codes)
+
+    normalized_similarity = MinMaxScaler().fit_transform(similarity_data.loc[true_labels.index, true_labels.index])
+    distances = 1 - normalized_similarity
+    np.fill_diagonal(distances, 0)
+
+    rng = np.random.default_rng(random_state)
+    samples = rng.integers(0, n, size=(replicates_n, n))
+    permutations = rng.permuted(np.tile(predicted_codes, (permutations_n, 1)), axis=1)
+
+    def label_scores(true: np.ndarray, predicted: np.ndarray) -> dict[str, np.ndarray]:
+        chunks = [get_label_scores(get_contingency_tables(true[start:start + chunk_size],
+                                                          predicted[start:start + chunk_size],
+                                                          classes_n=len(classes), clusters_n=len(clusters)))
+                  for start in range(0, len(predicted), chunk_size)]
+        return {score: np.concatenate([chunk[score] for chunk in chunks]) for score in chunks[0]}
+
+    observed = {score: value[0]
+                for score, value in label_scores(true_codes[np.newaxis, :], predicted_codes[np.newaxis, :]).items()}
+    observed['silhouette_score'] = get_silhouette(distances, predicted_codes)
+
+    bootstrap = label_scores(true_codes[samples], predicted_codes[samples])
+    null = label_scores(np.broadcast_to(true_codes, permutations.shape), permutations)
+
+    logger.debug(f'Computing {replicates_n} bootstrap and {permutations_n} permutation silhouettes...')
+    workers_n, threads = split_threads(max_workers)
+    with SharedMatrixRegistry() as registry:
+        shared_distances = registry.publish(distances)
+        with ProcessPoolExecutor(max_workers=workers_n, initializer=_set_worker_distances,
+                                 initargs=(shared_distances, threads)) as executor:
+            bootstrap_tasks = [executor.submit(_get_silhouettes, samples[start:start + chunk_size], predicted_codes)
+                               for start in range(0, replicates_n, chunk_size)]
+            null_tasks = [executor.submit(_get_silhouettes, None, permutations[start:start + chunk_size])
+                          for start in range(0, permutations_n, chunk_size)]
+            bootstrap['silhouette_score'] = np.concatenate([task.result() for task in bootstrap_tasks])
+            null['silhouette_score'] = np.concatenate([task.result() for task in null_tasks])
+
+    alpha = (1 - confidence) / 2
+    records = {}
+    for score in SCORES:
+        replicates = bootstrap[score][~np.isnan(bootstrap[score])]
+        null_replicates = null[score][~np.isnan(null[score])]
+        records[score] = {'value': observed[score],
+                          'standard_error': replicates.std(ddof=1),
+                          'ci_low': np.quantile(replicates, alpha),
+                          'ci_high': np.quantile(replicates, 1 - alpha),
+                          'p_value': (1 + (null_replicates >= observed[score]).sum()) / (1 + len(null_replicates)),
+                          'replicates_n': len(replicates)}
+
+    return pd.DataFrame.from_dict(records, orient='index')
+
+
+if __name__ == '__main__':
+    logger.remove()
+    logger.add(stdout, level='INFO', colorize=True,
+               format='<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[data_type]} | <level>{message}</level>')
+    logger.configure(extra={'data_type': 'None'})
+
+    parser = argparse.ArgumentParser(description='Compute bootstrap confidence intervals of the metrics of each method.')
+    parser.add_argument('--retain-k', type=int, default=100)
+    parser.add_argument('--K', type=int, default=20)
+    parser.add_argument('--t', type=int, default=20)
+    parser.add_argument('--clusters-n', type=int, default=3)
+    parser.add_argument('--replicates', type=int, default=2000)
+    parser.add_argument('--permutations', type=int, default=2000)
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--report', type=str, default='../results/metrics_intervals.csv')
+    args = parser.parse_args()
+    set_threads(args.threads)
+
+    proteins_data, mirna_data, mrna_data, _, subtypes_data = load_experiment(retain_k=args.retain_k)
+    true_labels = get_true_labels(subtypes_data)
+
+    intervals = []
+    for label, predicted_labels, similarity_matrix in cluster_experiment([proteins_data, mirna_data, mrna_data],
+                                                                         K=args.K, t=args.t,
+                                                                         clusters_n=args.clusters_n):
+        logger.info(f'Bootstrapping {label}...')
+        method_intervals = get_metrics_intervals(true_labels, predicted_labels, similarity_matrix,
+                                                 replicates_n=args.replicates, permutations_n=args.permutations,
+                                                 confidence=args.confidence, max_workers=args.workers)
+        intervals.append(method_intervals.rename_axis('score').reset_index().assign(label=label))
+
+    report = pd.concat(intervals, ignore_index=True)
+    os.makedirs(os.path.dirname(args.report), exist_ok=True)
+    report.to_csv(args.report, index=False)
+    print(report.to_string())
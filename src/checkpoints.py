@@ -0,0 +1,200 @@
+from datetime import datetime
+from models import Metrics
+from loguru import logger
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os.path
+import os
+
+ARTIFACTS_VERSION = 2
+
+
+def get_file_fingerprint(path: str, chunk_size: int = 1024 ** 2) -> str:
+    """
+    This function returns a hexadecimal digest of the content of the given file, read by chunks.
+    """
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+
+    return digest.hexdigest()[:16]
+
+
+class RunDirectory:
+    """
+    Directory holding the artifacts of the stages of a run, described by a manifest.
+
+    A stage is recorded in the manifest only once all its artifacts have been written, so a stage interrupted halfway
+    is seen as missing and computed again when the run is resumed. The manifest also records the configuration of the
+    run (parameters, engines and input fingerprints), so the stages depending on a changed value are computed again.
+    """
+
+    manifest_name = 'manifest.json'
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        self.manifest = self._read_manifest()
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.path, self.manifest_name)
+
+    def _read_manifest(self) -> dict:
+        if not os.path.isfile(self.manifest_path):
+            return {'version': ARTIFACTS_VERSION, 'stages': {}}
+
+        with open(self.manifest_path) as file:
+            manifest = json.load(file)
+
+        if manifest.get('version') != ARTIFACTS_VERSION:
+            logger.warning(f'Run {self.path} has artifacts version {manifest.get("version")}, expected '
+                           f'{ARTIFACTS_VERSION}: its stages will be computed again.')
+            return {'version': ARTIFACTS_VERSION, 'stages': {}}
+
+        return manifest
+
+    def _write_manifest(self):
+        buffer_path = f'{self.manifest_path}.tmp'
+        with open(buffer_path, 'w') as file:
+            json.dump(self.manifest, file, indent=2)
+        os.replace(buffer_path, self.manifest_path)
+
+    def _stage_path(self, stage: str) -> str:
+        path = os.path.join(self.path, stage)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def is_completed(self, stage: str) -> bool:
+        return stage in self.manifest['stages']
+
+    def first_missing_stage(self, stages: list[str]) -> str | None:
+        """
+        This method returns the first of the given stages (in order) that is not completed, or None if all of them are.
+        """
+
+        return next((stage for stage in stages if not self.is_completed(stage)), None)
+
+    def invalidate(self, stages: list[str]):
+        """
+        This method removes the given stages from the manifest, so they are computed again.
+        """
+
+        for stage in stages:
+            self.manifest['stages'].pop(stage, None)
+        self._write_manifest()
+
+    def update_configuration(self, configuration: dict, dependencies: dict[str, list[str]]) -> list[str]:
+        """
+        This method records the given configuration in the manifest, invalidating the stages built with a different
+        one.
+
+        Parameters
+        ----------
+        configuration : dict
+            The values the artifacts depend on, JSON serializable.
+        dependencies : dict[str, list[str]]
+            The stages of the run, in order, each with the keys of the configuration it depends on directly. A stage
+            also depends on the keys of the stages before it.
+
+        Returns
+        -------
+        list[str]
+            The stages invalidated: the first stage depending on a changed value and all the following ones. If the
+            manifest has completed stages but no configuration, all the stages are invalidated.
+        """
+
+        stages = list(dependencies)
+        previous = self.manifest.get('configuration')
+
+        if previous is None:
+            changed = set(configuration)
+            first = 0 if self.manifest['stages'] else len(stages)
+        else:
+            changed = {key for key in set(previous) | set(configuration) if previous.get(key) != configuration.get(key)}
+            first = next((i for i, stage in enumerate(stages) if changed & set(dependencies[stage])), len(stages))
+        invalidated = [stage for stage in stages[first:] if self.is_completed(stage)]
+        if invalidated:
+            logger.warning(f'Configuration of run {self.path} changed ({sorted(changed)}): stages {invalidated} will '
+                           f'be computed again.')
+
+        self.manifest['configuration'] = configuration
+        self.invalidate(stages[first:])
+
+        return invalidated
+
+    def _complete(self, stage: str, kind: str, names: list[str]):
+        self.manifest['stages'][stage] = {'kind': kind, 'names': names, 'completed_at': datetime.now().isoformat()}
+        self._write_manifest()
+        logger.debug(f'Stage {stage} saved to {self.path}.')
+
+    def save_frames(self, stage: str, frames: dict[str, pd.DataFrame]):
+        """
+        This method saves the given dataframes (e.g. the aligned datasets), preserving their dtypes.
+        """
+
+        path = self._stage_path(stage)
+        for name, frame in frames.items():
+            pd.DataFrame(frame).to_pickle(os.path.join(path, f'{name}.pkl'))
+        self._complete(stage, 'frames', list(frames))
+
+    def load_frames(self, stage: str) -> dict[str, pd.DataFrame]:
+        path = self._stage_path(stage)
+        return {name: pd.read_pickle(os.path.join(path, f'{name}.pkl'))
+                for name in self.manifest['stages'][stage]['names']}
+
+    def save_matrices(self, stage: str, matrices: dict[str, pd.DataFrame]):
+        """
+        This method saves the given square matrices (e.g. the similarity matrices) as .npy files, with their index
+        pickled in a separate file, so they can be memory-mapped when loaded.
+        """
+
+        path = self._stage_path(stage)
+        for name, matrix in matrices.items():
+            np.save(os.path.join(path, f'{name}.npy'), matrix.to_numpy())
+            pd.to_pickle(matrix.index, os.path.join(path, f'{name}.index.pkl'))
+        self._complete(stage, 'matrices', list(matrices))
+
+    def load_matrices(self, stage: str, mmap_mode: str | None = 'r') -> dict[str, pd.DataFrame]:
+        """
+        This method loads the matrices of the given stage. By default, they are memory-mapped read-only.
+        """
+
+        path = self._stage_path(stage)
+        matrices = {}
+
+        for name in self.manifest['stages'][stage]['names']:
+            index = pd.read_pickle(os.path.join(path, f'{name}.index.pkl'))
+            values = np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+            matrices[name] = pd.DataFrame(values, index=index, columns=index, copy=False)
+
+        return matrices
+
+    def save_labels(self, stage: str, labels: dict[str, pd.Series]):
+        """
+        This method saves the given cluster labels in a single CSV file, with one column per method.
+        """
+
+        pd.DataFrame(labels).to_csv(os.path.join(self._stage_path(stage), 'labels.csv'))
+        self._complete(stage, 'labels', list(labels))
+
+    def load_labels(self, stage: str) -> dict[str, pd.Series]:
+        labels = pd.read_csv(os.path.join(self._stage_path(stage), 'labels.csv'), index_col=0)
+        return {name: labels[name] for name in self.manifest['stages'][stage]['names']}
+
+    def save_metrics(self, stage: str, metrics: dict[str, Metrics]):
+        """
+        This method saves the given metrics as JSON.
+        """
+
+        with open(os.path.join(self._stage_path(stage), 'metrics.json'), 'w') as file:
+            json.dump({name: m.model_dump() for name, m in metrics.items()}, file, indent=2)
+        self._complete(stage, 'metrics', list(metrics))
+
+    def load_metrics(self, stage: str) -> dict[str, Metrics]:
+        with open(os.path.join(self._stage_path(stage), 'metrics.json')) as file:
+            return {name: Metrics.model_validate(m) for name, m in json.load(file).items()}
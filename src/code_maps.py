@@ -0,0 +1,122 @@
+from contextlib import contextmanager
+from settings import CACHE_PATH
+from loguru import logger
+import pandas as pd
+import numpy as np
+import os.path
+import fcntl
+import os
+
+
+class CodeMapIndex:
+    """
+    Index of the code maps of the categorical columns, kept in memory and persisted in the cache directory.
+
+    The code map of a column holds the categories seen so far in the order of their codes. The categories of the first
+    encoding are sorted, as LabelEncoder does, and the ones found later are appended, so a category keeps its code
+    across calls, datasets and runs, and new categories never require refitting the map.
+
+    The maps are only extended while holding an exclusive lock on the cache file, after reloading it, so processes
+    sharing the cache directory never assign the same code to different categories, and the maps held in memory are
+    always a prefix of the persisted ones.
+    """
+
+    def __init__(self, cache_path: str | None = CACHE_PATH):
+        self.cache_path = cache_path
+        self._maps: dict[str, pd.Index] | None = None
+
+    def _file_path(self) -> str:
+        return os.path.join(self.cache_path, 'code-maps.pkl')
+
+    def _load(self, reload: bool = False) -> dict[str, pd.Index]:
+        if self._maps is None or reload:
+            self._maps = {}
+            if self.cache_path is not None and os.path.isfile(self._file_path()):
+                logger.debug('Loading code maps from cache...')
+                self._maps = pd.read_pickle(self._file_path())
+
+        return self._maps
+
+    def _save(self):
+        if self.cache_path is None:
+            return
+
+        buffer_path = f'{self._file_path()}.{os.getpid()}.tmp'
+        pd.to_pickle(self._maps, buffer_path)
+        os.replace(buffer_path, self._file_path())
+
+    @contextmanager
+    def _lock(self):
+        if self.cache_path is None:
+            yield
+            return
+
+        os.makedirs(self.cache_path, exist_ok=True)
+        with open(f'{self._file_path()}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get(self, column: str) -> pd.Index | None:
+        """
+        This method returns the categories of the given column in the order of their codes, if it has been encoded
+        before.
+        """
+
+        return self._load().get(str(column))
+
+    def encode(self, column: str, values: pd.Series) -> np.ndarray:
+        """
+        This method encodes the given values of a categorical column with its code map, extending the map with the
+        categories it does not hold yet.
+
+        Parameters
+        ----------
+        column : str
+            The name of the column, which identifies its code map.
+        values : pd.Series
+            The values of the column.
+
+        Returns
+        -------
+        np.ndarray
+            The integer codes of the values, or float codes with NaN for the missing values if there are any.
+
+        The method works as follows:
+        1. The values are factorized into the positions of their sorted distinct categories, in a single pass.
+        2. The distinct categories are looked up in the code map. If some are missing, the lock is taken and the map is
+           reloaded, so the categories added by other processes keep their codes; the ones still missing are appended
+           to it, in sorted order, and persisted before the lock is released.
+        3. The codes are gathered from the positions of the categories in the code map.
+        """
+
+        objects = values.to_numpy(dtype=object)
+        try:
+            positions, categories = pd.factorize(objects, sort=True)
+        except TypeError:
+            positions, categories = pd.factorize(objects)
+
+        code_map = self._load().get(str(column), pd.Index([], dtype=object))
+        codes = code_map.get_indexer(categories)
+
+        if (codes < 0).any():
+            with self._lock():
+                code_map = self._load(reload=True).get(str(column), pd.Index([], dtype=object))
+                codes = code_map.get_indexer(categories)
+
+                new = codes < 0
+                if new.any():
+                    codes[new] = np.arange(len(code_map), len(code_map) + new.sum())
+                    self._maps[str(column)] = code_map.append(pd.Index(categories[new], dtype=object))
+                    self._save()
+                    logger.debug(f'{new.sum()} new categories added to the code map of {column}.')
+
+        if (positions < 0).any():
+            return np.where(positions < 0, np.nan, codes[positions])
+
+        return codes[positions].astype(np.int64)
+
+
+CODE_MAP_INDEX = CodeMapIndex()
@@ -1,9 +1,24 @@
 from loguru import logger
 from models import Data, PhenotypeData, mRNAData, miRNAData, ProteinsData, SubtypesData
+from barcodes import BARCODE_INDEX, PRIMARY_TUMOR
+from precision import get_float_dtype
+from settings import CACHE_PATH
+import importlib.util
 import pandas as pd
+import threading
 import os.path
+import queue
+import gzip
+import io
 import re
 
+STRING_DTYPE = 'string[pyarrow]' if importlib.util.find_spec('pyarrow') else 'string'
+
+# Suffix of the CSV files accepted by the loaders, plain or compressed
+CSV_SUFFIX_REGEX = r'\.csv(\.gz|\.zst)?$'
+
+COMPRESSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+
 
 class FileNotValidException(Exception):
     def __init__(self, message: str):
@@ -15,6 +30,122 @@ class EntryNotValidException(Exception):
         self.message = message
 
 
+def get_compression(file_path: str) -> str | None:
+    """
+    This function returns the compression of the given file from its extension, or None for plain files.
+    """
+
+    return COMPRESSIONS.get(os.path.splitext(file_path)[1])
+
+
+def open_decompressed(file_path: str) -> io.RawIOBase:
+    """
+    This function opens the given compressed file as a stream of decompressed bytes.
+    """
+
+    compression = get_compression(file_path)
+
+    if compression == 'gzip':
+        return gzip.open(file_path, 'rb')
+
+    if compression == 'zstd':
+        if not importlib.util.find_spec('zstandard'):
+            raise FileNotValidException(f'File {file_path} is zstd compressed, but zstandard is not installed.')
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True)
+
+    raise FileNotValidException(f'File {file_path} is not compressed.')
+
+
+class StreamingDecompressor(io.RawIOBase):
+    """
+    Readable stream of the decompressed content of a file, decompressed on a reader thread ahead of the consumer, so
+    decompression (which releases the GIL) overlaps with parsing. At most prefetch_n chunks are held in memory.
+    """
+
+    def __init__(self, file_path: str, chunk_size: int = 1 << 20, prefetch_n: int = 8):
+        super().__init__()
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+        self._chunks: queue.Queue = queue.Queue(maxsize=prefetch_n)
+        self._stop = threading.Event()
+        self._buffer = memoryview(b'')
+        self._eof = False
+        self._thread = threading.Thread(target=self._read, name=f'reader-{os.path.basename(file_path)}', daemon=True)
+        self._thread.start()
+
+    def _put(self, item: bytes | BaseException):
+        while not self._stop.is_set():
+            try:
+                self._chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _read(self):
+        try:
+            with open_decompressed(self.file_path) as stream:
+                while not self._stop.is_set():
+                    chunk = stream.read(self.chunk_size)
+                    self._put(chunk)
+                    if not chunk:
+                        return
+        except BaseException as exception:
+            self._put(exception)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            if self._eof:
+                return 0
+
+            chunk = self._chunks.get()
+            if isinstance(chunk, BaseException):
+                raise chunk
+            if not chunk:
+                self._eof = True
+                return 0
+            self._buffer = memoryview(chunk)
+
+        size = min(len(buffer), len(self._buffer))
+        buffer[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+        super().close()
+
+
+def open_csv(file_path: str) -> io.BufferedReader:
+    """
+    This function opens the given CSV file as a binary stream, decompressed on a reader thread if the file is
+    compressed (see CSV_SUFFIX_REGEX).
+    """
+
+    if get_compression(file_path) is None:
+        return open(file_path, 'rb')
+
+    return io.BufferedReader(StreamingDecompressor(file_path))
+
+
+def read_csv(file_path: str, **kwargs) -> pd.DataFrame:
+    """
+    This function reads the given CSV file, plain or compressed, with pd.read_csv and the given arguments.
+    """
+
+    if get_compression(file_path) is None:
+        return pd.read_csv(file_path, **kwargs)
+
+    with open_csv(file_path) as stream:
+        return pd.read_csv(stream, **kwargs)
+
+
 class DataLoader:
     filename_regex: str
     name: str
@@ -170,42 +301,107 @@ class DataLoader:
             The list of barcodes that correspond to primary tumors.
 
         The method works as follows:
-        1. It iterates over the given barcodes.
-        2. For each barcode, it checks if it corresponds to a primary tumor using the is_primary_tumor method.
-        3. It retains the barcodes that correspond to primary tumors in a list.
-        4. It returns the list of barcodes that correspond to primary tumors.
+        1. It parses all the given barcodes at once with the barcode index.
+        2. It retains the barcodes whose sample type is 01, which corresponds to a primary tumor.
+        3. It returns the list of barcodes that correspond to primary tumors.
         """
 
-        main_tumors = [barcode for barcode in barcodes if self.is_primary_tumor(barcode=barcode)]
+        barcodes = pd.Index(barcodes)
+        main_tumors = barcodes[BARCODE_INDEX.parse(barcodes)['sample_type'].to_numpy() == PRIMARY_TUMOR]
+
+        return list(main_tumors)
+
 
-        return main_tumors
+class PhenotypeSidecar:
+    """
+    The phenotype columns left out of the loaded schema. They are parsed from the CSV file only when first accessed,
+    and pickled in the cache so later runs do not parse them again.
+    """
+
+    def __init__(self, file_path: str, columns: list[str], index_column: str, cache_path: str = CACHE_PATH):
+        self.file_path = file_path
+        self.columns = columns
+        self.index_column = index_column
+        self.cache_path = os.path.join(cache_path, 'phenotype-sidecar')
+        self._data: pd.DataFrame | None = None
+
+    @property
+    def path(self) -> str:
+        stat = os.stat(self.file_path)
+        key = f'{os.path.basename(self.file_path)}-{stat.st_size}-{int(stat.st_mtime)}'
+        return os.path.join(self.cache_path, f'{key}.pkl')
+
+    def load(self) -> pd.DataFrame:
+        """
+        This method returns the sidecar columns, indexed by patient, as categoricals.
+        """
+
+        if self._data is not None:
+            return self._data
+
+        if os.path.isfile(self.path):
+            logger.debug(f'Loading phenotype sidecar from {self.path}...')
+            self._data = pd.read_pickle(self.path)
+            return self._data
+
+        logger.debug(f'Parsing {len(self.columns)} phenotype sidecar columns from {self.file_path}...')
+        # Converting after parsing is several times faster than parsing each column as a categorical
+        data = read_csv(self.file_path, sep=',', usecols=[self.index_column] + self.columns)
+        self._data = data.set_index(self.index_column).astype('category')
+        self._data.index = self._data.index.astype(STRING_DTYPE)
+
+        os.makedirs(self.cache_path, exist_ok=True)
+        self._data.to_pickle(self.path)
+
+        return self._data
+
+    def __getitem__(self, columns: str | list[str]) -> pd.DataFrame | pd.Series:
+        return self.load()[columns]
 
 
 class PhenotypeDataLoader(DataLoader):
-    filename_regex = r'.*mo_colData\.csv'
+    """
+    Loader of the clinical table. Only the columns of the schema are parsed, with the given dtypes: the other columns
+    are available, when a sidecar is requested, from the sidecar attribute after loading.
+    """
+
+    filename_regex = r'.*mo_colData' + CSV_SUFFIX_REGEX
     name = 'clinical'
+    index_column = 'patientID'
+    default_schema = {'patient.samples.sample.2.is_ffpe': 'category'}
+
+    def __init__(self, schema: dict[str, str] | None = None, sidecar: bool = False):
+        self.schema = self.default_schema if schema is None else schema
+        self.sidecar = sidecar
+        self.sidecar_data: PhenotypeSidecar | None = None
 
     def _load(self, file_path: str) -> PhenotypeData:
-        return PhenotypeData(pd.read_csv(file_path, sep=','))
+        dtypes = {self.index_column: STRING_DTYPE} | self.schema
+        data = read_csv(file_path, sep=',', usecols=list(dtypes), dtype=dtypes)
+
+        if self.sidecar:
+            header = read_csv(file_path, sep=',', nrows=0).columns
+            columns = [column for column in header[1:] if column not in dtypes]
+            self.sidecar_data = PhenotypeSidecar(file_path=file_path, columns=columns, index_column=self.index_column)
+
+        return PhenotypeData(data)
 
     def _sanitize(self, df: PhenotypeData) -> PhenotypeData:
-        buffer = df.copy(deep=True)
-        buffer = buffer.set_index('patientID')
+        buffer = df.set_index(self.index_column)
         buffer.index.name = 'ShortPatientID'
-        buffer = buffer.drop(columns=['Unnamed: 0'])
         return PhenotypeData(buffer)
 
 
 class miRNADataLoader(DataLoader):
-    filename_regex = r'.*miRNASeqGene.*'
+    filename_regex = r'.*miRNASeqGene.*' + CSV_SUFFIX_REGEX
     name = 'miRNA'
 
     def _load(self, file_path: str) -> miRNAData:
-        raw = pd.read_csv(file_path, sep=',')
+        raw = read_csv(file_path, sep=',')
         raw.columns = ['ShortPatientID'] + list(raw.columns[1:])
         raw = raw.set_index('ShortPatientID')
 
-        transposed = raw.transpose()
+        transposed = raw.transpose().astype(get_float_dtype(), copy=False)
         return miRNAData(transposed)
 
     def _sanitize(self, df: miRNAData) -> miRNAData:
@@ -213,15 +409,15 @@ class miRNADataLoader(DataLoader):
 
 
 class mRNADataLoader(DataLoader):
-    filename_regex = r'.*RNASeq2Gene.*'
+    filename_regex = r'.*RNASeq2Gene.*' + CSV_SUFFIX_REGEX
     name = 'mRNA'
 
     def _load(self, file_path: str) -> mRNAData:
-        raw = pd.read_csv(file_path, sep=',')
+        raw = read_csv(file_path, sep=',')
         raw.columns = ['ShortPatientID'] + list(raw.columns[1:])
         raw = raw.set_index('ShortPatientID')
 
-        transposed = raw.transpose()
+        transposed = raw.transpose().astype(get_float_dtype(), copy=False)
         return mRNAData(transposed)
 
     def _sanitize(self, df: mRNAData) -> mRNAData:
@@ -229,15 +425,15 @@ class mRNADataLoader(DataLoader):
 
 
 class ProteinsDataLoader(DataLoader):
-    filename_regex = '.*RPPAArray.*'
+    filename_regex = '.*RPPAArray.*' + CSV_SUFFIX_REGEX
     name = 'protein'
 
     def _load(self, file_path) -> ProteinsData:
-        raw = pd.read_csv(file_path, sep=',')
+        raw = read_csv(file_path, sep=',')
         raw.columns = ['ShortPatientID'] + list(raw.columns[1:])
         raw = raw.set_index('ShortPatientID')
 
-        transposed = raw.transpose()
+        transposed = raw.transpose().astype(get_float_dtype(), copy=False)
         return ProteinsData(transposed)
 
     def _sanitize(self, df: ProteinsData) -> ProteinsData:
@@ -245,11 +441,11 @@ class ProteinsDataLoader(DataLoader):
 
 
 class SubtypesDataLoader(DataLoader):
-    filename_regex = 'subtypes.csv'
+    filename_regex = 'subtypes' + CSV_SUFFIX_REGEX
     name = 'subtypes'
 
     def _load(self, file_path) -> SubtypesData:
-        raw = pd.read_csv(file_path, sep=',')
+        raw = read_csv(file_path, sep=',')
         raw.columns = ['ShortPatientID'] + list(raw.columns[1:])
         raw = raw.set_index('ShortPatientID')
 
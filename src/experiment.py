@@ -0,0 +1,317 @@
+from pipelines import (PhenotypePipeline, MultiDataframesPipeline, miRNAPipeline, mRNAPipeline, ProteinsPipeline,
+                       SubTypesPipeline, ExperimentPipeline, Pipeline)
+from pipeline_steps import (RetainMainTumors, FilterByNanPercentage, ImputeKNN, ComputeFeatureStatistics,
+                            FilterByVariance, TruncateBarcode, EncodeCategoricalData, SimilarityMatrices,
+                            ComputeKMedoids, ComputeMatricesAverage, ComputeSNF, ComputeSpectralClustering)
+from data_loaders import (ProteinsDataLoader, miRNADataLoader, mRNADataLoader, PhenotypeDataLoader,
+                          SubtypesDataLoader, DataLoader)
+from settings import PROTEINS_PATH, MIRNA_PATH, MRNA_PATH, PHENOTYPE_PATH, SUBTYPES_PATH
+from models import Data, PhenotypeData, SubtypesData, Metrics
+from analysis import get_metrics
+import pandas as pd
+
+
+def get_data(dataset_path: str, loader: DataLoader, pipeline: Pipeline) -> Data:
+    """
+    This function loads the dataset at the given path and runs the given pipeline on it.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The path of the dataset to be loaded.
+    loader : DataLoader
+        The loader to be used to load the dataset.
+    pipeline : Pipeline
+        The pipeline to be run on the loaded dataset.
+
+    Returns
+    -------
+    Data
+        The processed dataset.
+    """
+
+    data = loader.load(file_path=dataset_path)
+    data = pipeline(data=data)
+    return data
+
+
+def get_modalities_pipelines() -> list[ExperimentPipeline]:
+    """
+    This function returns a pipeline for each omics modality, in the order proteins, miRNA, mRNA.
+    """
+
+    return [ProteinsPipeline(), miRNAPipeline(), mRNAPipeline()]
+
+
+def load_modalities(proteins_path: str = PROTEINS_PATH,
+                    mirna_path: str = MIRNA_PATH,
+                    mrna_path: str = MRNA_PATH,
+                    imputation_threshold: float | None = None) -> list[Data]:
+    """
+    This function loads the omics modalities and runs the part of the experiment pipeline that does not depend on the
+    number of retained features.
+
+    Parameters
+    ----------
+    proteins_path : str
+        The path of the proteins dataset.
+    mirna_path : str
+        The path of the miRNA dataset.
+    mrna_path : str
+        The path of the mRNA dataset.
+    imputation_threshold : float, optional
+        The maximum NaN percentage of the features kept and imputed with ImputeKNN. Default is None: the features
+        with any NaN are dropped.
+
+    Returns
+    -------
+    list[Data]
+        The proteins, miRNA and mRNA data, with their feature statistics indexed.
+    """
+
+    loaders = [ProteinsDataLoader(), miRNADataLoader(), mRNADataLoader()]
+
+    return [preprocess_modality(loader.load(file_path=path), pipeline=pipeline,
+                                imputation_threshold=imputation_threshold)
+            for path, loader, pipeline in zip([proteins_path, mirna_path, mrna_path], loaders,
+                                              get_modalities_pipelines())]
+
+
+def preprocess_modality(data: Data, pipeline: ExperimentPipeline, imputation_threshold: float | None = None) -> Data:
+    """
+    This function runs on an already loaded modality the part of the experiment pipeline that does not depend on the
+    number of retained features.
+
+    Parameters
+    ----------
+    data : Data
+        The loaded modality.
+    pipeline : ExperimentPipeline
+        The pipeline of the modality, see get_modalities_pipelines.
+    imputation_threshold : float, optional
+        See load_modalities.
+
+    Returns
+    -------
+    Data
+        The modality, with its feature statistics indexed.
+    """
+
+    if imputation_threshold is None:
+        pipeline.steps = [RetainMainTumors(), FilterByNanPercentage(), ComputeFeatureStatistics()]
+    else:
+        pipeline.steps = [RetainMainTumors(), FilterByNanPercentage(threshold=imputation_threshold), ImputeKNN(),
+                          ComputeFeatureStatistics()]
+
+    return pipeline(data=data)
+
+
+def load_annotations(phenotype_path: str = PHENOTYPE_PATH,
+                     subtypes_path: str = SUBTYPES_PATH) -> tuple[PhenotypeData, SubtypesData]:
+    """
+    This function loads the phenotype and the subtypes datasets.
+
+    Parameters
+    ----------
+    phenotype_path : str
+        The path of the phenotype dataset.
+    subtypes_path : str
+        The path of the subtypes dataset.
+
+    Returns
+    -------
+    tuple[PhenotypeData, SubtypesData]
+        The phenotype and the subtypes data.
+    """
+
+    phenotype_data = get_data(dataset_path=phenotype_path, loader=PhenotypeDataLoader(), pipeline=PhenotypePipeline())
+    subtypes_data = get_data(dataset_path=subtypes_path, loader=SubtypesDataLoader(), pipeline=SubTypesPipeline())
+
+    return phenotype_data, subtypes_data
+
+
+def select_features(modalities: list[Data], retain_k: int = 100) -> list[Data]:
+    """
+    This function runs the part of the experiment pipeline that depends on the number of retained features.
+
+    Parameters
+    ----------
+    modalities : list[Data]
+        The proteins, miRNA and mRNA data, as returned by load_modalities.
+    retain_k : int
+        The number of features to be retained for each modality.
+
+    Returns
+    -------
+    list[Data]
+        The proteins, miRNA and mRNA data with the top retain_k features only.
+    """
+
+    selected = []
+
+    for data, pipeline in zip(modalities, get_modalities_pipelines()):
+        pipeline.steps = [FilterByVariance(retain_k=retain_k), TruncateBarcode()]
+        selected.append(pipeline(data=data))
+
+    return selected
+
+
+def align_datasets(modalities: list[Data], phenotype_data: PhenotypeData,
+                   subtypes_data: SubtypesData) -> tuple[Data, Data, Data, PhenotypeData, SubtypesData]:
+    """
+    This function restricts all the datasets to the patients they have in common, sorted by patient ID.
+
+    Returns
+    -------
+    tuple[Data, Data, Data, PhenotypeData, SubtypesData]
+        The aligned proteins, miRNA, mRNA, phenotype and subtypes data.
+    """
+
+    return tuple(MultiDataframesPipeline()(data=[*modalities, phenotype_data, subtypes_data]))
+
+
+def get_true_labels(subtypes_data: SubtypesData, subtype_column: str = 'Subtype_Integrative') -> pd.Series:
+    """
+    This function returns the encoded subtypes, to be used as ground truth for the clustering metrics.
+    """
+
+    return EncodeCategoricalData()(data=subtypes_data)[subtype_column]
+
+
+def load_experiment(proteins_path: str = PROTEINS_PATH,
+                    mirna_path: str = MIRNA_PATH,
+                    mrna_path: str = MRNA_PATH,
+                    phenotype_path: str = PHENOTYPE_PATH,
+                    subtypes_path: str = SUBTYPES_PATH,
+                    retain_k: int = 100) -> tuple[Data, Data, Data, PhenotypeData, SubtypesData]:
+    """
+    This function loads, preprocesses and aligns all the datasets of an experiment.
+
+    Returns
+    -------
+    tuple[Data, Data, Data, PhenotypeData, SubtypesData]
+        The aligned proteins, miRNA, mRNA, phenotype and subtypes data.
+    """
+
+    modalities = select_features(load_modalities(proteins_path=proteins_path, mirna_path=mirna_path,
+                                                 mrna_path=mrna_path),
+                                 retain_k=retain_k)
+    phenotype_data, subtypes_data = load_annotations(phenotype_path=phenotype_path, subtypes_path=subtypes_path)
+
+    return align_datasets(modalities, phenotype_data, subtypes_data)
+
+
+def cluster_experiment(modalities: list[Data], K: int = 20, t: int = 20, clusters_n: int = 3,
+                       similarity_step: SimilarityMatrices | None = None,
+                       snf_step: ComputeSNF | None = None) -> list[tuple[str, pd.Series, pd.DataFrame]]:
+    """
+    This function runs the similarity, integration and clustering steps on the given aligned modalities.
+
+    Parameters
+    ----------
+    modalities : list[Data]
+        The aligned proteins, miRNA and mRNA data.
+    K : int
+        The number of neighbors used by the similarity matrices and by SNF.
+    t : int
+        The number of SNF iterations.
+    clusters_n : int
+        The number of clusters to be detected.
+    similarity_step : SimilarityMatrices | None
+        The step computing the similarity matrices, e.g. with the approximate backend. By default, the exact
+        similarity matrices with K neighbors.
+    snf_step : ComputeSNF | None
+        The step fusing the similarity matrices, e.g. with the low-rank fusion. By default, the exact SNF with K
+        neighbors and t iterations.
+
+    Returns
+    -------
+    list[tuple[str, pd.Series, pd.DataFrame]]
+        For each modality, for the average and SNF integrations clustered with KMedoids, and for the SNF integration
+        clustered with spectral clustering: the metrics label, the predicted labels and the clustered similarity matrix.
+    """
+
+    similarity_step = similarity_step or SimilarityMatrices(K=K, K_max=max(K, 50))
+    similarity_matrices = similarity_step(data=modalities)
+    snf_step = snf_step or ComputeSNF(K=K, t=t)
+    fused = snf_step(data=similarity_matrices)
+
+    return cluster_similarity_matrices([data.name for data in modalities], similarity_matrices, fused,
+                                       clusters_n=clusters_n)
+
+
+def cluster_similarity_matrices(names: list[str], similarity_matrices: list[pd.DataFrame], fused: pd.DataFrame,
+                                clusters_n: int = 3) -> list[tuple[str, pd.Series, pd.DataFrame]]:
+    """
+    This function runs the clustering steps of cluster_experiment on already computed similarity matrices, so the
+    callers computing them differently (e.g. the grid search, which shares them across the combinations) evaluate the
+    same methods.
+
+    Parameters
+    ----------
+    names : list[str]
+        The names of the modalities, used in the metrics labels.
+    similarity_matrices : list[pd.DataFrame]
+        The similarity matrix of each modality.
+    fused : pd.DataFrame
+        The SNF integration of the similarity matrices.
+    clusters_n : int
+        The number of clusters to be detected.
+
+    Returns
+    -------
+    list[tuple[str, pd.Series, pd.DataFrame]]
+        See cluster_experiment.
+    """
+
+    average = ComputeMatricesAverage()(data=similarity_matrices)
+
+    evaluations = [(f'{name} prediction metrics', ComputeKMedoids(), similarity_matrix)
+                   for name, similarity_matrix in zip(names, similarity_matrices)]
+    evaluations += [('Average prediction metrics', ComputeKMedoids(), average),
+                    ('SNF prediction metrics', ComputeKMedoids(), fused),
+                    ('Spectral prediction metrics', ComputeSpectralClustering(), fused)]
+
+    return [(label, step(data=similarity_matrix, clusters_n=clusters_n), similarity_matrix)
+            for label, step, similarity_matrix in evaluations]
+
+
+def evaluate_experiment(modalities: list[Data], true_labels: pd.Series, K: int = 20, t: int = 20,
+                        clusters_n: int = 3, similarity_step: SimilarityMatrices | None = None,
+                        snf_step: ComputeSNF | None = None) -> list[Metrics]:
+    """
+    This function clusters the given aligned modalities with cluster_experiment and computes the metrics of each
+    method against the true labels.
+
+    Parameters
+    ----------
+    modalities : list[Data]
+        The aligned proteins, miRNA and mRNA data.
+    true_labels : pd.Series
+        The encoded true subtypes, aligned with the modalities.
+    K, t, clusters_n, similarity_step, snf_step
+        See cluster_experiment.
+
+    Returns
+    -------
+    list[Metrics]
+        The metrics of the clustering of each modality, of the average and SNF integrations clustered with KMedoids, and
+        of the SNF integration clustered with spectral clustering.
+    """
+
+    clusterings = cluster_experiment(modalities, K=K, t=t, clusters_n=clusters_n, similarity_step=similarity_step,
+                                     snf_step=snf_step)
+
+    return evaluate_clusterings(clusterings, true_labels)
+
+
+def evaluate_clusterings(clusterings: list[tuple[str, pd.Series, pd.DataFrame]],
+                         true_labels: pd.Series) -> list[Metrics]:
+    """
+    This function computes the metrics of each of the given clusterings, as returned by cluster_experiment, against
+    the true labels.
+    """
+
+    return [get_metrics(true_labels=true_labels, predicted_labels=predicted_labels, similarity_data=similarity_matrix,
+                        metrics_label=label)
+            for label, predicted_labels, similarity_matrix in clusterings]
@@ -0,0 +1,253 @@
+from settings import CACHE_PATH, FEATURE_STATISTICS_CACHE_SIZE
+from loguru import logger
+import pandas as pd
+import numpy as np
+import hashlib
+import warnings
+import weakref
+import os.path
+import os
+
+FEATURE_STATISTICS_COLUMNS = ['mean', 'variance', 'mad', 'nan_count', 'nan_fraction', 'q25', 'median', 'q75',
+                              'zero_fraction', 'min', 'max']
+
+
+class FeatureStatistics:
+    """
+    The statistics of a modality: the per-feature moments, quantiles, NaN counts, extremes and fraction of zeros, and
+    the NaN count of each sample. They are computed in a single pass and shared by the NaN filter, the feature
+    selectors and the data-quality plots.
+    """
+
+    def __init__(self, features: pd.DataFrame, sample_nan_count: pd.Series):
+        self.features = features
+        self.sample_nan_count = sample_nan_count
+
+    @property
+    def sample_nan_fraction(self) -> pd.Series:
+        return self.sample_nan_count / max(len(self.features), 1)
+
+    @property
+    def features_with_nans_n(self) -> int:
+        return int((self.features['nan_count'] > 0).sum())
+
+    def select(self, data: pd.DataFrame, columns: pd.Index) -> 'FeatureStatistics':
+        """
+        This method returns the statistics of the given columns of the dataframe the statistics were computed on.
+
+        The per-feature statistics are sliced, while the NaN counts of the samples are decreased by the NaNs in the
+        discarded columns, so only those are scanned.
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            The dataframe the statistics were computed on.
+        columns : pd.Index
+            The columns to retain.
+
+        Returns
+        -------
+        FeatureStatistics
+            The statistics of data[columns].
+        """
+
+        dropped = data.columns.difference(columns, sort=False)
+        sample_nan_count = self.sample_nan_count - data[dropped].isna().sum(axis=1) if len(dropped) else \
+            self.sample_nan_count
+
+        return FeatureStatistics(features=self.features.loc[columns], sample_nan_count=sample_nan_count)
+
+
+def get_data_fingerprint(data: pd.DataFrame) -> str:
+    """
+    This function computes a fingerprint of the given dataframe, based on its labels and its values.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The dataframe to fingerprint.
+
+    Returns
+    -------
+    str
+        A hexadecimal digest identifying the content of the dataframe.
+    """
+
+    digest = hashlib.sha1()
+    digest.update(str(data.shape).encode())
+    digest.update('\x1f'.join(map(str, data.columns)).encode())
+    digest.update('\x1f'.join(map(str, data.index)).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+
+    return digest.hexdigest()[:16]
+
+
+def compute_feature_statistics(data: pd.DataFrame) -> FeatureStatistics:
+    """
+    This function computes the statistics of the given (numerical) dataframe in a single vectorized pass.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The dataframe to analyze. All the columns are expected to be numerical.
+
+    Returns
+    -------
+    FeatureStatistics
+        The statistics of the dataframe, with one per-feature column for each statistic in FEATURE_STATISTICS_COLUMNS.
+
+    The function works as follows:
+    1. It converts the dataframe to a float matrix, with samples on the rows and features on the columns, and computes
+       its NaN mask once.
+    2. It sums the mask along both axes to get the NaN counts per feature and per sample.
+    3. It computes mean, variance (ddof=1), quartiles, extremes and fraction of zeros ignoring the NaNs; the quartiles
+       of the complete features are computed without the slower NaN-aware quantile.
+    4. It computes the median absolute deviation from the median of each feature.
+    5. The statistics are collected in a FeatureStatistics and returned.
+    """
+
+    values = data.to_numpy(dtype=float)
+    mask = np.isnan(values)
+    n, p = values.shape
+
+    nan_count = mask.sum(axis=0)
+    complete, partial = nan_count == 0, (nan_count > 0) & (nan_count < n)
+    quartiles, mad = np.full((3, p), np.nan), np.full(p, np.nan)
+
+    if n and complete.any():
+        quartiles[:, complete] = np.quantile(values[:, complete], [0.25, 0.5, 0.75], axis=0)
+        mad[complete] = np.median(np.abs(values[:, complete] - quartiles[1, complete]), axis=0)
+    if n and partial.any():
+        quartiles[:, partial] = np.nanquantile(values[:, partial], [0.25, 0.5, 0.75], axis=0)
+        mad[partial] = np.nanmedian(np.abs(values[:, partial] - quartiles[1, partial]), axis=0)
+
+    with warnings.catch_warnings(), np.errstate(invalid='ignore', divide='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(values, axis=0) if n else np.full(p, np.nan)
+        variance = np.nanvar(values, axis=0, ddof=1) if n > 1 else np.full(p, np.nan)
+        zero_fraction = (values == 0).sum(axis=0) / (n - nan_count)
+
+    minimum = np.where(mask, np.inf, values).min(axis=0, initial=np.inf)
+    maximum = np.where(mask, -np.inf, values).max(axis=0, initial=-np.inf)
+    minimum[nan_count == n] = maximum[nan_count == n] = np.nan
+
+    features = pd.DataFrame({'mean': mean,
+                             'variance': variance,
+                             'mad': mad,
+                             'nan_count': nan_count,
+                             'nan_fraction': nan_count / n if n else 0.0,
+                             'q25': quartiles[0],
+                             'median': quartiles[1],
+                             'q75': quartiles[2],
+                             'zero_fraction': zero_fraction,
+                             'min': minimum,
+                             'max': maximum},
+                            index=data.columns,
+                            columns=FEATURE_STATISTICS_COLUMNS)
+
+    return FeatureStatistics(features=features, sample_nan_count=pd.Series(mask.sum(axis=1), index=data.index))
+
+
+class FeatureStatisticsIndex:
+    """
+    Index of the statistics of each modality, kept in memory and persisted in the cache directory.
+
+    In memory, the statistics are keyed by the identity of the dataframe they were computed on and released with it,
+    so the NaN filter, the selectors and the plots receiving the same dataframe reuse them without scanning it again; a
+    dataframe must not be modified in place once indexed. The fingerprint of the dataframe is only computed to look
+    up and store the statistics in the cache directory, which keeps the max_files most recently used ones.
+    """
+
+    def __init__(self, cache_path: str | None = CACHE_PATH, max_files: int = FEATURE_STATISTICS_CACHE_SIZE):
+        self.cache_path = cache_path
+        self.max_files = max_files
+        self._statistics: dict[int, tuple[weakref.ref, str | None, FeatureStatistics | None]] = {}
+
+    def _file_path(self, key: str) -> str:
+        return os.path.join(self.cache_path, 'statistics', f'{key}.pkl')
+
+    @staticmethod
+    def get_key(data: pd.DataFrame) -> str:
+        return f'{getattr(data, "name", data.__class__.__name__)}-{get_data_fingerprint(data)}'
+
+    def _entry(self, data: pd.DataFrame) -> tuple[str | None, FeatureStatistics | None]:
+        reference, key, statistics = self._statistics.get(id(data), (None, None, None))
+        if reference is not None and reference() is data:
+            return key, statistics
+
+        return None, None
+
+    def _store(self, data: pd.DataFrame, key: str | None, statistics: FeatureStatistics | None):
+        identity = id(data)
+        self._statistics[identity] = (weakref.ref(data, lambda _: self._statistics.pop(identity, None)), key,
+                                      statistics)
+
+    def _evict(self):
+        directory = os.path.dirname(self._file_path(''))
+        paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.pkl')]
+
+        for path in sorted(paths, key=os.path.getmtime)[:max(len(paths) - self.max_files, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            logger.debug(f'Feature statistics {os.path.basename(path)} evicted from cache.')
+
+    def get(self, data: pd.DataFrame) -> FeatureStatistics | None:
+        """
+        This method returns the statistics of the given dataframe, if they have been indexed before.
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            The dataframe whose statistics are requested.
+
+        Returns
+        -------
+        FeatureStatistics | None
+            The statistics of the dataframe, or None if they are neither in memory nor in the cache directory.
+        """
+
+        key, statistics = self._entry(data)
+        if statistics is not None or self.cache_path is None:
+            return statistics
+
+        key = key or self.get_key(data)
+        if os.path.isfile(self._file_path(key)):
+            logger.debug(f'Loading feature statistics {key} from cache...')
+            statistics = pd.read_pickle(self._file_path(key))
+            os.utime(self._file_path(key))
+
+        self._store(data, key, statistics)
+
+        return statistics
+
+    def put(self, data: pd.DataFrame, statistics: FeatureStatistics, persist: bool = True):
+        """
+        This method indexes the statistics of the given dataframe, persisting them in the cache directory unless
+        persist is False (e.g. for statistics derived from the ones of another dataframe, which are cheap to derive
+        again).
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            The dataframe the statistics were computed on.
+        statistics : FeatureStatistics
+            The statistics to index.
+        persist : bool
+            Whether to persist the statistics in the cache directory.
+        """
+
+        key, _ = self._entry(data)
+
+        if self.cache_path is not None and persist:
+            key = key or self.get_key(data)
+            os.makedirs(os.path.dirname(self._file_path(key)), exist_ok=True)
+            pd.to_pickle(statistics, self._file_path(key))
+            logger.debug(f'Feature statistics {key} saved to cache.')
+            self._evict()
+
+        self._store(data, key, statistics)
+
+
+FEATURE_STATISTICS_INDEX = FeatureStatisticsIndex()
@@ -0,0 +1,218 @@
+from experiment import (load_modalities, load_annotations, select_features, align_datasets, get_true_labels,
+                        cluster_similarity_matrices, evaluate_clusterings)
+from pipeline_steps import SimilarityMatrices, ComputeSNF
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait
+from analysis import metrics_to_record
+from itertools import product
+from precision import PRECISIONS, set_precision, get_precision
+from resources import set_threads, split_threads
+from shared_matrices import SharedMatrix, SharedMatrixRegistry, attach, detach
+from loguru import logger
+from sys import stdout
+import pandas as pd
+import argparse
+import os.path
+import os
+
+GRID_PARAMETERS = ['retain_k', 'K', 't', 'clusters_n']
+
+
+def load_completed_combinations(results_path: str) -> set[tuple]:
+    """
+    This function returns the parameters combinations already stored in the given results file.
+
+    Parameters
+    ----------
+    results_path : str
+        The path of the results file. It may not exist yet.
+
+    Returns
+    -------
+    set[tuple]
+        The completed combinations, as tuples of values ordered as GRID_PARAMETERS.
+    """
+
+    if not os.path.isfile(results_path):
+        return set()
+
+    results = pd.read_csv(results_path, usecols=GRID_PARAMETERS)
+
+    return set(results.itertuples(index=False, name=None))
+
+
+def append_results(records: list[dict], results_path: str):
+    """
+    This function appends the given records to the results file, writing the header if the file is new.
+    """
+
+    header = not os.path.isfile(results_path)
+    pd.DataFrame(records).to_csv(results_path, mode='a', header=header, index=False)
+
+
+def evaluate_fusion(similarity_matrices: list[SharedMatrix | pd.DataFrame], names: list[str], true_labels: pd.Series,
+                    retain_k: int, K: int, t: int, clusters_n_values: list[int]) -> list[dict]:
+    """
+    This function fuses the given similarity matrices with SNF and, for each number of clusters, evaluates the same
+    methods as experiment.evaluate_experiment: each modality, the average and SNF integrations clustered with
+    KMedoids, and the SNF integration clustered with spectral clustering. It is executed by the workers of the
+    process pool.
+
+    Parameters
+    ----------
+    similarity_matrices : list[SharedMatrix | pd.DataFrame]
+        The similarity matrices of the modalities, computed with the given K, or their handles in shared memory.
+    names : list[str]
+        The names of the modalities, used in the method labels.
+    true_labels : pd.Series
+        The encoded true subtypes.
+    retain_k, K, t : int
+        The parameters of the combination.
+    clusters_n_values : list[int]
+        The numbers of clusters to evaluate on the fused matrix.
+
+    Returns
+    -------
+    list[dict]
+        One record for each number of clusters and method, with the parameters and the metrics.
+    """
+
+    attached = [attach(matrix) for matrix in similarity_matrices]
+    fused = ComputeSNF(K=K, t=t)(data=attached)
+    records = []
+
+    for clusters_n in clusters_n_values:
+        metrics = evaluate_clusterings(cluster_similarity_matrices(names, attached, fused, clusters_n=clusters_n),
+                                       true_labels)
+        records += [{'retain_k': retain_k, 'K': K, 't': t, 'clusters_n': clusters_n, 'method': m.label,
+                     **metrics_to_record(m)} for m in metrics]
+
+    # The baselines cluster the attached matrices, so the segments are closed only once all the methods are evaluated
+    del attached
+    for matrix in similarity_matrices:
+        detach(matrix)
+
+    return records
+
+
+def init_worker(precision: str, threads: int):
+    """
+    This function sets the precision and the thread budget of a worker of the process pool.
+    """
+
+    set_precision(precision)
+    set_threads(threads)
+
+
+def run_grid_search(grid: dict[str, list[int]], results_path: str, max_workers: int | None = None) -> pd.DataFrame:
+    """
+    This function evaluates every combination of the given parameters grid, streaming the results to a CSV file.
+
+    Parameters
+    ----------
+    grid : dict[str, list[int]]
+        The values to be explored for each of the parameters in GRID_PARAMETERS.
+    results_path : str
+        The path of the CSV results file. Combinations already stored in it are skipped, so an interrupted search can
+        be resumed by running it again with the same file.
+    max_workers : int, optional
+        The number of worker processes. Default is one per thread of the budget, see resources.split_threads.
+
+    Returns
+    -------
+    pd.DataFrame
+        The content of the results file.
+
+    The function works as follows:
+    1. It loads the datasets and runs the part of the preprocessing that does not depend on any parameter once.
+    2. For each retain_k, it selects the features, aligns the datasets and computes the distance matrices and the
+       nearest neighbors once.
+    3. For each K, it turns the distance matrices into similarity matrices.
+    4. The similarity matrices are published in shared memory once, and for each t the missing numbers of clusters
+       are submitted to the process pool with their handles. The workers run SNF and evaluate the same methods as
+       experiment.evaluate_experiment.
+    5. The records are appended to the results file as soon as each task completes, and the similarity matrices of a
+       retain_k are released from shared memory once all its tasks have completed.
+    """
+
+    missing_parameters = set(GRID_PARAMETERS) - set(grid)
+    if missing_parameters:
+        raise ValueError(f'Missing grid parameters: {sorted(missing_parameters)}')
+
+    completed = load_completed_combinations(results_path)
+    combinations = set(product(*[grid[parameter] for parameter in GRID_PARAMETERS])) - completed
+    logger.info(f'Combinations to evaluate: {len(combinations)} ({len(completed)} already completed)')
+
+    if combinations:
+        os.makedirs(os.path.dirname(os.path.abspath(results_path)), exist_ok=True)
+
+        modalities = load_modalities()
+        phenotype_data, subtypes_data = load_annotations()
+
+        workers_n, threads = split_threads(max_workers)
+        registry = SharedMatrixRegistry()
+        with registry, ProcessPoolExecutor(max_workers=workers_n, initializer=init_worker,
+                                           initargs=(get_precision(), threads)) as executor:
+            pending: dict = {}
+            handles: dict[int, list[SharedMatrix]] = {}
+
+            def collect(futures):
+                for future in futures:
+                    retain_k = pending.pop(future)
+                    records = future.result()
+                    append_results(records, results_path)
+                    logger.info(f'Combination {records[0]["retain_k"], records[0]["K"], records[0]["t"]} evaluated.')
+
+                    if retain_k not in pending.values():
+                        for handle in handles.pop(retain_k):
+                            registry.release(handle)
+                        logger.debug(f'Similarity matrices of retain_k {retain_k} released.')
+
+            for retain_k in sorted({c[0] for c in combinations}):
+                *selected, _, aligned_subtypes = align_datasets(select_features(modalities, retain_k=retain_k),
+                                                                phenotype_data, subtypes_data)
+                true_labels = get_true_labels(aligned_subtypes)
+                names = [data.name for data in selected]
+
+                Ks = sorted({c[1] for c in combinations if c[0] == retain_k})
+                similarity_step = SimilarityMatrices(K=Ks[0], K_max=max(Ks[-1], 20))
+                neighbourhoods = similarity_step.get_neighbourhoods(selected)
+
+                for K in Ks:
+                    similarity_matrices = [registry.publish(matrix) for matrix in
+                                           similarity_step.get_affinities(neighbourhoods, index=selected[0].index, K=K)]
+                    handles.setdefault(retain_k, []).extend(similarity_matrices)
+
+                    for t in sorted({c[2] for c in combinations if c[:2] == (retain_k, K)}):
+                        clusters_n_values = sorted(c[3] for c in combinations if c[:3] == (retain_k, K, t))
+                        pending[executor.submit(evaluate_fusion, similarity_matrices, names, true_labels, retain_k, K,
+                                                t, clusters_n_values)] = retain_k
+
+                # The tasks already completed are collected before the next retain_k publishes its matrices
+                collect(wait(list(pending), timeout=0).done)
+
+            collect(as_completed(list(pending)))
+
+    return pd.read_csv(results_path)
+
+
+if __name__ == '__main__':
+    logger.remove()
+    logger.add(stdout, level='INFO', colorize=True,
+               format='<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[data_type]} | <level>{message}</level>')
+    logger.configure(extra={'data_type': 'None'})
+
+    parser = argparse.ArgumentParser(description='Evaluate a grid of SNF pipeline parameters.')
+    parser.add_argument('--retain-k', type=int, nargs='+', default=[100])
+    parser.add_argument('--K', type=int, nargs='+', default=[20])
+    parser.add_argument('--t', type=int, nargs='+', default=[20])
+    parser.add_argument('--clusters-n', type=int, nargs='+', default=[3])
+    parser.add_argument('--results', type=str, default='../results/grid_search.csv')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--precision', type=str, choices=list(PRECISIONS), default='float64')
+    parser.add_argument('--threads', type=int, default=None)
+    args = parser.parse_args()
+    set_precision(args.precision)
+    set_threads(args.threads)
+
+    run_grid_search(grid={'retain_k': args.retain_k, 'K': args.K, 't': args.t, 'clusters_n': args.clusters_n},
+                    results_path=args.results, max_workers=args.workers)
@@ -0,0 +1,162 @@
+from pipeline_steps import EncodeCategoricalData, SimilarityMatrices
+from scipy.spatial.distance import cdist
+from models import Data
+from loguru import logger
+import pandas as pd
+import numpy as np
+
+
+class ModalityState:
+    """
+    The state of a single modality kept between incremental updates: the scaler parameters fitted on the initial
+    cohort, the scaled samples, the distance matrix, the sorted nearest neighbors distances and the affinity matrix.
+    """
+
+    def __init__(self, mean: np.ndarray, scale: np.ndarray, samples: np.ndarray, distances: np.ndarray,
+                 neighbours: np.ndarray, affinities: np.ndarray):
+        self.mean = mean
+        self.scale = scale
+        self.samples = samples
+        self.distances = distances
+        self.neighbours = neighbours
+        self.affinities = affinities
+
+
+class IncrementalSimilarityMatrices:
+    """
+    Similarity matrices that can be updated when new patients are added to the cohort.
+
+    Adding m patients to a cohort of n computes only the m new rows and columns of each distance matrix. The nearest
+    neighbors of the existing patients are updated by merging their sorted neighbors with the new distances, and the
+    affinities are recomputed only for the new patients and for the existing ones whose neighborhood changed.
+
+    The z-score parameters are fitted on the initial cohort and kept fixed afterwards, so the matrices match a full
+    recomputation only as long as the new patients do not shift the feature distributions noticeably. Only the
+    similarity matrices are updated: the fusion of the updated matrices is a full ComputeSNF run.
+    """
+
+    def __init__(self, K: int = 20, mu: float = 0.5, K_max: int = 50):
+        self.K = K
+        self.mu = mu
+        self.K_max = max(K, K_max)
+        self.index = pd.Index([])
+        self.names: list[str] = []
+        self.states: list[ModalityState] = []
+
+    @property
+    def similarity_matrices(self) -> list[pd.DataFrame]:
+        return [pd.DataFrame(state.affinities, index=self.index, columns=self.index) for state in self.states]
+
+    def _average(self, neighbours: np.ndarray) -> np.ndarray:
+        return neighbours[:, 1:self.K + 1].mean(axis=1)
+
+    def _nearest(self, distances: np.ndarray) -> np.ndarray:
+        neighbours_n = min(self.K_max + 1, distances.shape[1])
+        neighbours = np.partition(distances, neighbours_n - 1, axis=1)[:, :neighbours_n]
+        neighbours.sort(axis=1)
+        return neighbours
+
+    def fit(self, data: list[Data]) -> list[pd.DataFrame]:
+        """
+        This method computes the similarity matrices of the initial cohort from scratch.
+
+        Parameters
+        ----------
+        data : list[Data]
+            The aligned modalities of the initial cohort.
+
+        Returns
+        -------
+        list[pd.DataFrame]
+            The similarity matrices, equal to the ones computed by SimilarityMatrices.
+        """
+
+        logger.debug(f'Fitting incremental similarity matrices on {len(data[0])} patients...')
+        self.index = data[0].index
+        self.names = [d.name for d in data]
+        self.states = []
+
+        for d in data:
+            values = EncodeCategoricalData()(data=d).to_numpy(dtype=float)
+            mean = values.mean(axis=0)
+            scale = values.std(axis=0)
+            scale[scale == 0] = 1
+            samples = (values - mean) / scale
+
+            distances = cdist(samples, samples, metric='sqeuclidean')
+            np.fill_diagonal(distances, 0)
+            neighbours = self._nearest(distances)
+            average = self._average(neighbours)
+            affinities = SimilarityMatrices.kernel(distances, rows_average=average[:, np.newaxis],
+                                                   columns_average=average[np.newaxis, :], mu=self.mu)
+
+            self.states.append(ModalityState(mean=mean, scale=scale, samples=samples, distances=distances,
+                                             neighbours=neighbours, affinities=(affinities + affinities.T) / 2))
+
+        return self.similarity_matrices
+
+    def add(self, data: list[Data]) -> list[pd.DataFrame]:
+        """
+        This method adds the given new patients to the cohort and updates the similarity matrices.
+
+        Parameters
+        ----------
+        data : list[Data]
+            The aligned modalities of the new patients only, with the same features as the initial cohort.
+
+        Returns
+        -------
+        list[pd.DataFrame]
+            The similarity matrices of the whole updated cohort.
+
+        The method works as follows:
+        1. The new patients are scaled with the parameters of the initial cohort.
+        2. Only the distances between the new patients and all the patients are computed.
+        3. The sorted neighbors of the existing patients are merged with their distances to the new patients.
+        4. The affinities are recomputed for the new patients and for the existing patients whose average distance to
+           the K nearest neighbors changed; all the other affinities are kept.
+        """
+
+        if data[0].index.isin(self.index).any():
+            raise ValueError('Some of the new patients are already in the cohort.')
+
+        old_n, new_n = len(self.index), len(data[0])
+        logger.debug(f'Adding {new_n} patients to {old_n}...')
+
+        for d, state in zip(data, self.states):
+            values = EncodeCategoricalData()(data=d).to_numpy(dtype=float)
+            new_samples = (values - state.mean) / state.scale
+
+            cross = cdist(new_samples, state.samples, metric='sqeuclidean')
+            own = cdist(new_samples, new_samples, metric='sqeuclidean')
+            np.fill_diagonal(own, 0)
+
+            distances = np.block([[state.distances, cross.T], [cross, own]])
+
+            previous_average = self._average(state.neighbours)
+            old_neighbours = self._nearest(np.hstack([state.neighbours, cross.T]))
+            new_neighbours = self._nearest(np.hstack([cross, own]))
+            neighbours = np.vstack([old_neighbours, new_neighbours])
+            average = self._average(neighbours)
+
+            changed = np.concatenate([np.flatnonzero(average[:old_n] != previous_average),
+                                      np.arange(old_n, old_n + new_n)])
+
+            affinities = np.zeros_like(distances)
+            affinities[:old_n, :old_n] = state.affinities
+            rows = SimilarityMatrices.kernel(distances[changed], rows_average=average[changed, np.newaxis],
+                                             columns_average=average[np.newaxis, :], mu=self.mu)
+            affinities[changed, :] = rows
+            affinities[:, changed] = rows.T
+
+            logger.debug(f'{d.name}: affinities updated for {len(changed)}/{old_n + new_n} patients.')
+
+            state.samples = np.vstack([state.samples, new_samples])
+            state.distances = distances
+            state.neighbours = neighbours
+            state.affinities = affinities
+
+        self.index = self.index.append(data[0].index)
+
+        return self.similarity_matrices
+
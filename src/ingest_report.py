@@ -0,0 +1,133 @@
+from data_loaders import ProteinsDataLoader, miRNADataLoader, mRNADataLoader, open_decompressed
+from settings import PROTEINS_PATH, MIRNA_PATH, MRNA_PATH
+from loguru import logger
+from sys import stdout
+import importlib.util
+import pandas as pd
+import argparse
+import tempfile
+import os.path
+import gzip
+import time
+import os
+
+LOADERS = {PROTEINS_PATH: ProteinsDataLoader, MIRNA_PATH: miRNADataLoader, MRNA_PATH: mRNADataLoader}
+
+
+def compress(file_path: str, compression: str, directory: str, scale: int = 1) -> str:
+    """
+    This function writes a compressed copy of the given CSV file in the given directory, with its columns (the samples)
+    repeated scale times to benchmark larger files, and returns its path.
+    """
+
+    content = pd.read_csv(file_path, index_col=0)
+    if scale > 1:
+        content = pd.concat([content.add_suffix(f'-{i}') for i in range(scale)], axis=1)
+
+    path = os.path.join(directory, f'{os.path.basename(file_path)}.{compression}')
+    data = content.to_csv().encode()
+
+    if compression == 'gz':
+        with gzip.open(path, 'wb') as file:
+            file.write(data)
+    else:
+        import zstandard
+        with open(path, 'wb') as file:
+            file.write(zstandard.ZstdCompressor().compress(data))
+
+    return path
+
+
+def drain(file_path: str):
+    """
+    This function decompresses the given file without parsing it.
+    """
+
+    with open_decompressed(file_path) as stream:
+        while stream.read(1 << 20):
+            pass
+
+
+def get_ingest_report(file_paths: list[str], scale: int = 1, repeats_n: int = 3) -> pd.DataFrame:
+    """
+    This function measures the split between decompression (I/O) and parsing (CPU) when loading compressed CSV files,
+    and how much of it the streaming loaders overlap.
+
+    Parameters
+    ----------
+    file_paths : list[str]
+        The plain CSV files of the modalities, among the keys of LOADERS.
+    scale : int
+        The number of times the samples are repeated in the benchmarked files.
+    repeats_n : int
+        The number of runs of each measure; the fastest one is reported.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per file and compression, with the sizes of the file, the seconds spent decompressing it alone (I/O),
+        loading its decompressed content from a plain file (CPU) and loading it with the streaming loader, and the
+        overlap: the fraction of the shorter phase hidden by running the two phases concurrently.
+    """
+
+    compressions = ['gz'] + (['zst'] if importlib.util.find_spec('zstandard') else [])
+    records = []
+
+    def fastest(function) -> float:
+        durations = []
+        for _ in range(repeats_n):
+            start = time.perf_counter()
+            function()
+            durations.append(time.perf_counter() - start)
+        return min(durations)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for file_path in file_paths:
+            loader = LOADERS[file_path]()
+
+            for compression in compressions:
+                path = compress(file_path, compression, directory, scale=scale)
+                logger.info(f'Benchmarking {os.path.basename(path)}...')
+
+                with open_decompressed(path) as stream:
+                    content = stream.read()
+
+                plain_path = os.path.join(directory, os.path.basename(file_path))
+                with open(plain_path, 'wb') as file:
+                    file.write(content)
+
+                decompress_seconds = fastest(lambda: drain(path))
+                parse_seconds = fastest(lambda: loader.load(plain_path, skip_checks=True))
+                load_seconds = fastest(lambda: loader.load(path, skip_checks=True))
+
+                records.append({'file': os.path.basename(file_path), 'compression': compression,
+                                'compressed_mib': os.path.getsize(path) / 1024 ** 2,
+                                'decompressed_mib': len(content) / 1024 ** 2,
+                                'decompress_seconds': decompress_seconds, 'parse_seconds': parse_seconds,
+                                'load_seconds': load_seconds})
+
+    report = pd.DataFrame(records)
+    report['overlap'] = ((report['decompress_seconds'] + report['parse_seconds'] - report['load_seconds'])
+                         / report[['decompress_seconds', 'parse_seconds']].min(axis=1))
+
+    return report
+
+
+if __name__ == '__main__':
+    logger.remove()
+    logger.add(stdout, level='INFO', colorize=True,
+               format='<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[data_type]} | <level>{message}</level>')
+    logger.configure(extra={'data_type': 'None'})
+
+    parser = argparse.ArgumentParser(description='Measure the I/O and CPU split of loading compressed CSV files.')
+    parser.add_argument('--paths', type=str, nargs='+', default=list(LOADERS))
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--report', type=str, default='../results/ingest.csv')
+    args = parser.parse_args()
+
+    report = get_ingest_report(file_paths=args.paths, scale=args.scale, repeats_n=args.repeats)
+
+    os.makedirs(os.path.dirname(args.report), exist_ok=True)
+    report.to_csv(args.report, index=False)
+    print(report.to_string())
@@ -0,0 +1,144 @@
+from sklearn.utils.validation import check_symmetric
+from scipy import sparse
+import numpy as np
+
+
+def get_landmarks(n: int, landmarks_n: int, random_state: int = 0) -> np.ndarray:
+    """
+    This function returns the sorted positions of landmarks_n landmarks drawn uniformly without replacement among n
+    samples (all of them when landmarks_n >= n).
+    """
+
+    if landmarks_n >= n:
+        return np.arange(n)
+
+    return np.sort(np.random.default_rng(random_state).choice(n, size=landmarks_n, replace=False))
+
+
+def get_nystrom_factor(columns: np.ndarray, landmarks: np.ndarray, tolerance: float = 1e-10) -> np.ndarray:
+    """
+    This function returns the Nyström factor F of a symmetric matrix P from its columns at the landmarks, so that
+    P ~ F @ F.T.
+
+    Parameters
+    ----------
+    columns : np.ndarray
+        The (n, r) columns C of the matrix at the landmarks.
+    landmarks : np.ndarray
+        The r positions of the landmarks.
+    tolerance : float
+        The eigenvalues of C[landmarks] below tolerance times the largest one are discarded, so the factor stays
+        stable when the matrix is not positive definite.
+
+    Returns
+    -------
+    np.ndarray
+        The (n, k) factor C @ W^(-1/2), with k <= r the number of eigenvalues kept.
+    """
+
+    core = columns[landmarks]
+    eigenvalues, eigenvectors = np.linalg.eigh((core + core.T) / 2)
+    kept = eigenvalues > tolerance * max(eigenvalues.max(), 0)
+
+    return columns @ (eigenvectors[:, kept] / np.sqrt(eigenvalues[kept]))
+
+
+def get_sparse_dominant_set(affinity: np.ndarray, K: int, block_size: int = 1024) -> sparse.csr_matrix:
+    """
+    This function returns the K nearest neighbors kernel of snf.compute._find_dominate_set as a sparse matrix: for
+    each row, the K largest affinities normalized to sum to one. The rows are processed in blocks of block_size, so no
+    dense n x n index matrix is allocated. The affinity may be a panel of rows of the whole matrix.
+    """
+
+    n = len(affinity)
+    columns = np.empty((n, K), dtype=np.int64)
+
+    for start in range(0, n, block_size):
+        block = affinity[start:start + block_size]
+        columns[start:start + block_size] = np.argpartition(block, -K, axis=1)[:, -K:]
+
+    values = np.take_along_axis(affinity, columns, axis=1)
+    values = values / values.sum(axis=1, keepdims=True)
+
+    return sparse.csr_matrix((values.ravel(), columns.ravel(), np.arange(0, n * K + 1, K)), shape=affinity.shape)
+
+
+def fuse_low_rank(affinities: list[np.ndarray], K: int = 20, t: int = 20, alpha: float = 1.0, landmarks_n: int = 500,
+                  random_state: int = 0) -> np.ndarray:
+    """
+    This function runs the SNF cross-diffusion of snf.compute.snf in a low-rank factored space.
+
+    The status matrix of each modality is kept as F @ F.T + c * I, where F is an (n, k) Nyström factor over the
+    landmarks and c the weight of the identity added by each iteration, which is kept exact. Each iteration only
+    computes the columns of the new status at the landmarks, as sparse and thin dense products, and refactors them, so
+    it costs O(n * landmarks_n * (m * landmarks_n + K)) for m modalities instead of the O(n^3) of the dense products.
+
+    Parameters
+    ----------
+    affinities : list[np.ndarray]
+        The (n, n) similarity matrices of the modalities, without missing values.
+    K, t, alpha
+        The SNF parameters, see snf.compute.snf.
+    landmarks_n : int
+        The number of landmarks, i.e. the rank of the factors. With landmarks_n >= n the diffusion is exact up to the
+        eigenvalues discarded by get_nystrom_factor.
+    random_state : int
+        The seed of the landmarks sampling.
+
+    Returns
+    -------
+    np.ndarray
+        The (n, n) fused similarity matrix.
+
+    The function works as follows:
+    1. Each affinity is normalized as in snf.compute.snf, its sparse dominant set is found, and it is factored from its
+       columns at the landmarks.
+    2. At each iteration, the status of modality v becomes S_v @ Q_v @ S_v.T + alpha * I, with S_v its dominant set and
+       Q_v = G @ G.T + q * I the mean of the statuses of the other modalities. The low-rank part of its columns at the
+       landmarks, (S_v @ G) @ (S_v[L] @ G).T + q * S_v @ S_v[L].T, is refactored with get_nystrom_factor.
+    3. The statuses are averaged, row-normalized and symmetrized as in snf.compute.snf; only this step builds an
+       n x n matrix.
+    """
+
+    if any(np.isnan(affinity).any() for affinity in affinities):
+        raise ValueError('The low-rank fusion does not support missing values in the similarity matrices.')
+
+    n, m = len(affinities[0]), len(affinities)
+    landmarks = get_landmarks(n, landmarks_n, random_state=random_state)
+
+    factors = []
+    dominant = []
+    for affinity in affinities:
+        affinity = affinity / np.sum(affinity, axis=1, keepdims=True)
+        affinity = check_symmetric(affinity, raise_warning=False)
+        dominant.append(get_sparse_dominant_set(affinity, K=int(K)))
+        factors.append(get_nystrom_factor(affinity[:, landmarks], landmarks))
+    identities = [0.0] * m
+
+    for _ in range(t):
+        new_factors = []
+        for v in range(m):
+            others = [u for u in range(m) if u != v]
+            mean_factor = np.hstack([factors[u] for u in others]) / np.sqrt(m - 1)
+            mean_identity = sum(identities[u] for u in others) / (m - 1)
+
+            diffused = dominant[v] @ mean_factor
+            columns = diffused @ diffused[landmarks].T
+            if mean_identity:
+                columns += mean_identity * (dominant[v] @ dominant[v][landmarks].T).toarray()
+            new_factors.append(get_nystrom_factor(columns, landmarks))
+
+        factors = new_factors
+        identities = [alpha] * m
+
+    # The mean status is F @ F.T + c * I, with F the stacked factors
+    factor = np.hstack(factors) / np.sqrt(m)
+    identity = sum(identities) / m
+
+    fused = factor @ factor.T
+    fused[np.diag_indices_from(fused)] += identity
+    fused = fused / np.sum(fused, axis=1, keepdims=True)
+    fused = (fused + fused.T) / 2
+    fused[np.diag_indices_from(fused)] += 0.5
+
+    return fused
@@ -0,0 +1,105 @@
+from experiment import load_experiment, get_true_labels
+from pipeline_steps import SimilarityMatrices, ComputeSNF, ComputeKMedoids, ComputeSpectralClustering
+from sklearn.metrics import adjusted_rand_score
+from analysis import get_metrics, metrics_to_record
+from models import Data
+from loguru import logger
+from sys import stdout
+import pandas as pd
+import numpy as np
+import argparse
+import os.path
+import time
+import os
+
+CLUSTERING_STEPS = {'SNF prediction metrics': ComputeKMedoids, 'Spectral prediction metrics': ComputeSpectralClustering}
+
+
+def get_low_rank_report(modalities: list[Data], true_labels: pd.Series, landmarks_n_values: list[int], K: int = 20,
+                        t: int = 20, clusters_n: int = 3, random_state: int = 0) -> pd.DataFrame:
+    """
+    This function compares the low-rank fusion of ComputeSNF with the exact one, for each number of landmarks.
+
+    Parameters
+    ----------
+    modalities : list[Data]
+        The aligned modalities.
+    true_labels : pd.Series
+        The encoded true subtypes, aligned with the modalities.
+    landmarks_n_values : list[int]
+        The numbers of landmarks to be evaluated.
+    K, t : int
+        The SNF parameters.
+    clusters_n : int
+        The number of clusters to be detected.
+    random_state : int
+        The seed of the landmarks sampling.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per number of landmarks and method clustering the fused matrix, with the seconds spent fusing, the
+        relative Frobenius error of the fused matrix, the adjusted Rand index between the approximate and the exact
+        clusterings, the metrics of the approximate fusion and their difference from the metrics of the exact one.
+    """
+
+    similarity_matrices = SimilarityMatrices(K=K, K_max=max(K, 50))(data=modalities)
+
+    def evaluate(snf_step: ComputeSNF) -> tuple[pd.DataFrame, float, dict[str, tuple[pd.Series, dict]]]:
+        start = time.perf_counter()
+        fused = snf_step(data=similarity_matrices)
+        seconds = time.perf_counter() - start
+
+        evaluations = {}
+        for label, step in CLUSTERING_STEPS.items():
+            predicted_labels = step()(data=fused, clusters_n=clusters_n)
+            metrics = get_metrics(true_labels=true_labels, predicted_labels=predicted_labels, similarity_data=fused,
+                                  metrics_label=label)
+            evaluations[label] = (predicted_labels, metrics_to_record(metrics))
+
+        return fused, seconds, evaluations
+
+    logger.info('Evaluating the exact fusion...')
+    exact_fused, exact_seconds, exact_evaluations = evaluate(ComputeSNF(K=K, t=t))
+
+    records = []
+    for landmarks_n in landmarks_n_values:
+        logger.info(f'Evaluating the low-rank fusion with {landmarks_n} landmarks...')
+        fused, seconds, evaluations = evaluate(ComputeSNF(K=K, t=t, landmarks_n=landmarks_n,
+                                                          random_state=random_state))
+        error = np.linalg.norm(fused.to_numpy() - exact_fused.to_numpy()) / np.linalg.norm(exact_fused.to_numpy())
+
+        for label, (predicted_labels, record) in evaluations.items():
+            exact_labels, exact_record = exact_evaluations[label]
+            drift = {f'{score} drift': value - exact_record[score] for score, value in record.items()}
+            records.append({'landmarks_n': landmarks_n, 'label': label, 'seconds': seconds,
+                            'exact_seconds': exact_seconds, 'relative_error': error,
+                            'agreement': adjusted_rand_score(exact_labels, predicted_labels)} | record | drift)
+
+    return pd.DataFrame(records)
+
+
+if __name__ == '__main__':
+    logger.remove()
+    logger.add(stdout, level='INFO', colorize=True,
+               format='<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[data_type]} | <level>{message}</level>')
+    logger.configure(extra={'data_type': 'None'})
+
+    parser = argparse.ArgumentParser(description='Compare the low-rank fusion of SNF with the exact one.')
+    parser.add_argument('--landmarks-n', type=int, nargs='+', default=[10, 20, 40, 80])
+    parser.add_argument('--retain-k', type=int, default=100)
+    parser.add_argument('--K', type=int, default=20)
+    parser.add_argument('--t', type=int, default=20)
+    parser.add_argument('--clusters-n', type=int, default=3)
+    parser.add_argument('--random-state', type=int, default=0)
+    parser.add_argument('--report', type=str, default='../results/low_rank_fusion.csv')
+    args = parser.parse_args()
+
+    proteins_data, mirna_data, mrna_data, _, subtypes_data = load_experiment(retain_k=args.retain_k)
+    report = get_low_rank_report([proteins_data, mirna_data, mrna_data], true_labels=get_true_labels(subtypes_data),
+                                 landmarks_n_values=args.landmarks_n, K=args.K, t=args.t,
+                                 clusters_n=args.clusters_n, random_state=args.random_state)
+
+    os.makedirs(os.path.dirname(args.report), exist_ok=True)
+    report.to_csv(args.report, index=False)
+    print(report.to_string())
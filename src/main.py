@@ -1,18 +1,40 @@
 from pipelines import (PhenotypePipeline, MultiDataframesPipeline, miRNAPipeline, mRNAPipeline,
-                       ProteinsPipeline, SubTypesPipeline, DownstreamPipeline, Pipeline)
+                       ProteinsPipeline, SubTypesPipeline, ExperimentPipeline)
 from analysis import get_metrics, get_metrics_comparison_plot, get_metrics_comparison_by_score_plot, \
     plot_subtypes_distribution, plot_similarity_heatmap
 from pipeline_steps import SimilarityMatrices, EncodeCategoricalData, ComputeKMedoids, \
-    ComputeMatricesAverage, ComputeSNF, ComputeSpectralClustering
-from data_loaders import ProteinsDataLoader, miRNADataLoader, mRNADataLoader, PhenotypeDataLoader, SubtypesDataLoader, \
-    DataLoader
-from settings import PROTEINS_PATH, MIRNA_PATH, MRNA_PATH, PHENOTYPE_PATH, SUBTYPES_PATH
+    ComputeMatricesAverage, ComputeSNF, ComputeSpectralClustering, FilterByVariance
+from data_loaders import ProteinsDataLoader, miRNADataLoader, mRNADataLoader, PhenotypeDataLoader, SubtypesDataLoader
+from settings import PROTEINS_PATH, MIRNA_PATH, MRNA_PATH, PHENOTYPE_PATH, SUBTYPES_PATH, RUNS_PATH
+from models import ProteinsData, miRNAData, mRNAData, PhenotypeData, SubtypesData
+from checkpoints import RunDirectory, get_file_fingerprint
+from precision import PRECISIONS, set_precision
+from resources import set_threads, log_thread_allocation
+from planner import plan_run
+from results_store import ResultsStore
+from feature_statistics import get_data_fingerprint
 from plotly.graph_objs import Figure
 from offline_analysis import run_all
+from experiment import get_data
 from slugify import slugify
 from loguru import logger
-from models import Data
+from datetime import datetime
 from sys import stdout
+import argparse
+import time
+import os
+
+INPUT_PATHS = {'proteins': PROTEINS_PATH, 'mirna': MIRNA_PATH, 'mrna': MRNA_PATH, 'phenotype': PHENOTYPE_PATH,
+               'subtypes': SUBTYPES_PATH}
+
+# The stages of the run, each with the values of the configuration its artifacts depend on (besides the ones of the
+# previous stages)
+STAGE_DEPENDENCIES = {'datasets': ['precision', 'retain_k'] + [f'fingerprint.{name}' for name in INPUT_PATHS],
+                      'similarity': ['backend', 'K'],
+                      'fusion': ['t'],
+                      'clustering': ['clusters_n'],
+                      'metrics': []}
+STAGES = list(STAGE_DEPENDENCIES)
 
 # Set up the logger
 logger.remove()
@@ -21,32 +43,6 @@ logger.add(stdout, level='DEBUG', colorize=True,
 logger.configure(extra={'data_type': 'None'})
 
 
-def get_data(dataset_path: str, loader: DataLoader, pipeline: Pipeline) -> Data:
-    """
-    This method filters out the barcodes that correspond to primary tumors.
-
-    Parameters
-    ----------
-    barcodes : list[str]
-        The list of barcodes to be filtered. Each barcode is expected to have the tumor sample code at the 14th and 15th positions (0-indexed).
-
-    Returns
-    -------
-    list[str]
-        The list of barcodes that correspond to primary tumors.
-
-    The method works as follows:
-    1. It iterates over the given barcodes.
-    2. For each barcode, it checks if it corresponds to a primary tumor using the is_primary_tumor method.
-    3. It retains the barcodes that correspond to primary tumors in a list.
-    4. It returns the list of barcodes that correspond to primary tumors.
-    """
-
-    data = loader.load(file_path=dataset_path)
-    data = pipeline(data=data)
-    return data
-
-
 def save_plot(plot: Figure, extensionless_path: str):
     """
     This function saves the given plot as a PNG image and an HTML file.
@@ -68,70 +64,170 @@ def save_plot(plot: Figure, extensionless_path: str):
     plot.write_html(f'{extensionless_path}.html')
 
 
-# Load the datasets
-proteins_data = get_data(dataset_path=PROTEINS_PATH,
-                         loader=ProteinsDataLoader(),
-                         pipeline=ProteinsPipeline())
-
-mirna_data = get_data(dataset_path=MIRNA_PATH,
-                      loader=miRNADataLoader(),
-                      pipeline=miRNAPipeline())
-
-mrna_data = get_data(dataset_path=MRNA_PATH,
-                     loader=mRNADataLoader(),
-                     pipeline=mRNAPipeline())
-
-phenotype_data = get_data(dataset_path=PHENOTYPE_PATH,
-                          loader=PhenotypeDataLoader(),
-                          pipeline=PhenotypePipeline())
+parser = argparse.ArgumentParser(description='Run the PRAD subtypes experiment.')
+parser.add_argument('--run-dir', type=str, default=None,
+                    help='Directory where the artifacts of each stage are saved. Default is a new directory in '
+                         f'{RUNS_PATH}, or the most recent one when resuming.')
+parser.add_argument('--resume', action='store_true',
+                    help='Load the completed stages from the run directory and continue from the first missing one.')
+parser.add_argument('--precision', type=str, choices=list(PRECISIONS), default='float64',
+                    help='Floating point precision of the modality, similarity and fused matrices.')
+parser.add_argument('--threads', type=int, default=None,
+                    help='Number of threads of the BLAS and OpenMP pools. Default is the number of available cores.')
+parser.add_argument('--memory-budget-gb', type=float, default=None,
+                    help='Memory budget of the run. Lighter engines are used when the estimated peak memory exceeds '
+                         'it, and the run is refused if it still does. Default is the memory available.')
+parser.add_argument('--snf-memory-budget-gb', type=float, default=None,
+                    help='Run SNF out of core, with its matrices stored as tiles on disk and processed within this '
+                         'memory budget. Default is in memory.')
+parser.add_argument('--scratch', type=str, default=None,
+                    help='Directory of the tiles of the out-of-core SNF. Default is the system temporary directory.')
+args = parser.parse_args()
+set_threads(args.threads)
+log_thread_allocation()
+
+# Plan the run from the shapes of the datasets, before loading them
+configuration, estimates = plan_run([PROTEINS_PATH, MIRNA_PATH, MRNA_PATH], precision=args.precision,
+                                    memory_budget=int(args.memory_budget_gb * 1024 ** 3) if args.memory_budget_gb
+                                    else None)
+logger.info(f'Estimates:\n{estimates.to_string()}')
+set_precision(configuration['precision'])
+
+run_path = args.run_dir
+if run_path is None:
+    previous_runs = sorted(os.listdir(RUNS_PATH)) if os.path.isdir(RUNS_PATH) else []
+    run_path = os.path.join(RUNS_PATH, previous_runs[-1] if args.resume and previous_runs
+                            else datetime.now().strftime('%Y%m%d-%H%M%S'))
+
+# The steps whose parameters are recorded with the run
+similarity_step = SimilarityMatrices(backend=configuration['backend'])
+snf_step = ComputeSNF(memory_budget=int(args.snf_memory_budget_gb * 1024 ** 3) if args.snf_memory_budget_gb else None,
+                      scratch_path=args.scratch)
+variance_step = next(step for step in ExperimentPipeline.steps if isinstance(step, FilterByVariance))
+clusters_n = 3
+parameters = {'retain_k': variance_step.retain_k, 'K': similarity_step.K, 't': snf_step.t, 'clusters_n': clusters_n}
+
+run = RunDirectory(run_path)
+if not args.resume:
+    run.invalidate(STAGES)
+run.update_configuration(parameters | configuration
+                         | {f'fingerprint.{name}': get_file_fingerprint(path) for name, path in INPUT_PATHS.items()},
+                         STAGE_DEPENDENCIES)
+
+first_missing_stage = run.first_missing_stage(STAGES)
+completed_stages = STAGES[:STAGES.index(first_missing_stage)] if first_missing_stage else STAGES
+logger.info(f'Run directory: {run_path}, completed stages: {completed_stages}')
+
+# Seconds spent in each stage computed by this run
+timings = {}
 
-subtypes_data = get_data(dataset_path=SUBTYPES_PATH,
-                         loader=SubtypesDataLoader(),
-                         pipeline=SubTypesPipeline())
-
-# Prepare datasets for integration
-proteins_data, mirna_data, mrna_data, phenotype_data, subtypes_data = MultiDataframesPipeline()(
-    data=[proteins_data, mirna_data, mrna_data, phenotype_data, subtypes_data])
+# Load the datasets
+if 'datasets' in completed_stages:
+    datasets = run.load_frames('datasets')
+    proteins_data = ProteinsData(datasets['proteins'])
+    mirna_data = miRNAData(datasets['mirna'])
+    mrna_data = mRNAData(datasets['mrna'])
+    phenotype_data = PhenotypeData(datasets['phenotype'])
+    subtypes_data = SubtypesData(datasets['subtypes'])
+else:
+    start = time.perf_counter()
+    proteins_data = get_data(dataset_path=PROTEINS_PATH,
+                             loader=ProteinsDataLoader(),
+                             pipeline=ProteinsPipeline())
+
+    mirna_data = get_data(dataset_path=MIRNA_PATH,
+                          loader=miRNADataLoader(),
+                          pipeline=miRNAPipeline())
+
+    mrna_data = get_data(dataset_path=MRNA_PATH,
+                         loader=mRNADataLoader(),
+                         pipeline=mRNAPipeline())
+
+    phenotype_data = get_data(dataset_path=PHENOTYPE_PATH,
+                              loader=PhenotypeDataLoader(),
+                              pipeline=PhenotypePipeline())
+
+    subtypes_data = get_data(dataset_path=SUBTYPES_PATH,
+                             loader=SubtypesDataLoader(),
+                             pipeline=SubTypesPipeline())
+
+    # Prepare datasets for integration
+    proteins_data, mirna_data, mrna_data, phenotype_data, subtypes_data = MultiDataframesPipeline()(
+        data=[proteins_data, mirna_data, mrna_data, phenotype_data, subtypes_data])
+
+    run.save_frames('datasets', {'proteins': proteins_data, 'mirna': mirna_data, 'mrna': mrna_data,
+                                 'phenotype': phenotype_data, 'subtypes': subtypes_data})
+    timings['datasets'] = time.perf_counter() - start
 
 # Compute similarity matrices
-sim_proteins, sim_mirna, sim_mrna = SimilarityMatrices()(data=[proteins_data, mirna_data, mrna_data])
-
-# Cluster each similarity matrix separately
-proteins_pred = ComputeKMedoids()(data=sim_proteins)
-mirna_pred = ComputeKMedoids()(data=sim_mirna)
-mrna_pred = ComputeKMedoids()(data=sim_mrna)
-
-# Integrate the similarity matrices with average and cluster the integrated matrix
-downstream_pipeline = DownstreamPipeline()
-downstream_pipeline.steps = [ComputeMatricesAverage(), ComputeKMedoids()]
-avg_pred = downstream_pipeline(data=[sim_proteins, sim_mirna, sim_mrna])
-
-# Integrate the similarity matrices with SNF and cluster the integrated matrix
-downstream_pipeline.steps = [ComputeSNF(), ComputeKMedoids()]
-snf_pred = downstream_pipeline(data=[sim_proteins, sim_mirna, sim_mrna])
-
-# Integrate the similarity matrices with SNF and cluster the integrated matrix using spectral clustering
-downstream_pipeline.steps = [ComputeSNF(), ComputeSpectralClustering()]
-spectral_pred = downstream_pipeline(data=[sim_proteins, sim_mirna, sim_mrna])
+if 'similarity' in completed_stages:
+    sim_proteins, sim_mirna, sim_mrna = run.load_matrices('similarity').values()
+else:
+    start = time.perf_counter()
+    sim_proteins, sim_mirna, sim_mrna = similarity_step(data=[proteins_data, mirna_data, mrna_data])
+    run.save_matrices('similarity', {'proteins': sim_proteins, 'mirna': sim_mirna, 'mrna': sim_mrna})
+    timings['similarity'] = time.perf_counter() - start
+
+# Integrate the similarity matrices with average and with SNF
+if 'fusion' in completed_stages:
+    avg_similarity, snf_similarity = run.load_matrices('fusion').values()
+else:
+    start = time.perf_counter()
+    avg_similarity = ComputeMatricesAverage()(data=[sim_proteins, sim_mirna, sim_mrna])
+    snf_similarity = snf_step(data=[sim_proteins, sim_mirna, sim_mrna])
+    if snf_step.io_report is not None:
+        logger.info(f'Out-of-core SNF:\n{snf_step.io_report.to_string()}')
+    run.save_matrices('fusion', {'average': avg_similarity, 'snf': snf_similarity})
+    timings['fusion'] = time.perf_counter() - start
+
+# Cluster each similarity matrix separately, the integrated matrices with KMedoids and the SNF matrix with spectral
+# clustering
+if 'clustering' in completed_stages:
+    proteins_pred, mirna_pred, mrna_pred, avg_pred, snf_pred, spectral_pred = run.load_labels('clustering').values()
+else:
+    start = time.perf_counter()
+    proteins_pred = ComputeKMedoids()(data=sim_proteins, clusters_n=clusters_n)
+    mirna_pred = ComputeKMedoids()(data=sim_mirna, clusters_n=clusters_n)
+    mrna_pred = ComputeKMedoids()(data=sim_mrna, clusters_n=clusters_n)
+    avg_pred = ComputeKMedoids()(data=avg_similarity, clusters_n=clusters_n)
+    snf_pred = ComputeKMedoids()(data=snf_similarity, clusters_n=clusters_n)
+    spectral_pred = ComputeSpectralClustering()(data=snf_similarity, clusters_n=clusters_n)
+    run.save_labels('clustering', {'proteins': proteins_pred, 'mirna': mirna_pred, 'mrna': mrna_pred,
+                                   'average': avg_pred, 'snf': snf_pred, 'spectral': spectral_pred})
+    timings['clustering'] = time.perf_counter() - start
 
 # Calculate metrics
-encoded_subtypes = EncodeCategoricalData()(data=subtypes_data)['Subtype_Integrative']
-
-proteins_metrics = get_metrics(true_labels=encoded_subtypes, predicted_labels=proteins_pred,
-                               metrics_label='Proteins prediction metrics', similarity_data=sim_proteins)
-mirna_metrics = get_metrics(true_labels=encoded_subtypes, predicted_labels=mirna_pred,
-                            metrics_label='miRNA prediction metrics', similarity_data=sim_mirna)
-mrna_metrics = get_metrics(true_labels=encoded_subtypes, predicted_labels=mrna_pred,
-                           metrics_label='mRNA prediction metrics', similarity_data=sim_mrna)
-avg_metrics = get_metrics(true_labels=encoded_subtypes, predicted_labels=avg_pred,
-                          metrics_label='Average prediction metrics',
-                          similarity_data=ComputeMatricesAverage()(data=[sim_proteins, sim_mirna, sim_mrna]))
-snf_metrics = get_metrics(true_labels=encoded_subtypes, predicted_labels=snf_pred,
-                          metrics_label='SNF prediction metrics',
-                          similarity_data=ComputeSNF()(data=[sim_proteins, sim_mirna, sim_mrna]))
-spectral_metrics = get_metrics(true_labels=encoded_subtypes, predicted_labels=spectral_pred,
-                               metrics_label='Spectral prediction metrics',
-                               similarity_data=ComputeSNF()(data=[sim_proteins, sim_mirna, sim_mrna]))
+if 'metrics' in completed_stages:
+    proteins_metrics, mirna_metrics, mrna_metrics, avg_metrics, snf_metrics, spectral_metrics = \
+        run.load_metrics('metrics').values()
+else:
+    start = time.perf_counter()
+    encoded_subtypes = EncodeCategoricalData()(data=subtypes_data)['Subtype_Integrative']
+
+    proteins_metrics = get_metrics(true_labels=encoded_subtypes, predicted_labels=proteins_pred,
+                                   metrics_label='Proteins prediction metrics', similarity_data=sim_proteins)
+    mirna_metrics = get_metrics(true_labels=encoded_subtypes, predicted_labels=mirna_pred,
+                                metrics_label='miRNA prediction metrics', similarity_data=sim_mirna)
+    mrna_metrics = get_metrics(true_labels=encoded_subtypes, predicted_labels=mrna_pred,
+                               metrics_label='mRNA prediction metrics', similarity_data=sim_mrna)
+    avg_metrics = get_metrics(true_labels=encoded_subtypes, predicted_labels=avg_pred,
+                              metrics_label='Average prediction metrics', similarity_data=avg_similarity)
+    snf_metrics = get_metrics(true_labels=encoded_subtypes, predicted_labels=snf_pred,
+                              metrics_label='SNF prediction metrics', similarity_data=snf_similarity)
+    spectral_metrics = get_metrics(true_labels=encoded_subtypes, predicted_labels=spectral_pred,
+                                   metrics_label='Spectral prediction metrics', similarity_data=snf_similarity)
+
+    run.save_metrics('metrics', {'proteins': proteins_metrics, 'mirna': mirna_metrics, 'mrna': mrna_metrics,
+                                 'average': avg_metrics, 'snf': snf_metrics, 'spectral': spectral_metrics})
+    timings['metrics'] = time.perf_counter() - start
+
+    # Record the run in the results store, to be compared with the other runs
+    ResultsStore().append([proteins_metrics, mirna_metrics, mrna_metrics, avg_metrics, snf_metrics, spectral_metrics],
+                          run_id=os.path.basename(os.path.normpath(run_path)), cohort='PRAD',
+                          parameters=parameters | configuration,
+                          fingerprints={data.name: get_data_fingerprint(data)
+                                        for data in [proteins_data, mirna_data, mrna_data]},
+                          timings=timings)
 
 # Save each metric's plot as a PNG image and an HTML file
 save_plot(proteins_metrics.plot(), '../plots/proteins_metrics')
@@ -154,10 +250,11 @@ save_plot(get_metrics_comparison_by_score_plot(
 # Save the subtypes distribution plot as a PNG image and an HTML file
 save_plot(plot_subtypes_distribution(subtypes_data), '../plots/subtypes_distribution')
 
-# Save the similarity matrices as PNG images and HTML files
-save_plot(plot_similarity_heatmap(sim_proteins, data_type='Proteins'), '../plots/proteins_similarity_heatmap')
-save_plot(plot_similarity_heatmap(sim_mirna, data_type='miRNA'), '../plots/mirna_similarity_heatmap')
-save_plot(plot_similarity_heatmap(sim_mrna, data_type='mRNA'), '../plots/mrna_similarity_heatmap')
+# Save the similarity matrices as PNG images and HTML files, unless they do not fit the memory budget
+if configuration['heatmaps']:
+    save_plot(plot_similarity_heatmap(sim_proteins, data_type='Proteins'), '../plots/proteins_similarity_heatmap')
+    save_plot(plot_similarity_heatmap(sim_mirna, data_type='miRNA'), '../plots/mirna_similarity_heatmap')
+    save_plot(plot_similarity_heatmap(sim_mrna, data_type='mRNA'), '../plots/mrna_similarity_heatmap')
 
 # Run all offline analysis
 offline_plots = run_all()
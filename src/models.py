@@ -104,8 +104,3 @@ class Metrics(BaseModel):
         fig.update_traces(textposition='outside', textangle=0)
 
         return fig
-
-
-class NanPercentage(BaseModel):
-    column: str
-    percentage: float
@@ -1,7 +1,8 @@
 from data_loaders import ProteinsDataLoader, miRNADataLoader, mRNADataLoader, PhenotypeDataLoader
 from settings import PROTEINS_PATH, MIRNA_PATH, MRNA_PATH, PHENOTYPE_PATH, SUBTYPES_PATH
 from pipelines import ProteinsPipeline, miRNAPipeline, PhenotypePipeline
-from pipeline_steps import RetainMainTumors
+from pipeline_steps import RetainMainTumors, ComputeFeatureStatistics
+from analysis import get_nan_percentage
 from plotly.graph_objs import Figure
 from typing import Generator
 import plotly.express as px
@@ -51,7 +52,8 @@ def plot_features_with_nans(show: bool = False) -> Figure:
         The created plotly.graph_objs.Figure object representing the bar plot.
 
     The function works as follows:
-    1. It calculates the total number of features and the number of features with NaN values in each dataset.
+    1. It reads the total number of features and the number of features with NaN values from the feature statistics
+       of each dataset.
     2. It calculates the percentage of features with NaN values in each dataset.
     3. It creates a DataFrame with the calculated data.
     4. It creates a bar plot from the DataFrame using plotly.
@@ -61,15 +63,15 @@ def plot_features_with_nans(show: bool = False) -> Figure:
     """
 
     proteins_features = len(proteins_data.columns)
-    proteins_features_with_nans = sum(proteins_data.isna().sum() > 0)
+    proteins_features_with_nans = ComputeFeatureStatistics().get_statistics(proteins_data).features_with_nans_n
     proteins_nans_percentage = proteins_features_with_nans / proteins_features * 100
 
     mirna_features = len(mirna_data.columns)
-    mirna_features_with_nans = sum(mirna_data.isna().sum() > 0)
+    mirna_features_with_nans = ComputeFeatureStatistics().get_statistics(mirna_data).features_with_nans_n
     mirna_features_with_nans_percentage = mirna_features_with_nans / mirna_features * 100
 
     mrna_features = len(mrna_data.columns)
-    mrna_features_with_nans = sum(mrna_data.isna().sum() > 0)
+    mrna_features_with_nans = ComputeFeatureStatistics().get_statistics(mrna_data).features_with_nans_n
     mrna_features_with_nans_percentage = mrna_features_with_nans / mrna_features * 100
 
     data = pd.DataFrame([['Proteins', proteins_features_with_nans, proteins_nans_percentage],
@@ -115,7 +117,7 @@ def plot_nan_percentage_per_feature(data: pd.DataFrame, data_type: str, show: bo
         The created plotly.graph_objs.Figure object representing the bar plot.
 
     The function works as follows:
-    1. It calculates the percentage of NaN values for each feature in the dataset.
+    1. It reads the percentage of NaN values for each feature from the feature statistics of the dataset.
     2. It converts the calculated data to a DataFrame and filters out the features with no NaN values.
     3. It adds the feature names and the data type to the DataFrame.
     4. It creates a bar plot from the DataFrame using plotly.
@@ -124,7 +126,7 @@ def plot_nan_percentage_per_feature(data: pd.DataFrame, data_type: str, show: bo
     7. It returns the created plot.
     """
 
-    data = data.isna().sum() / len(data) * 100
+    data = get_nan_percentage(data) * 100
     data = data.to_frame()
     data.columns = ['NaNs Percentage']
     data = data[data['NaNs Percentage'] > 0]
@@ -0,0 +1,257 @@
+from low_rank_fusion import get_sparse_dominant_set
+from scipy import sparse
+from loguru import logger
+import pandas as pd
+import numpy as np
+import tempfile
+import os.path
+import time
+import os
+
+
+class IOCounter:
+    """
+    Accumulator of the seconds and bytes of the reads and writes of the tiled matrices.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.read_bytes = 0
+        self.written_bytes = 0
+
+
+class TiledMatrix:
+    """
+    (n, n) matrix stored on disk as a memmap of (tiles_n, tiles_n, tile_size, tile_size) tiles, each one contiguous, so
+    both a panel of rows and a panel of columns are read and written as tiles_n contiguous chunks.
+
+    The reads return in-memory copies and the writes are flushed by flush, so the time spent by the disk is accounted
+    in the given IOCounter.
+    """
+
+    def __init__(self, path: str, n: int, tile_size: int, dtype: np.dtype, counter: IOCounter):
+        self.n = n
+        self.tile_size = tile_size
+        self.tiles_n = -(-n // tile_size)
+        self.counter = counter
+        self.tiles = np.memmap(path, dtype=dtype, mode='w+',
+                               shape=(self.tiles_n, self.tiles_n, tile_size, tile_size))
+
+    def _span(self, i: int) -> int:
+        return min(self.tile_size, self.n - i * self.tile_size)
+
+    def read_rows(self, i: int) -> np.ndarray:
+        start = time.perf_counter()
+        panel = np.array(self.tiles[i]).transpose(1, 0, 2).reshape(self.tile_size, -1)[:self._span(i), :self.n]
+        self.counter.seconds += time.perf_counter() - start
+        self.counter.read_bytes += panel.nbytes
+
+        return panel
+
+    def read_columns(self, j: int) -> np.ndarray:
+        start = time.perf_counter()
+        panel = np.array(self.tiles[:, j]).reshape(-1, self.tile_size)[:self.n, :self._span(j)]
+        self.counter.seconds += time.perf_counter() - start
+        self.counter.read_bytes += panel.nbytes
+
+        return panel
+
+    def write_rows(self, i: int, panel: np.ndarray):
+        start = time.perf_counter()
+        padded = np.zeros((self.tile_size, self.tiles_n * self.tile_size), dtype=self.tiles.dtype)
+        padded[:panel.shape[0], :self.n] = panel
+        self.tiles[i] = padded.reshape(self.tile_size, self.tiles_n, self.tile_size).transpose(1, 0, 2)
+        self.counter.seconds += time.perf_counter() - start
+        self.counter.written_bytes += panel.nbytes
+
+    def write_columns(self, j: int, panel: np.ndarray):
+        start = time.perf_counter()
+        padded = np.zeros((self.tiles_n * self.tile_size, self.tile_size), dtype=self.tiles.dtype)
+        padded[:self.n, :panel.shape[1]] = panel
+        self.tiles[:, j] = padded.reshape(self.tiles_n, self.tile_size, self.tile_size)
+        self.counter.seconds += time.perf_counter() - start
+        self.counter.written_bytes += panel.nbytes
+
+    def flush(self):
+        start = time.perf_counter()
+        self.tiles.flush()
+        self.counter.seconds += time.perf_counter() - start
+
+
+def get_tile_size(n: int, modalities_n: int, K: int, memory_budget: int, dtype: np.dtype) -> int:
+    """
+    This function returns the largest tile size whose working set fits in the given memory budget: the sparse dominant
+    sets of the modalities, which are kept in memory, and about five panels of tile_size x n values.
+    """
+
+    itemsize = np.dtype(dtype).itemsize
+    dominant_bytes = modalities_n * n * K * (itemsize + 8)
+    tile_size = (memory_budget - dominant_bytes) // (5 * n * itemsize)
+
+    if tile_size < 1:
+        raise MemoryError(f'The memory budget of {memory_budget / 1024 ** 2:.1f} MiB cannot hold the sparse kernels and '
+                          f'a panel of {n} values.')
+
+    return int(min(tile_size, n))
+
+
+def fuse_out_of_core(affinities: list[np.ndarray | pd.DataFrame], K: int = 20, t: int = 20, alpha: float = 1.0,
+                     memory_budget: int = 1024 ** 3, scratch_path: str | None = None,
+                     dtype: np.dtype = np.float64) -> tuple[np.ndarray, pd.DataFrame]:
+    """
+    This function runs the SNF cross-diffusion of snf.compute.snf with the status matrices stored as tiles on disk, so
+    only panels of tile_size x n values are in memory at once.
+
+    The dominant sets are kept as sparse matrices, so the products S_v @ Q @ S_v.T cost O(n^2 K) instead of the O(n^3)
+    of the dense products. The passes over the tiles are ordered so each tile is read once per pass: the status sum is
+    read once per iteration for all the modalities, and the new status sum is accumulated while the new statuses are
+    written, instead of in a separate pass.
+
+    Parameters
+    ----------
+    affinities : list[np.ndarray | pd.DataFrame]
+        The (n, n) similarity matrices of the modalities, without missing values. They may be memmaps themselves: they
+        are only read by panels.
+    K, t, alpha
+        The SNF parameters, see snf.compute.snf.
+    memory_budget : int
+        The bytes of memory the fusion may use, see get_tile_size.
+    scratch_path : str, optional
+        The directory of the tiles, which are deleted at the end. Default is the system temporary directory.
+    dtype : np.dtype
+        The floating point type of the tiles and of the computations.
+
+    Returns
+    -------
+    tuple[np.ndarray, pd.DataFrame]
+        The (n, n) fused similarity matrix, as a memmap of a file unlinked from the scratch directory, and one row for
+        the setup, for each diffusion iteration and for the output, with the seconds spent in I/O and in computation
+        and the MiB read and written.
+
+    The function works as follows:
+    1. The affinities are normalized and symmetrized as in snf.compute.snf, by panels, into the initial statuses P_v;
+       their sparse dominant sets S_v and the status sum W are computed on the way.
+    2. At each iteration, a pass over the row panels computes T_v = Q_v @ S_v.T for every modality, with
+       Q_v = (W - P_v) / (m - 1) built from a single read of each panel of W.
+    3. A pass over the column panels then writes P_v = S_v @ T_v + alpha * I and the new W, with the row sums of W.
+    4. The mean status is row-normalized and symmetrized by panels into the fused matrix.
+    """
+
+    arrays = [affinity.to_numpy() if isinstance(affinity, pd.DataFrame) else affinity for affinity in affinities]
+    n, m = arrays[0].shape[0], len(arrays)
+    tile_size = get_tile_size(n, m, K=int(K), memory_budget=memory_budget, dtype=dtype)
+    panels = [(start, min(start + tile_size, n)) for start in range(0, n, tile_size)]
+
+    counter = IOCounter()
+    records = []
+    compute_seconds = 0.0
+
+    def record(stage: str, iteration: int):
+        nonlocal compute_seconds
+        records.append({'stage': stage, 'iteration': iteration, 'io_seconds': counter.seconds,
+                        'compute_seconds': compute_seconds, 'read_mib': counter.read_bytes / 1024 ** 2,
+                        'written_mib': counter.written_bytes / 1024 ** 2})
+        logger.debug(f'Out-of-core SNF {stage} {iteration}: {counter.seconds:.2f} s of I/O, '
+                     f'{compute_seconds:.2f} s of computation.')
+        counter.seconds, counter.read_bytes, counter.written_bytes, compute_seconds = 0.0, 0, 0, 0.0
+
+    logger.debug(f'Out-of-core SNF on {len(panels)} x {len(panels)} tiles of {tile_size} x {tile_size}.')
+
+    with tempfile.TemporaryDirectory(dir=scratch_path) as directory:
+        statuses = [TiledMatrix(os.path.join(directory, f'status-{v}'), n, tile_size, dtype, counter) for v in range(m)]
+        diffused = [TiledMatrix(os.path.join(directory, f'diffused-{v}'), n, tile_size, dtype, counter)
+                    for v in range(m)]
+        status_sum = TiledMatrix(os.path.join(directory, 'status-sum'), n, tile_size, dtype, counter)
+
+        def read(array: np.ndarray, rows: slice, columns: slice) -> np.ndarray:
+            start = time.perf_counter()
+            block = np.array(array[rows, columns], dtype=dtype)
+            counter.seconds += time.perf_counter() - start
+            counter.read_bytes += block.nbytes
+            return block
+
+        # 1. Initial statuses, dominant sets and status sum
+        row_sums = [np.concatenate([read(array, slice(start, end), slice(None)).sum(axis=1) for start, end in panels])
+                    for array in arrays]
+        if any(np.isnan(sums).any() for sums in row_sums):
+            raise ValueError('The out-of-core fusion does not support missing values in the similarity matrices.')
+
+        dominant_panels = [[] for _ in range(m)]
+        sum_row_sums = np.zeros(n, dtype=dtype)
+        for i, (start, end) in enumerate(panels):
+            panel_sum = np.zeros((end - start, n), dtype=dtype)
+            for v, array in enumerate(arrays):
+                rows = read(array, slice(start, end), slice(None))
+                columns = read(array, slice(None), slice(start, end))
+
+                begin = time.perf_counter()
+                panel = (rows / row_sums[v][start:end, None] + (columns / row_sums[v][:, None]).T) / 2
+                dominant_panels[v].append(get_sparse_dominant_set(panel, K=int(K)))
+                panel_sum += panel
+                compute_seconds += time.perf_counter() - begin
+
+                statuses[v].write_rows(i, panel)
+            sum_row_sums[start:end] = panel_sum.sum(axis=1)
+            status_sum.write_rows(i, panel_sum)
+
+        dominant = [sparse.vstack(panels_v).tocsr() for panels_v in dominant_panels]
+        for matrix in statuses + [status_sum]:
+            matrix.flush()
+        record('setup', 0)
+
+        for iteration in range(1, t + 1):
+            # 2. T_v = Q_v @ S_v.T by row panels, reading each panel of the status sum once for all the modalities
+            for i in range(len(panels)):
+                panel_sum = status_sum.read_rows(i)
+                for v in range(m):
+                    panel = statuses[v].read_rows(i)
+
+                    begin = time.perf_counter()
+                    product = (dominant[v] @ ((panel_sum - panel) / (m - 1)).T).T
+                    compute_seconds += time.perf_counter() - begin
+
+                    diffused[v].write_rows(i, product)
+
+            # 3. P_v = S_v @ T_v + alpha * I by column panels, accumulating the new status sum and its row sums
+            sum_row_sums = np.zeros(n, dtype=dtype)
+            for j, (start, end) in enumerate(panels):
+                panel_sum = np.zeros((n, end - start), dtype=dtype)
+                for v in range(m):
+                    panel = diffused[v].read_columns(j)
+
+                    begin = time.perf_counter()
+                    product = dominant[v] @ panel
+                    product[np.arange(start, end), np.arange(end - start)] += alpha
+                    panel_sum += product
+                    compute_seconds += time.perf_counter() - begin
+
+                    statuses[v].write_columns(j, product)
+                sum_row_sums += panel_sum.sum(axis=1)
+                status_sum.write_columns(j, panel_sum)
+
+            for matrix in statuses + [status_sum]:
+                matrix.flush()
+            record('diffusion', iteration)
+
+        # 4. The mean status, row-normalized and symmetrized, in a memmap that outlives the scratch directory
+        descriptor, fused_path = tempfile.mkstemp(dir=scratch_path, suffix='.fused')
+        os.close(descriptor)
+        fused = np.memmap(fused_path, dtype=dtype, mode='w+', shape=(n, n))
+        os.unlink(fused_path)
+
+        for i, (start, end) in enumerate(panels):
+            rows = status_sum.read_rows(i)
+            columns = status_sum.read_columns(i)
+
+            begin = time.perf_counter()
+            panel = (rows / sum_row_sums[start:end, None] + (columns / sum_row_sums[:, None]).T) / 2
+            panel[np.arange(end - start), np.arange(start, end)] += 0.5
+            compute_seconds += time.perf_counter() - begin
+
+            begin = time.perf_counter()
+            fused[start:end] = panel
+            counter.seconds += time.perf_counter() - begin
+            counter.written_bytes += panel.nbytes
+        record('output', t)
+
+    return fused, pd.DataFrame(records)
@@ -1,10 +1,23 @@
-from sklearn.preprocessing import LabelEncoder, StandardScaler, MinMaxScaler
+from sklearn.preprocessing import StandardScaler, MinMaxScaler
 from sklearn.cluster import SpectralClustering
 from sklearn_extra.cluster import KMedoids
+from sklearn.utils.validation import check_symmetric
 from datetime import datetime
-from itertools import chain
+from functools import reduce
+from feature_statistics import (FeatureStatistics, FeatureStatisticsIndex, FEATURE_STATISTICS_INDEX,
+                                compute_feature_statistics, get_data_fingerprint)
 from typing import Iterable
+from barcodes import BARCODE_INDEX
+from code_maps import CodeMapIndex, CODE_MAP_INDEX
 from models import Data
+from scipy.spatial.distance import cdist
+from approximate_neighbours import RandomProjectionForest
+from low_rank_fusion import fuse_low_rank
+from out_of_core_fusion import fuse_out_of_core
+from sparse_spectral import cluster_graph, EIGEN_SOLVERS
+from precision import get_float_dtype, get_precision
+from resources import limit_threads
+from scipy import sparse
 from tqdm.auto import tqdm
 from loguru import logger
 from snf import compute
@@ -40,7 +53,12 @@ class PipelineStep:
 
         logger.debug(f'{self.__class__.__name__} ran in {end - start}.')
 
-        return [df.__class__(df) for df in result] if isinstance(data, list) else data.__class__(result)
+        if isinstance(data, list):
+            return [df.__class__(df) for df in result]
+
+        # A dataframe returned unchanged, or already of the class of the input, keeps its identity, so the indexes
+        # keyed on it still find it
+        return result if result is data or type(result) is type(data) else data.__class__(result)
 
     def _call(self, data: Data) -> Data:
         raise NotImplementedError
@@ -67,7 +85,7 @@ class RetainMainTumors(PipelineStep):
         """
 
         logger.debug('Retaining main tumor samples only...')
-        main_tumors_samples = data.filter(regex='^TCGA-[A-Z0-9]{2}-[A-Z0-9]{4}-01', axis='index')
+        main_tumors_samples = data[BARCODE_INDEX.is_primary_tumor(data.index)]
         logger.debug(f'Main tumor samples: {len(main_tumors_samples)}/{len(data)}')
         return main_tumors_samples
 
@@ -127,10 +145,12 @@ class IntersectDataframes(PipelineStep):
         logger.debug('Intersecting dataframes...')
         data_copy = [df.copy() for df in data]
 
-        indexes = [list(df.index) for df in data_copy]
-        candidates = set(chain(*indexes))
+        # The labels are encoded as integers once, so the intersection is computed on integer codes
+        codes, labels = pd.factorize(np.concatenate([np.asarray(df.index, dtype=object) for df in data_copy]))
+        bounds = np.cumsum([0] + [len(df) for df in data_copy])
+        common = reduce(np.intersect1d, [codes[start:end] for start, end in zip(bounds[:-1], bounds[1:])])
 
-        index = [c for c in candidates if all(c in idx for idx in indexes)]
+        index = labels[common]
 
         data_copy = [cls(data.reindex(index=index)) for cls, data in zip([df.__class__ for df in data], data_copy)]
 
@@ -145,10 +165,14 @@ class IntersectDataframes(PipelineStep):
 class FilterByNanPercentage(PipelineStep):
     """
     Step to filter by NaN percentage.
+
+    The NaN fractions are read from the feature statistics index, and the statistics of the filtered dataframe are
+    derived from the ones of the input and indexed, so the following selectors do not scan the data again.
     """
 
-    def __init__(self, threshold: float = 0):
+    def __init__(self, threshold: float = 0, index: FeatureStatisticsIndex = FEATURE_STATISTICS_INDEX):
         self.threshold = threshold
+        self.index = index
 
     def _call(self, data: Data) -> Data:
         """
@@ -166,30 +190,200 @@ class FilterByNanPercentage(PipelineStep):
         """
 
         logger.debug(f'Filtering by NaN percentage (threshold: {self.threshold})...')
-        nan_counts = data.isna().sum()
-        nan_percs = nan_counts / len(data)
+        statistics = ComputeFeatureStatistics(index=self.index).get_statistics(data=data)
 
-        filtered = data[nan_percs[nan_percs <= self.threshold].index]
-        filtered_out_n = len(data) - len(filtered)
+        filtered = data.__class__(data.loc[:, statistics.features['nan_fraction'] <= self.threshold])
+        filtered_out_n = len(data.columns) - len(filtered.columns)
         logger.log('DEBUG' if not filtered_out_n else 'WARNING',
-                   f'Samples filtered out: {len(data) - len(filtered)}/{len(data)}')
+                   f'Features filtered out: {filtered_out_n}/{len(data.columns)}')
+
+        self.index.put(filtered, statistics.select(data, filtered.columns), persist=False)
 
         return filtered
 
 
-class FilterByVariance(PipelineStep):
+class ImputeKNN(PipelineStep):
     """
-    Step to filter by variance.
+    Step to impute the missing values of each sample from its K nearest neighbors.
+
+    The distances are the NaN-euclidean distances of sklearn's KNNImputer, computed over the features present in both
+    samples and scaled by the fraction of features present. They are computed by blocks of block_size incomplete
+    samples against all the samples, so the memory is bounded by block_size x n however many features there are.
+    Unlike KNNImputer, samples without features in common are never used as donors, so fewer than K donors may be
+    averaged.
+    """
+
+    def __init__(self, K: int = 5, block_size: int = 256):
+        self.K = K
+        self.block_size = block_size
+
+    @staticmethod
+    def get_distances(values: np.ndarray, squares: np.ndarray, present: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Compute the NaN-euclidean distances between the given rows and all the samples.
+
+        Parameters
+        ----------
+        values : np.ndarray
+            The (n, p) values of the samples, with the missing values set to zero.
+        squares : np.ndarray
+            The squares of values.
+        present : np.ndarray
+            The (n, p) mask of the values present, as floats.
+        rows : np.ndarray
+            The positions of the samples of the block.
+
+        Returns
+        -------
+        np.ndarray
+            The (len(rows), n) distances. Pairs of samples without features in common are infinitely distant.
+        """
+
+        overlap = present[rows] @ present.T
+        squared = squares[rows] @ present.T + present[rows] @ squares.T - 2 * values[rows] @ values.T
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            distances = np.sqrt(np.maximum(squared, 0) * values.shape[1] / overlap)
+        distances[overlap == 0] = np.inf
+
+        return distances
+
+    def _call(self, data: Data) -> Data:
+        """
+        Impute the missing values of the given dataframe.
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            The dataframe to impute, with samples on the rows.
+
+        Returns
+        -------
+        pd.DataFrame
+            The imputed dataframe.
+
+        The method works as follows:
+        1. The samples with missing values are split in blocks, and the distances of each block to all the samples
+           are computed with three matrix products.
+        2. For each sample of the block, the samples are sorted by distance, and each missing value is imputed with
+           the mean of the K nearest samples where the feature is present.
+        3. Values without any donor (e.g. features missing in all the other samples) are imputed with the mean of the
+           feature.
+        """
+
+        mask = data.isna().to_numpy()
+        incomplete = np.flatnonzero(mask.any(axis=1))
+        if not len(incomplete):
+            return data
+
+        logger.debug(f'Imputing {mask.sum()} missing values of {len(incomplete)} samples (K: {self.K})...')
+        dtype = np.result_type(*data.dtypes)
+        values = np.where(mask, 0, data.to_numpy(dtype=np.float64))
+        squares = np.square(values)
+        present = (~mask).astype(np.float64)
+        imputed = values.copy()
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = values.sum(axis=0) / present.sum(axis=0)
+
+        for start in range(0, len(incomplete), self.block_size):
+            rows = incomplete[start:start + self.block_size]
+            distances = self.get_distances(values, squares, present, rows)
+            distances[np.arange(len(rows)), rows] = np.inf
+            order = np.argsort(distances, axis=1, kind='stable')
+
+            for position, row in enumerate(rows):
+                missing = np.flatnonzero(mask[row])
+                neighbours = order[position][np.isfinite(distances[position, order[position]])]
+
+                # The donors are searched among the nearest neighbors first, and among all of them only if needed
+                for limit in [4 * self.K, len(neighbours)]:
+                    candidates = neighbours[:limit]
+                    donors = ~mask[np.ix_(candidates, missing)]
+                    donors &= np.cumsum(donors, axis=0) <= self.K
+                    donors_n = donors.sum(axis=0)
+                    if limit >= len(neighbours) or (donors_n == self.K).all():
+                        break
+
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    imputed[row, missing] = np.where(donors_n > 0,
+                                                     (values[np.ix_(candidates, missing)] * donors).sum(axis=0)
+                                                     / donors_n, means[missing])
+
+        logger.debug('Missing values imputed.')
+
+        return pd.DataFrame(imputed.astype(dtype, copy=False), index=data.index, columns=data.columns)
+
+
+class ComputeFeatureStatistics(PipelineStep):
+    """
+    Step to compute the per-feature statistics of the data and store them in the feature statistics index.
+    """
+
+    def __init__(self, index: FeatureStatisticsIndex = FEATURE_STATISTICS_INDEX):
+        self.index = index
+
+    def get_statistics(self, data: Data) -> FeatureStatistics:
+        """
+        Return the statistics of the given dataframe, computing and indexing them if they are not indexed yet.
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            The dataframe to analyze.
+
+        Returns
+        -------
+        FeatureStatistics
+            The statistics of the dataframe.
+        """
+
+        statistics = self.index.get(data)
+
+        if statistics is None:
+            logger.debug('Computing feature statistics...')
+            statistics = compute_feature_statistics(EncodeCategoricalData()(data=data))
+            self.index.put(data, statistics)
+
+        return statistics
+
+    def _call(self, data: Data) -> Data:
+        """
+        Index the statistics of the given dataframe. The dataframe itself is returned unchanged.
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            The dataframe to analyze.
+
+        Returns
+        -------
+        pd.DataFrame
+            The same dataframe.
+        """
+
+        self.get_statistics(data=data)
+        return data
+
+
+class FeatureSelector(PipelineStep):
     """
+    Step to retain the top k features according to a criterion computed from the feature statistics index.
+    """
+
+    criterion: str
 
-    def __init__(self, retain_k: int = 100):
+    def __init__(self, retain_k: int = 100, index: FeatureStatisticsIndex = FEATURE_STATISTICS_INDEX):
         self.retain_k = retain_k
+        self.index = index
+
+    def score(self, statistics: pd.DataFrame) -> pd.Series:
+        raise NotImplementedError
 
     def _call(self, data: Data) -> Data:
         """
-        Filter the given dataframe by variance.
+        Filter the given dataframe by the criterion of the selector.
 
-        The top k features with the highest variance are retained.
+        The top k features with the highest score are retained.
 
         Parameters
         ----------
@@ -202,17 +396,68 @@ class FilterByVariance(PipelineStep):
             The filtered dataframe.
         """
 
-        encoded_data = EncodeCategoricalData()(data=data)
-        variances = encoded_data.var(axis='rows').sort_values(ascending=False)
-        filtered = data[variances[:self.retain_k].index]
+        statistics = ComputeFeatureStatistics(index=self.index).get_statistics(data=data)
+        scores = self.score(statistics.features).sort_values(ascending=False)
+        filtered = data[scores[:self.retain_k].index]
+        logger.debug(f'Features retained by {self.criterion}: {len(filtered.columns)}/{len(data.columns)}')
         return filtered
 
 
+class FilterByVariance(FeatureSelector):
+    """
+    Step to filter by variance.
+    """
+
+    criterion = 'variance'
+
+    def score(self, statistics: pd.DataFrame) -> pd.Series:
+        return statistics['variance']
+
+
+class FilterByMAD(FeatureSelector):
+    """
+    Step to filter by median absolute deviation.
+    """
+
+    criterion = 'mad'
+
+    def score(self, statistics: pd.DataFrame) -> pd.Series:
+        return statistics['mad']
+
+
+class FilterByCoefficientOfVariation(FeatureSelector):
+    """
+    Step to filter by coefficient of variation (standard deviation over the absolute mean).
+    """
+
+    criterion = 'coefficient of variation'
+
+    def score(self, statistics: pd.DataFrame) -> pd.Series:
+        return np.sqrt(statistics['variance']) / statistics['mean'].abs().replace(0, np.nan)
+
+
+class FilterByNanAdjustedVariance(FeatureSelector):
+    """
+    Step to filter by variance, weighted by the fraction of non-missing values of each feature.
+    """
+
+    criterion = 'NaN-adjusted variance'
+
+    def score(self, statistics: pd.DataFrame) -> pd.Series:
+        return statistics['variance'] * (1 - statistics['nan_fraction'])
+
+
 class EncodeCategoricalData(PipelineStep):
     """
     Step to encode categorical data.
+
+    The codes of each column come from its code map in the given index, so a category gets the same code in every
+    call, dataset and run, and unseen categories get new codes without refitting.
     """
 
+    def __init__(self, index: CodeMapIndex = CODE_MAP_INDEX):
+        self.index = index
+
     def _call(self, data: Data) -> Data:
         """
         Encode the categorical data of the given dataframe.
@@ -229,13 +474,16 @@ class EncodeCategoricalData(PipelineStep):
         """
 
         logger.debug('Encoding categorical data...')
-        encoded_data = data.copy(deep=True)
 
-        categorical_columns = [col for col in encoded_data.columns
-                               if encoded_data[col].dtype in ['object', 'string', 'category', ]]
+        categorical_columns = [col for col, dtype in data.dtypes.items() if dtype in ['object', 'string', 'category', ]]
+        if not categorical_columns:
+            logger.debug('0 categorical columns encoded.')
+            return data
 
+        # The encoded columns replace the original ones in a shallow copy, the others are not copied
+        encoded_data = data.copy(deep=False)
         for col in categorical_columns:
-            encoded_data[col] = LabelEncoder().fit_transform(encoded_data[col])
+            encoded_data[col] = self.index.encode(col, data[col])
 
         logger.debug(f'{len(categorical_columns)} categorical columns encoded.')
 
@@ -321,7 +569,7 @@ class TruncateBarcode(PipelineStep):
         """
 
         data_copy = data.copy(deep=True)
-        data_copy.index = data_copy.index.str[:12]
+        data_copy.index = BARCODE_INDEX.get_patients(data.index)
         return data_copy
 
 
@@ -388,8 +636,213 @@ class MinMaxScalerStep(PipelineStep):
 class SimilarityMatrices(PipelineStep):
     """
     Step to compute the similarity matrix.
+
+    The distance matrix of each modality and the distances of each sample to its K_max nearest neighbors are cached, so
+    the similarity matrices for any K <= K_max are computed without computing the distances again. K_max defaults to
+    max(K, 50).
+
+    With the 'approximate' backend, the nearest neighbors are searched with a random projection forest of trees_n trees
+    and only the distances along the neighbors graph are computed: the affinities of the samples that are not
+    neighbors of each other are set to zero.
     """
 
+    backends = ['exact', 'approximate']
+
+    def __init__(self, K: int = 20, mu: float = 0.5, K_max: int | None = None, backend: str = 'exact',
+                 trees_n: int = 8):
+        K_max = max(K, 50) if K_max is None else K_max
+        if K > K_max:
+            raise ValueError(f'K ({K}) must not be greater than K_max ({K_max}).')
+        if backend not in self.backends:
+            raise ValueError(f'Backend {backend} not in {self.backends}.')
+
+        self.K = K
+        self.mu = mu
+        self.K_max = K_max
+        self.backend = backend
+        self.trees_n = trees_n
+        self.cache: dict[str, tuple[np.ndarray | sparse.coo_matrix, np.ndarray]] = {}
+
+    def _get_approximate_neighbourhood(self, samples: np.ndarray) -> tuple[sparse.coo_matrix, np.ndarray]:
+        n = len(samples)
+        indices, neighbours = RandomProjectionForest(trees_n=self.trees_n).kneighbors(samples, K=self.K_max + 1)
+        neighbours = neighbours.astype(samples.dtype, copy=False)
+
+        rows = np.repeat(np.arange(n), indices.shape[1])
+        columns = indices.ravel()
+        values = neighbours.ravel()
+        edges = rows != columns
+
+        # Symmetrize the neighbors graph, keeping each edge once
+        rows, columns = np.concatenate([rows[edges], columns[edges]]), np.concatenate([columns[edges], rows[edges]])
+        values = np.concatenate([values[edges], values[edges]])
+        _, unique = np.unique(rows * n + columns, return_index=True)
+
+        distances = sparse.coo_matrix((values[unique], (rows[unique], columns[unique])), shape=(n, n))
+
+        return distances, neighbours
+
+    @staticmethod
+    def _get_distances(samples: np.ndarray, block_size: int = 1024) -> np.ndarray:
+        # cdist always computes in float64: in lower precisions it is run by blocks of rows, so only a block of float64
+        # distances is allocated at once
+        if samples.dtype == np.float64:
+            return cdist(samples, samples, metric='sqeuclidean')
+
+        distances = np.empty((len(samples), len(samples)), dtype=samples.dtype)
+        for start in range(0, len(samples), block_size):
+            distances[start:start + block_size] = cdist(samples[start:start + block_size], samples, metric='sqeuclidean')
+
+        return distances
+
+    def get_neighbourhoods(self, data: list[Data]) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Return the distance matrix and the sorted nearest neighbors distances of each of the given dataframes.
+
+        Parameters
+        ----------
+        data : list[pd.DataFrame]
+            The dataframes to process.
+
+        Returns
+        -------
+        list[tuple[np.ndarray, np.ndarray]]
+            For each dataframe, the (n, n) squared euclidean distance matrix (a sparse matrix of the neighbors graph
+            with the approximate backend) and the (n, K_max + 1) matrix of the distances of each sample to its nearest
+            neighbors (itself included), sorted in ascending order.
+
+        The method works as follows:
+        1. It looks up each dataframe in the cache by its fingerprint.
+        2. The missing dataframes are encoded and scaled, and their distance matrices are computed.
+        3. The K_max + 1 smallest distances of each row are selected with a partial sort, then sorted.
+        4. The results are stored in the cache and returned.
+        """
+
+        neighbourhoods = []
+
+        for d in data:
+            key = f'{get_data_fingerprint(d)}-{self.backend}-{self.trees_n}-{get_precision()}'
+
+            if key not in self.cache:
+                encoded_data = EncodeCategoricalData()(data=d)
+                scaled_data = ZScoreScaler()(data=encoded_data).to_numpy(dtype=get_float_dtype())
+
+                if self.backend == 'approximate':
+                    self.cache[key] = self._get_approximate_neighbourhood(scaled_data)
+                    neighbourhoods.append(self.cache[key])
+                    continue
+
+                distances = self._get_distances(scaled_data)
+
+                neighbours_n = min(self.K_max + 1, len(distances))
+                neighbours = np.partition(distances, neighbours_n - 1, axis=1)[:, :neighbours_n]
+                neighbours.sort(axis=1)
+
+                self.cache[key] = (distances, neighbours)
+            else:
+                logger.debug('Distances found in cache.')
+
+            neighbourhoods.append(self.cache[key])
+
+        return neighbourhoods
+
+    @staticmethod
+    def kernel(distances: np.ndarray, rows_average: np.ndarray, columns_average: np.ndarray,
+               mu: float = 0.5) -> np.ndarray:
+        """Compute the scaled exponential similarity kernel of snf.compute.affinity_matrix.
+
+        Parameters
+        ----------
+        distances : np.ndarray
+            The distances between pairs of samples, e.g. a (rows, columns) distance matrix or a vector of edges.
+        rows_average : np.ndarray
+            The average distance of the first sample of each pair to its K nearest neighbors, broadcastable with
+            distances (e.g. a column vector for a distance matrix).
+        columns_average : np.ndarray
+            The average distance of the second sample of each pair to its K nearest neighbors, broadcastable with
+            distances (e.g. a row vector for a distance matrix).
+        mu : float
+            The normalization factor of the kernel.
+
+        Returns
+        -------
+        np.ndarray
+            The affinities, with the shape and the type of distances. Missing distances give missing affinities. The
+            temporaries are in the same type, so no float64 matrix is allocated in float32 precision.
+        """
+
+        # The operations of stats.norm.pdf, in place and in the type of the distances
+        mask = np.isnan(distances)
+
+        scale = (rows_average + np.spacing(1)) + (columns_average + np.spacing(1))
+        scale += distances
+        scale /= 3
+        scale[scale <= np.spacing(1)] = 0
+        scale += np.spacing(1)
+
+        np.nan_to_num(scale, copy=False)
+        scale *= mu
+        scale += mask
+
+        matrix = np.nan_to_num(distances)
+        matrix /= scale
+        np.square(matrix, out=matrix)
+        matrix /= -2.0
+        np.exp(matrix, out=matrix)
+        matrix /= np.sqrt(2 * np.pi)
+        matrix /= scale
+        matrix[mask] = np.nan
+
+        return matrix
+
+    def get_affinities(self, neighbourhoods: list[tuple[np.ndarray, np.ndarray]], index: pd.Index,
+                       K: int | None = None) -> list[pd.DataFrame]:
+        """Compute the affinity matrices from the given neighbourhoods.
+
+        This is equivalent to snf.compute.affinity_matrix, but the average distance of each sample to its K nearest
+        neighbors is read from the precomputed neighbours distances instead of sorting the whole distance matrix.
+
+        Parameters
+        ----------
+        neighbourhoods : list[tuple[np.ndarray, np.ndarray]]
+            The distance matrices and nearest neighbors distances, as returned by get_neighbourhoods.
+        index : pd.Index
+            The samples the distance matrices refer to.
+        K : int, optional
+            The number of neighbors to consider. Default is the K of the step.
+
+        Returns
+        -------
+        list[pd.DataFrame]
+            The similarity matrices.
+        """
+
+        K = self.K if K is None else K
+        if K > self.K_max:
+            raise ValueError(f'K ({K}) must not be greater than K_max ({self.K_max}).')
+
+        matrices = []
+
+        for distances, neighbours in neighbourhoods:
+            average = neighbours[:, 1:K + 1].mean(axis=1)
+
+            if sparse.issparse(distances):
+                matrix = np.zeros(distances.shape, dtype=distances.dtype)
+                matrix[distances.row, distances.col] = self.kernel(distances.data, rows_average=average[distances.row],
+                                                                   columns_average=average[distances.col], mu=self.mu)
+                matrix[np.diag_indices_from(matrix)] = self.kernel(np.zeros_like(average), rows_average=average,
+                                                                   columns_average=average, mu=self.mu)
+                matrices.append(matrix)
+                continue
+
+            distances = distances.copy()
+            np.fill_diagonal(distances, 0)
+
+            matrix = self.kernel(distances, rows_average=average[:, np.newaxis],
+                                 columns_average=average[np.newaxis, :], mu=self.mu)
+            matrices.append((matrix + matrix.T) / 2)
+
+        return [pd.DataFrame(matrix, index=index, columns=index) for matrix in matrices]
+
     def _call(self, data: list[Data]) -> list[pd.DataFrame]:
         """Compute the similarity matrix of the given dataframe.
 
@@ -404,16 +857,8 @@ class SimilarityMatrices(PipelineStep):
             The similarity matrix.
         """
 
-        logger.debug(f'Computing similarity matrix...')
-        encoder = EncodeCategoricalData()
-        encoded_data = [encoder(d) for d in data]
-
-        scalser = ZScoreScaler()
-        scaled_data = [scalser(d) for d in encoded_data]
-
-        matrices = compute.make_affinity(scaled_data, K=20, normalize=False)
-        index = data[0].index
-        similarity_matrix = [pd.DataFrame(matrix, index=index, columns=index) for matrix in matrices]
+        logger.debug(f'Computing similarity matrix (K: {self.K})...')
+        similarity_matrix = self.get_affinities(self.get_neighbourhoods(data), index=data[0].index)
         logger.debug('Similarity matrix computed.')
 
         return similarity_matrix
@@ -441,7 +886,8 @@ class DownstreamStep:
         logger.debug(f'Running {self.__class__.__name__}...')
 
         start = datetime.now()
-        result = self._call(data=data, *args, **kwargs)
+        with limit_threads():
+            result = self._call(data=data, *args, **kwargs)
         end = datetime.now()
 
         logger.debug(f'{self.__class__.__name__} ran in {end - start}.')
@@ -487,8 +933,75 @@ class ComputeMatricesAverage(DownstreamStep):
 class ComputeSNF(DownstreamStep):
     """
     Step to compute the similarity matrix.
+
+    When landmarks_n is set, the cross-diffusion runs in a low-rank space with fuse_low_rank: each status matrix is a
+    Nyström factorization over landmarks_n landmarks drawn with random_state, which scales to cohorts where the dense
+    n x n x n products are infeasible.
+
+    When memory_budget is set instead, the diffusion runs out of core with fuse_out_of_core: the status matrices are
+    stored as memmapped tiles under scratch_path and processed by panels fitting in memory_budget bytes. The seconds
+    spent in I/O and in computation by each iteration of the last call are stored in io_report.
     """
 
+    io_report: pd.DataFrame | None = None
+
+    def __init__(self, K: int = 20, t: int = 20, alpha: float = 1.0, landmarks_n: int | None = None,
+                 random_state: int = 0, memory_budget: int | None = None, scratch_path: str | None = None):
+        self.K = K
+        self.t = t
+        self.alpha = alpha
+        self.landmarks_n = landmarks_n
+        self.random_state = random_state
+        self.memory_budget = memory_budget
+        self.scratch_path = scratch_path
+
+    def fuse(self, data: list[pd.DataFrame]) -> np.ndarray:
+        """Run the SNF cross-diffusion in the current precision.
+
+        This follows snf.compute.snf, which always works in float64, but keeps the matrices in the floating point type
+        of the current precision.
+
+        Parameters
+        ----------
+        data : list[pd.DataFrame]
+            The similarity matrices of the modalities.
+
+        Returns
+        -------
+        np.ndarray
+            The fused similarity matrix.
+        """
+
+        dtype = get_float_dtype()
+        affinities = [df.to_numpy(dtype=dtype, copy=True) for df in data]
+        n_aff = (len(affinities) - np.sum([np.isnan(a) for a in affinities], axis=0)).astype(dtype)
+
+        status = []
+        dominant = []
+        for affinity in affinities:
+            affinity = affinity / np.nansum(affinity, axis=1, keepdims=True)
+            affinity = check_symmetric(affinity, raise_warning=False)
+            dominant.append(snf.compute._find_dominate_set(affinity, int(self.K)))
+            status.append(affinity)
+
+        status_sum = np.nansum(status, axis=0)
+
+        for _ in range(self.t):
+            for n, matrix in enumerate(status):
+                nz_dominant = np.nan_to_num(dominant[n])
+                propagated = nz_dominant @ (status_sum - np.nan_to_num(matrix)) @ nz_dominant.T / (n_aff - 1)
+                propagated[np.diag_indices_from(propagated)] += self.alpha
+                status[n] = check_symmetric(propagated, raise_warning=False)
+
+            status_sum = np.nansum(status, axis=0)
+
+        fused = status_sum / len(status)
+        fused = fused / np.nansum(fused, axis=1, keepdims=True)
+        fused = (fused + fused.T) / 2
+        fused[np.diag_indices_from(fused)] += 0.5
+
+        return fused
+
     def _call(self, data: list[pd.DataFrame], *args, **kwargs) -> pd.DataFrame:
         """Compute the similarity matrix of the given dataframe.
 
@@ -503,9 +1016,20 @@ class ComputeSNF(DownstreamStep):
             The similarity matrix.
         """
 
-        logger.debug('Computing SNF...')
-
-        fusion = snf.compute.snf(data, K=20, t=20)
+        logger.debug(f'Computing SNF (K: {self.K}, t: {self.t}, precision: {get_precision()}, '
+                     f'landmarks: {self.landmarks_n}, memory budget: {self.memory_budget})...')
+
+        if self.landmarks_n is not None:
+            fusion = fuse_low_rank([df.to_numpy(dtype=get_float_dtype()) for df in data], K=self.K, t=self.t,
+                                   alpha=self.alpha, landmarks_n=self.landmarks_n, random_state=self.random_state)
+        elif self.memory_budget is not None:
+            fusion, self.io_report = fuse_out_of_core(data, K=self.K, t=self.t, alpha=self.alpha,
+                                                      memory_budget=self.memory_budget,
+                                                      scratch_path=self.scratch_path, dtype=get_float_dtype())
+        elif get_precision() == 'float64':
+            fusion = snf.compute.snf(data, K=self.K, t=self.t, alpha=self.alpha)
+        else:
+            fusion = self.fuse(data)
         result = pd.DataFrame(fusion, index=data[0].index, columns=data[0].index)
 
         logger.debug('SNF computed.')
@@ -516,8 +1040,12 @@ class ComputeSNF(DownstreamStep):
 class ComputeKMedoids(DownstreamStep):
     """
     Step to compute the similarity matrix.
+
+    The positions of the medoids found by the last call are stored in medoid_indices.
     """
 
+    medoid_indices: np.ndarray | None = None
+
     def _call(self, data: pd.DataFrame, clusters_n: int = 3, *args, **kwargs) -> pd.Series:
         """Compute the similarity matrix of the given dataframe.
 
@@ -539,8 +1067,10 @@ class ComputeKMedoids(DownstreamStep):
         normalized_similarity = scaler.fit_transform(data)
         distances = scaler.fit_transform(1 - normalized_similarity)
 
-        clusters = KMedoids(n_clusters=clusters_n, random_state=0, metric='precomputed', method='pam').fit_predict(distances)
+        model = KMedoids(n_clusters=clusters_n, random_state=0, metric='precomputed', method='pam')
+        clusters = model.fit_predict(distances)
         clusters = pd.Series(clusters, index=data.index)
+        self.medoid_indices = model.medoid_indices_
 
         logger.debug('Clustering computed.')
 
@@ -550,8 +1080,28 @@ class ComputeKMedoids(DownstreamStep):
 class ComputeSpectralClustering(DownstreamStep):
     """
     Step to compute the similarity matrix.
+
+    With the 'sparse' backend, the matrix is sparsified to its K nearest neighbors graph and the eigenvectors of its
+    normalized Laplacian are found with an iterative eigen_solver (see sparse_spectral.cluster_graph), instead of the
+    dense eigendecomposition of SpectralClustering. The seeds of the eigensolver and of k-means can be fixed for
+    reproducibility; kmeans_random_state is the random_state of SpectralClustering with the 'dense' backend.
     """
 
+    backends = ['dense', 'sparse']
+
+    def __init__(self, backend: str = 'dense', K: int = 20, eigen_solver: str = 'arpack',
+                 eigen_random_state: int | None = None, kmeans_random_state: int | None = None):
+        if backend not in self.backends:
+            raise ValueError(f'Backend {backend} not in {self.backends}.')
+        if eigen_solver not in EIGEN_SOLVERS:
+            raise ValueError(f'Eigen solver {eigen_solver} not in {EIGEN_SOLVERS}.')
+
+        self.backend = backend
+        self.K = K
+        self.eigen_solver = eigen_solver
+        self.eigen_random_state = eigen_random_state
+        self.kmeans_random_state = kmeans_random_state
+
     def _call(self, data: pd.DataFrame, clusters_n: int = 3, *args, **kwargs) -> pd.Series:
         """Compute the similarity matrix of the given dataframe.
 
@@ -568,9 +1118,15 @@ class ComputeSpectralClustering(DownstreamStep):
             The similarity matrix.
         """
 
-        logger.debug('Computing Spectral Clustering...')
+        logger.debug(f'Computing Spectral Clustering (backend: {self.backend})...')
 
-        clusters = SpectralClustering(n_clusters=clusters_n, affinity='precomputed', n_neighbors=20).fit_predict(data)
+        if self.backend == 'sparse':
+            clusters = cluster_graph(data.to_numpy(), clusters_n=clusters_n, K=self.K, eigen_solver=self.eigen_solver,
+                                     eigen_random_state=self.eigen_random_state,
+                                     kmeans_random_state=self.kmeans_random_state)
+        else:
+            clusters = SpectralClustering(n_clusters=clusters_n, affinity='precomputed', n_neighbors=20,
+                                          random_state=self.kmeans_random_state).fit_predict(data)
         clusters = pd.Series(clusters, index=data.index)
 
         logger.debug('Clustering computed.')
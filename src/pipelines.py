@@ -1,6 +1,7 @@
 from pipeline_steps import (PipelineStep, IntersectDataframes, RemoveFFPESamples, FilterByNanPercentage,
-                            FilterByVariance, RetainMainTumors, TruncateBarcode,
+                            FilterByVariance, RetainMainTumors, TruncateBarcode, ComputeFeatureStatistics,
                             ComputeSNF, ComputeKMedoids, SortByIndex)
+from resources import limit_threads
 from datetime import datetime
 from typing import Iterable
 from loguru import logger
@@ -33,7 +34,7 @@ class Pipeline:
         The method works as follows:
         1. It logs the start of the pipeline execution.
         2. It records the start time of the pipeline execution.
-        3. It runs the first step of the pipeline on the given data and stores the result.
+        3. Within the thread budget (see resources.limit_threads), it runs the first step of the pipeline on the given data and stores the result.
         4. It iterates over the remaining steps of the pipeline, running each step on the result of the previous step and updating the result.
         5. It records the end time of the pipeline execution.
         6. It logs the duration of the pipeline execution.
@@ -43,10 +44,11 @@ class Pipeline:
         logger.debug(f'Running {self.__class__.__name__} pipeline...')
         start = datetime.now()
 
-        result = self.steps[0](data=data)
+        with limit_threads():
+            result = self.steps[0](data=data)
 
-        for step in self.steps[1:]:
-            result = step(data=result)
+            for step in self.steps[1:]:
+                result = step(data=result)
 
         end = datetime.now()
         logger.debug(f'Pipeline ran in {end - start}.')
@@ -62,6 +64,7 @@ class ExperimentPipeline(Pipeline):
     data_type: str
     steps = [RetainMainTumors(),
              FilterByNanPercentage(),
+             ComputeFeatureStatistics(),
              FilterByVariance(),
              TruncateBarcode()]
 
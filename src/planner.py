@@ -0,0 +1,365 @@
+from pipeline_steps import (FilterByNanPercentage, ComputeFeatureStatistics, FilterByVariance, SimilarityMatrices,
+                            ComputeMatricesAverage, ComputeSNF, ComputeKMedoids, ComputeSpectralClustering)
+from settings import PROTEINS_PATH, MIRNA_PATH, MRNA_PATH, CACHE_PATH, MEMORY_BUDGET
+from analysis import get_metrics, plot_similarity_heatmap
+from precision import PRECISIONS, get_precision, use_precision
+from data_loaders import open_csv
+from models import ProteinsData
+from loguru import logger
+from sys import stdout
+import pandas as pd
+import numpy as np
+import argparse
+import tempfile
+import json
+import time
+import io
+import os
+
+STAGES = ['loading', 'preprocessing', 'similarity', 'fusion', 'clustering', 'metrics', 'heatmaps']
+
+# Seconds per unit of work of each stage (see get_units), fitted by calibrate_coefficients on a single core
+DEFAULT_COEFFICIENTS = {'loading': 3.8e-07,
+                        'preprocessing': 1.1e-06,
+                        'similarity': 3.0e-09,
+                        'similarity-approximate': 5.9e-07,
+                        'fusion': 5.8e-10,
+                        'clustering': 2.7e-09,
+                        'metrics': 7.9e-08,
+                        'heatmaps': 2.7e-05}
+
+COEFFICIENTS_PATH = os.path.join(CACHE_PATH, 'planner-coefficients.json')
+
+# Engines switched on, in order, while the estimated peak memory exceeds the budget
+ENGINE_FALLBACKS = [{'precision': 'float32'},
+                    {'backend': 'approximate'},
+                    {'heatmaps': False}]
+
+# Bytes of the rows materialized by plot_similarity_heatmap for each pair of samples
+HEATMAP_CELL_BYTES = 250
+
+
+def read_csv_shape(file_path: str) -> tuple[int, int]:
+    """
+    This function returns the number of rows and of columns of the given CSV file (plain or compressed), without the
+    header and the index column, parsing the header only and counting the lines of the rest of the file.
+    """
+
+    with open_csv(file_path) as file:
+        header = file.readline()
+        columns_n = len(pd.read_csv(io.BytesIO(header), nrows=0).columns) - 1
+        lines_n, last = 0, b'\n'
+        for chunk in iter(lambda: file.read(1 << 24), b''):
+            lines_n, last = lines_n + chunk.count(b'\n'), chunk[-1:]
+
+    return lines_n + (last != b'\n'), columns_n
+
+
+def get_available_memory() -> int:
+    """
+    This function returns the memory available to new allocations, in bytes.
+    """
+
+    try:
+        with open('/proc/meminfo') as meminfo:
+            fields = dict(line.split(':', 1) for line in meminfo)
+        return int(fields['MemAvailable'].split()[0]) * 1024
+    except (OSError, KeyError):
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def get_units(stage: str, samples_n: int, features_n: list[int], retain_k: int = 100, t: int = 20,
+              backend: str = 'exact') -> float:
+    """
+    This function returns the amount of work of the given stage, in the units its runtime coefficient refers to.
+    """
+
+    n, m = samples_n, len(features_n)
+    retained_n = [min(retain_k, p) for p in features_n]
+
+    units = {'loading': sum(features_n) * n,
+             'preprocessing': sum(features_n) * n,
+             'similarity': sum(retained_n) * n ** 2 if backend == 'exact' else m * n ** 2,
+             'fusion': t * m * n ** 3,
+             'clustering': n ** 3,
+             'metrics': (m + 3) * n ** 2,
+             'heatmaps': m * n ** 2}
+
+    return float(units[stage])
+
+
+def get_peak_bytes(stage: str, samples_n: int, features_n: list[int], retain_k: int = 100, K_max: int = 50,
+                   precision: str = 'float64', backend: str = 'exact', heatmaps: bool = True) -> float:
+    """
+    This function estimates the peak memory of the given stage, as the data held from the previous stages plus the
+    temporaries of the stage. Some temporaries are float64 whatever the precision (the loaded CSV, the scalers and
+    snfpy); the similarity kernel works in place in the current precision.
+    """
+
+    n, m = samples_n, len(features_n)
+    b = np.dtype(PRECISIONS[precision]).itemsize
+    modalities = sum(features_n) * n * b
+    selected = sum(min(retain_k, p) for p in features_n) * n * b
+    held = selected + (m + 2) * b * n ** 2
+
+    if backend == 'exact':
+        similarity = selected + 2 * m * b * n ** 2 + (5 * b + 1) * n ** 2
+    else:
+        similarity = selected + (m + 1) * b * n ** 2 + m * n * (K_max + 1) * 2 * (b + 16)
+
+    fusion_itemsize = 8 if precision == 'float64' else b
+    peaks = {'loading': modalities + 2 * 8 * max(features_n) * n,
+             'preprocessing': modalities + 3 * 8 * max(features_n) * n,
+             'similarity': similarity,
+             'fusion': selected + (m + 2) * b * n ** 2 + (2 * m + 2) * fusion_itemsize * n ** 2,
+             'clustering': held + 4 * 8 * n ** 2,
+             'metrics': held + 3 * 8 * n ** 2,
+             'heatmaps': held + HEATMAP_CELL_BYTES * n ** 2 if heatmaps else 0}
+
+    return float(peaks[stage])
+
+
+def load_coefficients(coefficients_path: str = COEFFICIENTS_PATH) -> dict[str, float]:
+    """
+    This function returns the runtime coefficients fitted by calibrate_coefficients, or the default ones if the
+    calibration was never run.
+    """
+
+    if not os.path.isfile(coefficients_path):
+        return DEFAULT_COEFFICIENTS
+
+    with open(coefficients_path) as file:
+        return DEFAULT_COEFFICIENTS | json.load(file)
+
+
+def estimate_stages(samples_n: int, features_n: list[int], retain_k: int = 100, K_max: int = 50, t: int = 20,
+                    precision: str = 'float64', backend: str = 'exact', heatmaps: bool = True,
+                    coefficients: dict[str, float] | None = None) -> pd.DataFrame:
+    """
+    This function estimates the peak memory and the runtime of each stage of a run.
+
+    Parameters
+    ----------
+    samples_n : int
+        The number of samples.
+    features_n : list[int]
+        The number of features of each modality.
+    retain_k, K_max, t : int
+        The parameters of the run.
+    precision : str
+        The floating point precision of the run.
+    backend : str
+        The nearest neighbors backend of SimilarityMatrices.
+    heatmaps : bool
+        Whether the similarity heatmaps are plotted.
+    coefficients : dict[str, float], optional
+        The runtime coefficients. Default is load_coefficients().
+
+    Returns
+    -------
+    pd.DataFrame
+        Indexed by stage, with the estimated peak bytes and seconds of each stage.
+    """
+
+    coefficients = load_coefficients() if coefficients is None else coefficients
+    records = []
+
+    for stage in STAGES:
+        if stage == 'heatmaps' and not heatmaps:
+            records.append({'stage': stage, 'peak_bytes': 0.0, 'seconds': 0.0})
+            continue
+
+        key = 'similarity-approximate' if stage == 'similarity' and backend == 'approximate' else stage
+        units = get_units(stage, samples_n, features_n, retain_k=retain_k, t=t, backend=backend)
+        records.append({'stage': stage,
+                        'peak_bytes': get_peak_bytes(stage, samples_n, features_n, retain_k=retain_k, K_max=K_max,
+                                                     precision=precision, backend=backend, heatmaps=heatmaps),
+                        'seconds': coefficients[key] * units})
+
+    return pd.DataFrame(records).set_index('stage')
+
+
+def plan_run(modality_paths: list[str], memory_budget: int | None = MEMORY_BUDGET, retain_k: int = 100,
+             K_max: int = 50, t: int = 20, precision: str | None = None, backend: str = 'exact',
+             heatmaps: bool = True) -> tuple[dict, pd.DataFrame]:
+    """
+    This function plans a run from the shapes of the modality CSV files, switching to lighter engines when the
+    estimated peak memory exceeds the budget.
+
+    Parameters
+    ----------
+    modality_paths : list[str]
+        The CSV files of the modalities, with the features on the rows and the samples on the columns.
+    memory_budget : int, optional
+        The memory budget, in bytes. Default is the memory currently available.
+    retain_k, K_max, t : int
+        The parameters of the run.
+    precision : str, optional
+        The requested floating point precision. Default is the current precision.
+    backend : str
+        The requested nearest neighbors backend.
+    heatmaps : bool
+        Whether the similarity heatmaps are requested.
+
+    Returns
+    -------
+    tuple[dict, pd.DataFrame]
+        The configuration of the run (precision, backend and heatmaps) and its estimates, see estimate_stages.
+
+    Raises
+    ------
+    MemoryError
+        If the estimated peak memory exceeds the budget with all the fallbacks in ENGINE_FALLBACKS.
+
+    The function works as follows:
+    1. It reads the shape of each CSV file. The number of samples is the largest one, an upper bound of the number
+       of samples left by the alignment.
+    2. It estimates the stages with the requested configuration.
+    3. While the peak memory exceeds the budget, it switches on the next fallback engine and estimates again.
+    """
+
+    memory_budget = get_available_memory() if memory_budget is None else memory_budget
+    shapes = [read_csv_shape(path) for path in modality_paths]
+    features_n = [rows for rows, _ in shapes]
+    samples_n = max(columns for _, columns in shapes)
+    logger.info(f'Planning a run on {samples_n} samples and {features_n} features, '
+                f'budget {memory_budget / 1024 ** 3:.2f} GiB...')
+
+    configuration = {'precision': precision or get_precision(), 'backend': backend, 'heatmaps': heatmaps}
+    parameters = {'retain_k': retain_k, 'K_max': K_max, 't': t}
+    estimates = estimate_stages(samples_n, features_n, **parameters, **configuration)
+
+    for fallback in ENGINE_FALLBACKS:
+        peak = estimates['peak_bytes'].max()
+        if peak <= memory_budget:
+            break
+
+        logger.warning(f'Estimated peak memory {peak / 1024 ** 3:.2f} GiB ({estimates["peak_bytes"].idxmax()}) '
+                       f'exceeds the budget, switching to {fallback}.')
+        configuration |= fallback
+        estimates = estimate_stages(samples_n, features_n, **parameters, **configuration)
+
+    peak = estimates['peak_bytes'].max()
+    if peak > memory_budget:
+        raise MemoryError(f'Estimated peak memory {peak / 1024 ** 3:.2f} GiB ({estimates["peak_bytes"].idxmax()}) '
+                          f'exceeds the budget of {memory_budget / 1024 ** 3:.2f} GiB with {configuration}.')
+
+    logger.info(f'Run planned with {configuration}: peak {peak / 1024 ** 3:.2f} GiB, '
+                f'about {estimates["seconds"].sum():.0f}s.')
+
+    return configuration, estimates
+
+
+def calibrate_coefficients(sizes: list[int] = (100, 200, 400), features_n: int = 200, t: int = 20,
+                           coefficients_path: str | None = COEFFICIENTS_PATH) -> dict[str, float]:
+    """
+    This function fits the runtime coefficients on synthetic data, running each stage with increasing numbers of
+    samples and fitting seconds = coefficient * units by least squares.
+
+    Parameters
+    ----------
+    sizes : list[int]
+        The numbers of samples to be benchmarked.
+    features_n : int
+        The number of features of each of the three synthetic modalities.
+    t : int
+        The number of SNF iterations.
+    coefficients_path : str, optional
+        The JSON file where the coefficients are saved, read afterwards by load_coefficients. None to skip saving.
+
+    Returns
+    -------
+    dict[str, float]
+        The fitted coefficients.
+    """
+
+    rng = np.random.default_rng(0)
+    durations = {key: [] for key in DEFAULT_COEFFICIENTS}
+    units = {key: [] for key in DEFAULT_COEFFICIENTS}
+
+    def measure(key: str, stage: str, n: int, function, backend: str = 'exact'):
+        start = time.perf_counter()
+        result = function()
+        durations[key].append(time.perf_counter() - start)
+        units[key].append(get_units(stage, n, [features_n] * 3, retain_k=features_n, t=t, backend=backend))
+        return result
+
+    for n in sizes:
+        logger.info(f'Calibrating on {n} samples...')
+        index = pd.Index([f'sample-{i}' for i in range(n)])
+        frame = pd.DataFrame(rng.normal(size=(features_n, n)), columns=index)
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, f'modality-{i}.csv') for i in range(3)]
+            for path in paths:
+                frame.to_csv(path)
+            loaded = measure('loading', 'loading', n,
+                             lambda: [ProteinsData(pd.read_csv(path, index_col=0).T) for path in paths])
+
+        steps = [FilterByNanPercentage(), ComputeFeatureStatistics(), FilterByVariance(retain_k=features_n)]
+        modalities = measure('preprocessing', 'preprocessing', n,
+                             lambda: [ProteinsData(d) for d in [_run_steps(steps, d) for d in loaded]])
+
+        similarity = measure('similarity', 'similarity', n, lambda: SimilarityMatrices()(data=modalities))
+        measure('similarity-approximate', 'similarity', n,
+                lambda: SimilarityMatrices(backend='approximate')(data=modalities), backend='approximate')
+
+        fused = measure('fusion', 'fusion', n, lambda: ComputeSNF(t=t)(data=similarity))
+        average = ComputeMatricesAverage()(data=similarity)
+
+        matrices = similarity + [average, fused]
+        labels = measure('clustering', 'clustering', n,
+                         lambda: [ComputeKMedoids()(data=matrix) for matrix in matrices]
+                                 + [ComputeSpectralClustering()(data=fused)])
+        true_labels = pd.Series(rng.integers(0, 3, size=n), index=index)
+        measure('metrics', 'metrics', n,
+                lambda: [get_metrics(true_labels=true_labels, predicted_labels=predicted, similarity_data=matrix,
+                                     metrics_label='Calibration') for predicted, matrix in zip(labels, matrices)])
+        measure('heatmaps', 'heatmaps', n,
+                lambda: [plot_similarity_heatmap(matrix, data_type='Calibration') for matrix in similarity])
+
+    coefficients = {key: float(np.dot(durations[key], units[key]) / np.dot(units[key], units[key]))
+                    for key in durations}
+
+    if coefficients_path is not None:
+        os.makedirs(os.path.dirname(coefficients_path), exist_ok=True)
+        with open(coefficients_path, 'w') as file:
+            json.dump(coefficients, file, indent=4)
+        logger.info(f'Coefficients saved to {coefficients_path}.')
+
+    return coefficients
+
+
+def _run_steps(steps: list, data):
+    for step in steps:
+        data = step(data=data)
+    return data
+
+
+if __name__ == '__main__':
+    logger.remove()
+    logger.add(stdout, level='INFO', colorize=True,
+               format='<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[data_type]} | <level>{message}</level>')
+    logger.configure(extra={'data_type': 'None'})
+
+    parser = argparse.ArgumentParser(description='Estimate the peak memory and the runtime of each stage of a run.')
+    parser.add_argument('--paths', type=str, nargs='+', default=[PROTEINS_PATH, MIRNA_PATH, MRNA_PATH])
+    parser.add_argument('--memory-budget-gb', type=float, default=None)
+    parser.add_argument('--retain-k', type=int, default=100)
+    parser.add_argument('--t', type=int, default=20)
+    parser.add_argument('--precision', type=str, choices=list(PRECISIONS), default='float64')
+    parser.add_argument('--backend', type=str, choices=SimilarityMatrices.backends, default='exact')
+    parser.add_argument('--calibrate', action='store_true',
+                        help='Fit the runtime coefficients on synthetic data before planning.')
+    args = parser.parse_args()
+
+    if args.calibrate:
+        with use_precision(args.precision):
+            print(pd.Series(calibrate_coefficients(t=args.t)).to_string())
+
+    configuration, estimates = plan_run(
+        args.paths, memory_budget=int(args.memory_budget_gb * 1024 ** 3) if args.memory_budget_gb else None,
+        retain_k=args.retain_k, t=args.t, precision=args.precision, backend=args.backend)
+
+    print(configuration)
+    print(estimates.assign(peak_gib=estimates['peak_bytes'] / 1024 ** 3).to_string())
@@ -0,0 +1,54 @@
+from contextlib import contextmanager
+from settings import PRECISION
+from loguru import logger
+import numpy as np
+
+PRECISIONS = {'float32': np.float32, 'float64': np.float64}
+
+_precision = PRECISION
+
+
+def set_precision(precision: str):
+    """
+    This function sets the floating point precision of the modality, similarity and fused matrices, for the whole
+    process. Processes forked afterwards inherit it.
+
+    Parameters
+    ----------
+    precision : str
+        Either 'float32' or 'float64'.
+    """
+
+    global _precision
+
+    if precision not in PRECISIONS:
+        raise ValueError(f'Precision {precision} not in {list(PRECISIONS)}.')
+
+    _precision = precision
+    logger.debug(f'Precision set to {precision}.')
+
+
+def get_precision() -> str:
+    return _precision
+
+
+def get_float_dtype() -> type:
+    """
+    This function returns the numpy floating point type of the current precision.
+    """
+
+    return PRECISIONS[_precision]
+
+
+@contextmanager
+def use_precision(precision: str):
+    """
+    Context manager setting the given precision and restoring the previous one on exit.
+    """
+
+    previous = get_precision()
+    set_precision(precision)
+    try:
+        yield
+    finally:
+        set_precision(previous)
@@ -0,0 +1,84 @@
+from experiment import load_experiment, cluster_experiment, get_true_labels
+from sklearn.metrics import adjusted_rand_score
+from precision import use_precision
+from analysis import get_metrics, metrics_to_record
+from loguru import logger
+from sys import stdout
+import pandas as pd
+import argparse
+import os.path
+import time
+import os
+
+
+def get_precision_report(retain_k: int = 100, K: int = 20, t: int = 20, clusters_n: int = 3) -> pd.DataFrame:
+    """
+    This function runs the whole experiment, from loading to clustering, in float64 and in float32, and compares the
+    two runs.
+
+    Parameters
+    ----------
+    retain_k : int
+        The number of features retained for each modality.
+    K, t : int
+        The SNF parameters.
+    clusters_n : int
+        The number of clusters to be detected.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per method, with the adjusted rand score between the float64 and float32 cluster labels, the metrics of
+        both runs and their difference, and the duration of both runs.
+    """
+
+    runs = {}
+    for precision in ['float64', 'float32']:
+        logger.info(f'Running the experiment in {precision}...')
+        start = time.perf_counter()
+        with use_precision(precision):
+            proteins_data, mirna_data, mrna_data, _, subtypes_data = load_experiment(retain_k=retain_k)
+            clusterings = cluster_experiment([proteins_data, mirna_data, mrna_data], K=K, t=t, clusters_n=clusters_n)
+        duration = time.perf_counter() - start
+
+        true_labels = get_true_labels(subtypes_data)
+        runs[precision] = {label: (predicted_labels,
+                                   metrics_to_record(get_metrics(true_labels=true_labels,
+                                                                 predicted_labels=predicted_labels,
+                                                                 similarity_data=similarity_matrix,
+                                                                 metrics_label=label)),
+                                   duration)
+                           for label, predicted_labels, similarity_matrix in clusterings}
+
+    records = []
+    for label, (labels_64, metrics_64, duration_64) in runs['float64'].items():
+        labels_32, metrics_32, duration_32 = runs['float32'][label]
+        record = {'label': label,
+                  'labels adjusted_rand_score': adjusted_rand_score(labels_64, labels_32.reindex(labels_64.index))}
+        for score, value in metrics_64.items():
+            record |= {f'{score} float64': value, f'{score} float32': metrics_32[score],
+                       f'{score} difference': metrics_32[score] - value}
+        records.append(record | {'float64 seconds': duration_64, 'float32 seconds': duration_32})
+
+    return pd.DataFrame(records)
+
+
+if __name__ == '__main__':
+    logger.remove()
+    logger.add(stdout, level='INFO', colorize=True,
+               format='<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[data_type]} | <level>{message}</level>')
+    logger.configure(extra={'data_type': 'None'})
+
+    parser = argparse.ArgumentParser(description='Compare the float32 and float64 runs of the experiment.')
+    parser.add_argument('--retain-k', type=int, default=100)
+    parser.add_argument('--K', type=int, default=20)
+    parser.add_argument('--t', type=int, default=20)
+    parser.add_argument('--clusters-n', type=int, default=3)
+    parser.add_argument('--report', type=str, default='../results/precision.csv')
+    args = parser.parse_args()
+
+    report = get_precision_report(retain_k=args.retain_k, K=args.K, t=args.t, clusters_n=args.clusters_n)
+
+    os.makedirs(os.path.dirname(args.report), exist_ok=True)
+    report.to_csv(args.report, index=False)
+    print(report.to_string())
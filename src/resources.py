@@ -0,0 +1,129 @@
+from threadpoolctl import ThreadpoolController
+from contextlib import contextmanager
+from settings import THREADS
+from loguru import logger
+# Imported so their thread pools are loaded before being inspected, see get_controller
+import sklearn.cluster
+import scipy.linalg
+import os
+
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS',
+                    'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+_threads = THREADS
+_controller: ThreadpoolController | None = None
+
+
+def get_available_cores() -> int:
+    """
+    This function returns the number of cores the current process is allowed to run on.
+    """
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def set_threads(threads: int | None):
+    """
+    This function sets the thread budget of the BLAS and OpenMP pools (NumPy, SciPy, scikit-learn) for the whole
+    process, resizing the pools already loaded. The thread variables of the environment are set as well, so the
+    processes spawned afterwards start with the same budget.
+
+    Parameters
+    ----------
+    threads : int, optional
+        The number of threads. Default is the number of available cores.
+    """
+
+    global _threads
+
+    if threads is not None and threads < 1:
+        raise ValueError(f'Threads must be at least 1, got {threads}.')
+
+    _threads = threads
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(get_threads())
+    get_controller().limit(limits=get_threads())
+    logger.debug(f'Threads set to {get_threads()}.')
+
+
+def get_threads() -> int:
+    return _threads if _threads is not None else get_available_cores()
+
+
+def get_controller() -> ThreadpoolController:
+    """
+    This function returns the controller of the thread pools of the process. It inspects the loaded libraries on
+    first call only, as the inspection is costly, so it must be called after importing NumPy, SciPy and scikit-learn.
+    """
+
+    global _controller
+
+    if _controller is None:
+        _controller = ThreadpoolController()
+
+    return _controller
+
+
+@contextmanager
+def limit_threads():
+    """
+    Context manager limiting the BLAS and OpenMP pools to the current thread budget, restoring their previous size on
+    exit. Pipelines and downstream steps run within it.
+    """
+
+    with get_controller().limit(limits=get_threads()):
+        yield
+
+
+@contextmanager
+def use_threads(threads: int | None):
+    """
+    Context manager setting the given thread budget, restoring the previous one on exit.
+    """
+
+    previous = _threads
+    set_threads(threads)
+    try:
+        with limit_threads():
+            yield
+    finally:
+        set_threads(previous)
+
+
+def split_threads(workers_n: int | None = None) -> tuple[int, int]:
+    """
+    This function divides the thread budget between concurrent workers (e.g. the processes of a pool).
+
+    Parameters
+    ----------
+    workers_n : int, optional
+        The number of workers. Default is one worker per thread of the budget.
+
+    Returns
+    -------
+    tuple[int, int]
+        The number of workers, capped at the budget, and the number of threads of each of them.
+    """
+
+    workers_n = workers_n or get_threads()
+    if workers_n > get_threads():
+        logger.warning(f'{workers_n} workers requested with a budget of {get_threads()} threads: clamped to '
+                       f'{get_threads()} workers.')
+        workers_n = get_threads()
+    threads = get_threads() // workers_n
+    logger.info(f'Thread allocation: {workers_n} workers x {threads} threads (budget {get_threads()}, '
+                f'{get_available_cores()} cores available).')
+
+    return workers_n, threads
+
+
+def log_thread_allocation():
+    """
+    This function logs the size of each thread pool loaded by the process.
+    """
+
+    for pool in get_controller().info():
+        logger.info(f'Thread pool {pool["internal_api"]} ({pool["prefix"]}): {pool["num_threads"]} threads.')
@@ -0,0 +1,217 @@
+from models import Metrics, RandScore, AdjustedRandScore, NormalizedMutualInfoScore, SilhouetteScore
+from analysis import metrics_to_record
+from settings import RESULTS_STORE_PATH
+from datetime import datetime
+from loguru import logger
+import importlib.util
+import pandas as pd
+import os.path
+import uuid
+import os
+
+PARTITION_FORMAT = 'parquet' if importlib.util.find_spec('pyarrow') else 'pickle'
+PARTITION_EXTENSIONS = {'parquet': '.parquet', 'pickle': '.pkl'}
+
+SCORE_MODELS = {'rand_score': RandScore,
+                'adjusted_rand_score': AdjustedRandScore,
+                'normalized_mutual_info_score': NormalizedMutualInfoScore,
+                'silhouette_score': SilhouetteScore}
+
+# Prefixes of the columns of the parameters, the data fingerprints and the timings of the runs
+PARAMETER_PREFIX = 'parameter.'
+FINGERPRINT_PREFIX = 'fingerprint.'
+SECONDS_PREFIX = 'seconds.'
+
+
+class ResultsStore:
+    """
+    Append-only columnar store of the metrics of the runs, with their parameters, data fingerprints and timings.
+
+    Each append writes a new immutable partition file (parquet when pyarrow is installed, a pickled dataframe
+    otherwise), so concurrent writers (e.g. the workers of a batch) never conflict. The partitions of both formats are
+    read, so a store written by writers with and without pyarrow stays whole. The partitions already read are kept in
+    memory and only the new ones are read by later queries; compact merges the partitions into one.
+    """
+
+    def __init__(self, path: str = RESULTS_STORE_PATH):
+        self.path = path
+        self._partitions: list[str] = []
+        self._frame = pd.DataFrame()
+
+    @property
+    def extension(self) -> str:
+        return PARTITION_EXTENSIONS[PARTITION_FORMAT]
+
+    def _list_partitions(self) -> list[str]:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if name.endswith(tuple(PARTITION_EXTENSIONS.values())))
+
+    def _write_partition(self, frame: pd.DataFrame, name: str):
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, name)
+        buffer_path = f'{path}.tmp'
+
+        if PARTITION_FORMAT == 'parquet':
+            frame.to_parquet(buffer_path, index=False)
+        else:
+            frame.to_pickle(buffer_path)
+        os.replace(buffer_path, path)
+
+    def _read_partition(self, name: str) -> pd.DataFrame:
+        path = os.path.join(self.path, name)
+        return pd.read_parquet(path) if name.endswith(PARTITION_EXTENSIONS['parquet']) else pd.read_pickle(path)
+
+    def append(self, metrics: list[Metrics], run_id: str | None = None, cohort: str | None = None,
+               parameters: dict | None = None, fingerprints: dict[str, str] | None = None,
+               timings: dict[str, float] | None = None) -> str:
+        """
+        This method appends the metrics of a run to the store.
+
+        Parameters
+        ----------
+        metrics : list[Metrics]
+            The metrics of the run, one per method. The label of each one is stored as the method.
+        run_id : str, optional
+            The identifier of the run. Default is a new unique identifier.
+        cohort : str, optional
+            The cohort the run was evaluated on.
+        parameters : dict, optional
+            The parameters of the run (e.g. K, t, clusters_n, precision).
+        fingerprints : dict[str, str], optional
+            The fingerprints of the input data, by dataset name.
+        timings : dict[str, float], optional
+            The seconds spent in each stage of the run.
+
+        Returns
+        -------
+        str
+            The identifier of the run.
+        """
+
+        run_id = run_id or uuid.uuid4().hex[:12]
+        recorded_at = datetime.now()
+        common = ({'run_id': run_id, 'recorded_at': recorded_at, 'cohort': cohort}
+                  | {f'{PARAMETER_PREFIX}{key}': value for key, value in (parameters or {}).items()}
+                  | {f'{FINGERPRINT_PREFIX}{key}': value for key, value in (fingerprints or {}).items()}
+                  | {f'{SECONDS_PREFIX}{key}': value for key, value in (timings or {}).items()})
+
+        frame = pd.DataFrame([common | {'method': m.label} | metrics_to_record(m) for m in metrics])
+        frame['cohort'] = frame['cohort'].astype(object)
+
+        name = f'{recorded_at:%Y%m%d-%H%M%S-%f}-{uuid.uuid4().hex[:8]}{self.extension}'
+        self._write_partition(frame, name)
+        logger.debug(f'Metrics of run {run_id} appended to {self.path}.')
+
+        return run_id
+
+    def load(self) -> pd.DataFrame:
+        """
+        This method returns all the records of the store, reading only the partitions written since the last call.
+        """
+
+        partitions = self._list_partitions()
+
+        # Partitions merged by a compaction since the last call: the whole store is read again
+        if not set(self._partitions) <= set(partitions):
+            self._partitions, self._frame = [], pd.DataFrame()
+
+        new_partitions = [name for name in partitions if name not in set(self._partitions)]
+        if new_partitions:
+            frames = [self._frame] if len(self._frame) else []
+            self._frame = pd.concat(frames + [self._read_partition(name) for name in new_partitions],
+                                    ignore_index=True)
+            self._partitions = partitions
+
+        return self._frame
+
+    def query(self, methods: list[str] | str | None = None, cohorts: list[str] | str | None = None,
+              run_ids: list[str] | str | None = None, since: datetime | None = None,
+              **parameters) -> pd.DataFrame:
+        """
+        This method returns the records matching all the given filters. Each filter accepts a value or a list of
+        values; the parameters are given by name (e.g. K=20, precision='float32').
+        """
+
+        records = self.load()
+        if records.empty:
+            return records
+
+        mask = pd.Series(True, index=records.index)
+        filters = {'method': methods, 'cohort': cohorts, 'run_id': run_ids}
+        filters |= {f'{PARAMETER_PREFIX}{key}': value for key, value in parameters.items()}
+
+        for column, values in filters.items():
+            if values is None:
+                continue
+            if column not in records:
+                return records.iloc[:0]
+            mask &= records[column].isin(values if isinstance(values, list) else [values])
+
+        if since is not None:
+            mask &= records['recorded_at'] >= since
+
+        return records[mask].reset_index(drop=True)
+
+    def get_metrics(self, label_columns: list[str] = ('method',), **filters) -> list[Metrics]:
+        """
+        This method returns the matching records as Metrics, labelled by the given columns, so they can be passed to
+        get_metrics_comparison_plot and get_metrics_comparison_by_score_plot.
+        """
+
+        records = self.query(**filters)
+
+        return [Metrics(label=' | '.join(str(record[column]) for column in label_columns),
+                        **{score: model(value=record[score]) for score, model in SCORE_MODELS.items()})
+                for _, record in records.iterrows()]
+
+    def compact(self):
+        """
+        This method merges all the partitions into a single one, so the store is read with a single file.
+        """
+
+        records = self.load()
+        partitions = list(self._partitions)
+        if len(partitions) < 2:
+            return
+
+        self._write_partition(records, f'{datetime.now():%Y%m%d-%H%M%S-%f}-compacted{self.extension}')
+        for name in partitions:
+            os.remove(os.path.join(self.path, name))
+
+        logger.info(f'Compacted {len(partitions)} partitions of {self.path}.')
+
+
+if __name__ == '__main__':
+    from analysis import get_metrics_comparison_plot, get_metrics_comparison_by_score_plot
+    from sys import stdout
+    import argparse
+
+    logger.remove()
+    logger.add(stdout, level='INFO', colorize=True,
+               format='<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[data_type]} | <level>{message}</level>')
+    logger.configure(extra={'data_type': 'None'})
+
+    parser = argparse.ArgumentParser(description='Query the metrics of the runs recorded in the results store.')
+    parser.add_argument('--store', type=str, default=RESULTS_STORE_PATH)
+    parser.add_argument('--methods', type=str, nargs='+', default=None)
+    parser.add_argument('--cohorts', type=str, nargs='+', default=None)
+    parser.add_argument('--run-ids', type=str, nargs='+', default=None)
+    parser.add_argument('--compact', action='store_true', help='Merge the partitions of the store into one.')
+    parser.add_argument('--plots', type=str, default=None,
+                        help='Directory where the comparison plots of the matching runs are saved as HTML files.')
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    if args.compact:
+        store.compact()
+
+    filters = {'methods': args.methods, 'cohorts': args.cohorts, 'run_ids': args.run_ids}
+    print(store.query(**filters).to_string())
+
+    if args.plots:
+        os.makedirs(args.plots, exist_ok=True)
+        metrics = store.get_metrics(label_columns=['method', 'run_id'], **filters)
+        get_metrics_comparison_plot(metrics).write_html(os.path.join(args.plots, 'metrics_comparison.html'))
+        get_metrics_comparison_by_score_plot(metrics).write_html(os.path.join(args.plots,
+                                                                              'metrics_comparison_by_score.html'))
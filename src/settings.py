@@ -3,3 +3,11 @@ MIRNA_PATH = '../data/mo_PRAD_miRNASeqGene-20160128.csv'
 MRNA_PATH = '../data/mo_PRAD_RNASeq2Gene-20160128.csv'
 PHENOTYPE_PATH = '../data/mo_colData.csv'
 SUBTYPES_PATH = '../data/subtypes.csv'
+CACHE_PATH = '../data/cache'
+FEATURE_STATISTICS_CACHE_SIZE = 64
+BARCODE_CACHE_SIZE = 32
+RUNS_PATH = '../runs'
+PRECISION = 'float64'
+THREADS = None
+MEMORY_BUDGET = None
+RESULTS_STORE_PATH = '../results/store'
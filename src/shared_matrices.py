@@ -0,0 +1,135 @@
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing import resource_tracker
+from loguru import logger
+import pandas as pd
+import numpy as np
+import atexit
+import sys
+
+
+class SharedMatrix:
+    """
+    Lightweight handle of a matrix published in shared memory. It is pickled in place of the matrix when sent to the
+    workers of a process pool, which attach to the same memory instead of receiving a copy.
+    """
+
+    def __init__(self, name: str, shape: tuple[int, ...], dtype: str, index: pd.Index | None = None,
+                 columns: pd.Index | None = None):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+        self.index = index
+        self.columns = columns
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+    def __repr__(self) -> str:
+        return f'SharedMatrix({self.name}, {self.shape}, {self.dtype})'
+
+
+_attached: dict[str, SharedMemory] = {}
+
+
+def _open_segment(name: str) -> SharedMemory:
+    """
+    This function opens an existing shared memory segment without registering it with the resource tracker of the
+    current process, which before Python 3.13 would unlink the segment when a worker exits.
+    """
+
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args, **kwargs: None
+    try:
+        return SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def attach(matrix: SharedMatrix | pd.DataFrame | np.ndarray) -> pd.DataFrame | np.ndarray:
+    """
+    This function returns the matrix of the given handle, as a read-only view of the shared memory (a dataframe if
+    the matrix was published with its index). Segments are opened once per process, until detach closes them. Matrices
+    that are not handles are returned as they are, so the functions run by the workers accept both.
+    """
+
+    if not isinstance(matrix, SharedMatrix):
+        return matrix
+
+    if matrix.name not in _attached:
+        _attached[matrix.name] = _open_segment(matrix.name)
+
+    values = np.ndarray(matrix.shape, dtype=matrix.dtype, buffer=_attached[matrix.name].buf)
+    values.flags.writeable = False
+
+    if matrix.index is None:
+        return values
+
+    return pd.DataFrame(values, index=matrix.index, columns=matrix.columns, copy=False)
+
+
+def detach(matrix: SharedMatrix | pd.DataFrame | np.ndarray):
+    """
+    This function closes the segment of the given handle in the current process, so a long-lived worker does not keep
+    a segment mapped after the registry released it. The views returned by attach must not be used afterwards.
+    """
+
+    if isinstance(matrix, SharedMatrix) and matrix.name in _attached:
+        _attached.pop(matrix.name).close()
+
+
+class SharedMatrixRegistry:
+    """
+    Registry of the matrices published in shared memory by the current process. Each matrix is copied once into its
+    own segment; the segments are unlinked when the registry is closed, on exit of its context or at interpreter exit.
+    """
+
+    def __init__(self):
+        self._segments: dict[str, SharedMemory] = {}
+        atexit.register(self.close)
+
+    def publish(self, matrix: pd.DataFrame | np.ndarray) -> SharedMatrix:
+        """
+        This method copies the given matrix into a new shared memory segment and returns its handle.
+        """
+
+        values = np.ascontiguousarray(matrix.to_numpy() if isinstance(matrix, pd.DataFrame) else matrix)
+        segment = SharedMemory(create=True, size=max(values.nbytes, 1))
+        np.ndarray(values.shape, dtype=values.dtype, buffer=segment.buf)[...] = values
+        self._segments[segment.name] = segment
+
+        handle = SharedMatrix(name=segment.name, shape=values.shape, dtype=values.dtype.str,
+                              index=matrix.index if isinstance(matrix, pd.DataFrame) else None,
+                              columns=matrix.columns if isinstance(matrix, pd.DataFrame) else None)
+        logger.debug(f'Published {handle} ({handle.nbytes / 1024 ** 2:.1f} MiB).')
+
+        return handle
+
+    def release(self, handle: SharedMatrix):
+        """
+        This method unlinks the segment of the given handle. Workers still attached keep their view until they exit.
+        """
+
+        segment = self._segments.pop(handle.name, None)
+        if segment is not None:
+            segment.close()
+            segment.unlink()
+
+    def close(self):
+        for name in list(self._segments):
+            segment = self._segments.pop(name)
+            segment.close()
+            segment.unlink()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(segment.size for segment in self._segments.values())
+
+    def __enter__(self) -> 'SharedMatrixRegistry':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,134 @@
+from sklearn.cluster import KMeans
+from scipy.sparse import linalg
+from scipy import sparse
+from loguru import logger
+import numpy as np
+
+EIGEN_SOLVERS = ['arpack', 'lobpcg']
+
+
+def get_knn_graph(affinity: np.ndarray, K: int = 20, block_size: int = 1024) -> sparse.csr_matrix:
+    """
+    This function sparsifies a dense affinity matrix to its symmetric K nearest neighbors graph: each sample keeps the
+    affinities of its K most similar samples (itself excluded), and the graph is symmetrized as (A + A.T) / 2. The rows
+    are processed in blocks of block_size, so no dense n x n temporary is allocated.
+    """
+
+    n = len(affinity)
+    K = min(K, n - 1)
+    columns = np.empty((n, K), dtype=np.int64)
+
+    for start in range(0, n, block_size):
+        block = np.array(affinity[start:start + block_size], dtype=np.float64)
+        block[np.arange(len(block)), np.arange(start, start + len(block))] = -np.inf
+        columns[start:start + block_size] = np.argpartition(block, -K, axis=1)[:, -K:]
+
+    values = np.take_along_axis(np.asarray(affinity), columns, axis=1).astype(np.float64)
+    graph = sparse.csr_matrix((values.ravel(), columns.ravel(), np.arange(0, n * K + 1, K)), shape=(n, n))
+
+    return ((graph + graph.T) / 2).tocsr()
+
+
+def get_normalized_laplacian(graph: sparse.csr_matrix) -> tuple[sparse.csr_matrix, np.ndarray]:
+    """
+    This function returns the symmetric normalized Laplacian I - D^(-1/2) A D^(-1/2) of the given graph, as a sparse
+    matrix, with the square roots of the degrees of its nodes.
+    """
+
+    degrees = np.asarray(graph.sum(axis=1)).ravel()
+    sqrt_degrees = np.sqrt(np.where(degrees > 0, degrees, 1))
+    scaling = sparse.diags(1 / sqrt_degrees)
+
+    laplacian = sparse.identity(graph.shape[0], format='csr') - scaling @ graph @ scaling
+
+    return laplacian.tocsr(), sqrt_degrees
+
+
+def get_spectral_embedding(graph: sparse.csr_matrix, components_n: int, eigen_solver: str = 'arpack',
+                           random_state: int | None = None, tolerance: float | None = None,
+                           max_iterations: int = 200) -> np.ndarray:
+    """
+    This function computes the spectral embedding of a sparse graph from the eigenvectors of the smallest eigenvalues
+    of its normalized Laplacian, as sklearn's spectral_embedding does for spectral clustering.
+
+    Parameters
+    ----------
+    graph : sparse.csr_matrix
+        The symmetric (n, n) affinity graph.
+    components_n : int
+        The number of eigenvectors, the first one included.
+    eigen_solver : str
+        'arpack' or 'lobpcg', on the largest eigenvalues of D^(-1/2) A D^(-1/2). lobpcg is started from the known
+        eigenvector D^(1/2) 1 and runs without preconditioner: the diagonal of the normalized Laplacian is the identity,
+        so a Jacobi preconditioner would not help, and a non-symmetric one (e.g. an incomplete LU) makes it converge
+        to wrong eigenvalues.
+    random_state : int, optional
+        The seed of the initial vectors of the solver.
+    tolerance : float, optional
+        The stopping tolerance of the solver. Default is the solver's own.
+    max_iterations : int
+        The maximum number of lobpcg iterations.
+
+    Returns
+    -------
+    np.ndarray
+        The (n, components_n) embedding, with the eigenvectors scaled by D^(-1/2) and their signs made deterministic.
+    """
+
+    if eigen_solver not in EIGEN_SOLVERS:
+        raise ValueError(f'Eigen solver {eigen_solver} not in {EIGEN_SOLVERS}.')
+
+    n = graph.shape[0]
+    laplacian, sqrt_degrees = get_normalized_laplacian(graph)
+    rng = np.random.default_rng(random_state)
+
+    adjacency = sparse.identity(n, format='csr') - laplacian
+
+    if eigen_solver == 'lobpcg':
+        initial = rng.normal(size=(n, components_n))
+        initial[:, 0] = sqrt_degrees
+        eigenvalues, eigenvectors = linalg.lobpcg(adjacency, initial, tol=tolerance, maxiter=max_iterations,
+                                                  largest=True)
+    else:
+        eigenvalues, eigenvectors = linalg.eigsh(adjacency, k=components_n, which='LA', tol=tolerance or 0,
+                                                 v0=rng.uniform(-1, 1, size=n))
+    eigenvectors = eigenvectors[:, np.argsort(eigenvalues)[::-1]]
+
+    embedding = eigenvectors / sqrt_degrees[:, None]
+
+    # Same sign convention as sklearn's _deterministic_vector_sign_flip
+    signs = np.sign(embedding[np.abs(embedding).argmax(axis=0), np.arange(components_n)])
+    return embedding * np.where(signs == 0, 1, signs)
+
+
+def cluster_graph(affinity: np.ndarray, clusters_n: int, K: int = 20, eigen_solver: str = 'arpack',
+                  eigen_random_state: int | None = None, kmeans_random_state: int | None = None) -> np.ndarray:
+    """
+    This function clusters a dense affinity matrix with spectral clustering on its sparse K nearest neighbors graph.
+
+    Parameters
+    ----------
+    affinity : np.ndarray
+        The symmetric (n, n) affinity matrix.
+    clusters_n : int
+        The number of clusters to be detected.
+    K : int
+        The number of neighbors kept by each sample, see get_knn_graph.
+    eigen_solver : str
+        See get_spectral_embedding.
+    eigen_random_state, kmeans_random_state : int, optional
+        The seeds of the eigensolver initialization and of the k-means initialization.
+
+    Returns
+    -------
+    np.ndarray
+        The cluster of each sample.
+    """
+
+    graph = get_knn_graph(affinity, K=K)
+    logger.debug(f'Sparse graph: {graph.nnz} edges ({graph.nnz / graph.shape[0] ** 2:.2%} of the dense matrix).')
+
+    embedding = get_spectral_embedding(graph, components_n=clusters_n, eigen_solver=eigen_solver,
+                                       random_state=eigen_random_state)
+
+    return KMeans(n_clusters=clusters_n, n_init=10, random_state=kmeans_random_state).fit_predict(embedding)
@@ -0,0 +1,218 @@
+from pipeline_steps import EncodeCategoricalData, SimilarityMatrices, ComputeSNF, ComputeKMedoids
+from scipy.spatial.distance import cdist
+from models import Data
+from loguru import logger
+import pandas as pd
+import numpy as np
+import json
+import os.path
+import os
+
+
+class ModalityReference:
+    """
+    The reference cohort of a single modality: the selected features, their scaler parameters, the scaled reference
+    samples and the average distance of each reference sample to its K nearest neighbors.
+    """
+
+    def __init__(self, name: str, features: list[str], mean: np.ndarray, scale: np.ndarray, samples: np.ndarray,
+                 neighbours_distance: np.ndarray):
+        self.name = name
+        self.features = features
+        self.mean = mean
+        self.scale = scale
+        self.samples = samples
+        self.neighbours_distance = neighbours_distance
+
+    def transform(self, data: pd.DataFrame) -> np.ndarray:
+        """
+        This method restricts the given samples to the selected features and scales them with the reference scaler.
+        Missing features and values are imputed with the reference mean.
+        """
+
+        values = data.reindex(columns=self.features).to_numpy(dtype=float)
+        scaled = (values - self.mean) / self.scale
+
+        return np.nan_to_num(scaled, nan=0.0)
+
+    def get_affinities(self, data: pd.DataFrame, K: int, mu: float) -> np.ndarray:
+        """
+        This method computes the affinities of the given samples to the reference samples, with the same scaled
+        exponential kernel used by SimilarityMatrices, and normalizes each row to sum to one as SNF does.
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            The new samples, with the features of the modality as columns.
+        K : int
+            The number of neighbors the kernel was fitted with.
+        mu : float
+            The normalization factor of the kernel.
+
+        Returns
+        -------
+        np.ndarray
+            The (new samples, reference samples) matrix of normalized affinities.
+        """
+
+        distances = cdist(self.transform(data), self.samples, metric='sqeuclidean')
+
+        K = min(K, distances.shape[1])
+        average = np.partition(distances, K - 1, axis=1)[:, :K].mean(axis=1)
+
+        affinities = SimilarityMatrices.kernel(distances, rows_average=average[:, np.newaxis],
+                                               columns_average=self.neighbours_distance[np.newaxis, :], mu=mu)
+
+        return affinities / affinities.sum(axis=1, keepdims=True)
+
+
+class SubtypeModel:
+    """
+    Fitted model assigning new patients to the subtypes found on a reference cohort.
+
+    A new patient is compared to the reference patients of each modality, the normalized affinities are averaged over
+    the modalities, and are then propagated through the fused reference similarity to the cluster medoids: the patient
+    is assigned to the medoid it is most similar to.
+    """
+
+    def __init__(self, modalities: list[ModalityReference], reference_index: list[str], labels: np.ndarray,
+                 medoids_similarity: np.ndarray, clusters: np.ndarray, K: int = 20, mu: float = 0.5):
+        self.modalities = modalities
+        self.reference_index = reference_index
+        self.labels = labels
+        self.medoids_similarity = medoids_similarity
+        self.clusters = clusters
+        self.K = K
+        self.mu = mu
+
+    @classmethod
+    def fit(cls, modalities: list[Data], K: int = 20, t: int = 20, clusters_n: int = 3,
+            mu: float = 0.5) -> 'SubtypeModel':
+        """
+        This method fits the model on the given aligned modalities, clustering their SNF fused similarity with KMedoids.
+
+        Parameters
+        ----------
+        modalities : list[Data]
+            The aligned modalities, restricted to the selected features.
+        K, t : int
+            The SNF parameters.
+        clusters_n : int
+            The number of clusters to be detected.
+        mu : float
+            The normalization factor of the affinity kernel.
+
+        Returns
+        -------
+        SubtypeModel
+            The fitted model.
+        """
+
+        logger.debug('Fitting subtype model...')
+        similarity_step = SimilarityMatrices(K=K, mu=mu, K_max=max(K, 50))
+        neighbourhoods = similarity_step.get_neighbourhoods(modalities)
+        similarity_matrices = similarity_step.get_affinities(neighbourhoods, index=modalities[0].index)
+
+        fused = ComputeSNF(K=K, t=t)(data=similarity_matrices)
+        clustering_step = ComputeKMedoids()
+        labels = clustering_step(data=fused, clusters_n=clusters_n)
+        medoids = clustering_step.medoid_indices
+
+        references = []
+        for data, (_, neighbours) in zip(modalities, neighbourhoods):
+            values = EncodeCategoricalData()(data=data).to_numpy(dtype=float)
+            mean = values.mean(axis=0)
+            scale = values.std(axis=0)
+            scale[scale == 0] = 1
+            references.append(ModalityReference(name=data.name, features=list(data.columns), mean=mean, scale=scale,
+                                                samples=(values - mean) / scale,
+                                                neighbours_distance=neighbours[:, 1:K + 1].mean(axis=1)))
+
+        logger.debug('Subtype model fitted.')
+
+        return cls(modalities=references, reference_index=list(map(str, fused.index)), labels=labels.to_numpy(),
+                   medoids_similarity=fused.to_numpy()[:, medoids], clusters=labels.to_numpy()[medoids], K=K, mu=mu)
+
+    def score(self, data: dict[str, pd.DataFrame]) -> pd.DataFrame:
+        """
+        This method computes the similarity of the given patients to the medoid of each cluster.
+
+        Parameters
+        ----------
+        data : dict[str, pd.DataFrame]
+            For each modality name, the new patients on the rows and the features on the columns. Patients missing
+            from a modality are compared on the other modalities only.
+
+        Returns
+        -------
+        pd.DataFrame
+            The similarity of each patient (rows) to each cluster (columns).
+        """
+
+        index = pd.Index(sorted(set().union(*[frame.index for frame in data.values()])))
+        affinities = np.zeros((len(index), len(self.reference_index)))
+        counts = np.zeros((len(index), 1))
+
+        for modality in self.modalities:
+            if modality.name not in data:
+                continue
+            frame = data[modality.name]
+            rows = index.get_indexer(frame.index)
+            affinities[rows] += modality.get_affinities(frame, K=self.K, mu=self.mu)
+            counts[rows] += 1
+
+        if not counts.all():
+            raise ValueError('Each patient must have the features of at least one modality.')
+
+        scores = (affinities / counts) @ self.medoids_similarity
+
+        return pd.DataFrame(scores, index=index, columns=self.clusters)
+
+    def assign(self, data: dict[str, pd.DataFrame]) -> pd.Series:
+        """
+        This method assigns each of the given patients to a cluster. See score for the format of the data.
+        """
+
+        scores = self.score(data)
+
+        return pd.Series(scores.columns[scores.to_numpy().argmax(axis=1)], index=scores.index, name='cluster')
+
+    def save(self, path: str):
+        """
+        This method saves the model to the given directory, as a JSON description and a .npz file of arrays.
+        """
+
+        os.makedirs(path, exist_ok=True)
+        arrays = {'labels': self.labels, 'medoids_similarity': self.medoids_similarity, 'clusters': self.clusters}
+        description = {'K': self.K, 'mu': self.mu, 'reference_index': self.reference_index, 'modalities': []}
+
+        for i, modality in enumerate(self.modalities):
+            description['modalities'].append({'name': modality.name, 'features': modality.features})
+            arrays |= {f'{i}_mean': modality.mean, f'{i}_scale': modality.scale, f'{i}_samples': modality.samples,
+                       f'{i}_neighbours_distance': modality.neighbours_distance}
+
+        np.savez(os.path.join(path, 'arrays.npz'), **arrays)
+        with open(os.path.join(path, 'model.json'), 'w') as file:
+            json.dump(description, file)
+
+        logger.debug(f'Subtype model saved to {path}.')
+
+    @classmethod
+    def load(cls, path: str) -> 'SubtypeModel':
+        """
+        This method loads a model saved with save.
+        """
+
+        with open(os.path.join(path, 'model.json')) as file:
+            description = json.load(file)
+        arrays = np.load(os.path.join(path, 'arrays.npz'))
+
+        modalities = [ModalityReference(name=modality['name'], features=modality['features'],
+                                        mean=arrays[f'{i}_mean'], scale=arrays[f'{i}_scale'],
+                                        samples=arrays[f'{i}_samples'],
+                                        neighbours_distance=arrays[f'{i}_neighbours_distance'])
+                      for i, modality in enumerate(description['modalities'])]
+
+        return cls(modalities=modalities, reference_index=description['reference_index'], labels=arrays['labels'],
+                   medoids_similarity=arrays['medoids_similarity'], clusters=arrays['clusters'],
+                   K=description['K'], mu=description['mu'])
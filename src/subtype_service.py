@@ -0,0 +1,210 @@
+from experiment import load_experiment
+from subtype_model import SubtypeModel
+from loguru import logger
+from sys import stdout
+import pandas as pd
+import argparse
+import asyncio
+import json
+import time
+
+
+class MicroBatcher:
+    """
+    Collects the patients of concurrent requests and assigns them with a single vectorized call to the model.
+
+    A batch is closed when it reaches max_batch_size patients or max_delay seconds after its first request. The
+    requests are validated before being queued, and if a batch fails anyway its requests are assigned one at a time,
+    so an invalid request only fails itself.
+    """
+
+    def __init__(self, model: SubtypeModel, max_batch_size: int = 256, max_delay: float = 0.005):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    async def assign(self, patients: dict[str, dict[str, dict[str, float]]]) -> dict[str, dict]:
+        """
+        This method queues the given patients for the next batch and waits for their assignments.
+
+        Parameters
+        ----------
+        patients : dict[str, dict[str, dict[str, float]]]
+            For each patient, the values of the features of each modality, keyed by modality name and feature name.
+
+        Returns
+        -------
+        dict[str, dict]
+            For each patient, the assigned cluster and the similarity to each cluster.
+        """
+
+        self._validate(patients)
+
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((patients, future))
+        return await future
+
+    def _validate(self, patients: dict[str, dict[str, dict[str, float]]]):
+        modalities = {modality.name for modality in self.model.modalities}
+
+        if not isinstance(patients, dict) or not patients:
+            raise ValueError('The patients must be a non-empty object keyed by patient.')
+        for patient, values in patients.items():
+            if not isinstance(values, dict) or not values:
+                raise ValueError(f'The modalities of patient {patient} must be a non-empty object keyed by modality.')
+            for modality, features in values.items():
+                if modality not in modalities:
+                    raise ValueError(f'Unknown modality {modality} of patient {patient}, expected one of '
+                                     f'{sorted(modalities)}.')
+                if not isinstance(features, dict):
+                    raise ValueError(f'The features of modality {modality} of patient {patient} must be an object.')
+
+    def _assign_batch(self, requests: list[dict]) -> list[dict]:
+        frames: dict[str, dict] = {}
+        for n, patients in enumerate(requests):
+            for patient, modalities in patients.items():
+                for modality, values in modalities.items():
+                    frames.setdefault(modality, {})[(n, patient)] = values
+
+        data = {modality: pd.DataFrame.from_dict(records, orient='index') for modality, records in frames.items()}
+        scores = self.model.score(data)
+        clusters = scores.columns[scores.to_numpy().argmax(axis=1)]
+
+        results = [{} for _ in requests]
+        for (n, patient), cluster, row in zip(scores.index, clusters, scores.to_numpy()):
+            results[n][patient] = {'cluster': int(cluster),
+                                   'scores': {str(c): float(s) for c, s in zip(scores.columns, row)}}
+
+        return results
+
+    async def run(self):
+        """
+        This method runs forever, closing batches and resolving the futures of their requests.
+        """
+
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.queue.get()]
+            patients_n = len(batch[0][0])
+            deadline = loop.time() + self.max_delay
+
+            while patients_n < self.max_batch_size and (timeout := deadline - loop.time()) > 0:
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout=timeout))
+                    patients_n += len(batch[-1][0])
+                except asyncio.TimeoutError:
+                    break
+
+            start = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(None, self._assign_batch, [patients for patients, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as exception:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(exception)
+                    continue
+
+                # One of the requests is invalid: assign them one at a time, so its error only reaches its own client
+                logger.warning(f'Batch of {len(batch)} requests failed ({exception!r}), assigning them one at a time.')
+                for patients, future in batch:
+                    try:
+                        future.set_result((await loop.run_in_executor(None, self._assign_batch, [patients]))[0])
+                    except Exception as request_exception:
+                        future.set_exception(request_exception)
+
+            logger.debug(f'Batch of {len(batch)} requests ({patients_n} patients) assigned in '
+                         f'{(time.perf_counter() - start) * 1000:.2f} ms.')
+
+
+class SubtypeService:
+    """
+    Minimal asyncio HTTP service exposing a SubtypeModel.
+
+    Endpoints:
+        GET /health          returns {"status": "ok"}.
+        POST /assign         takes {"patients": {patient: {modality: {feature: value}}}} and returns
+                             {"assignments": {patient: {"cluster": int, "scores": {cluster: float}}}}.
+    """
+
+    def __init__(self, model: SubtypeModel, max_batch_size: int = 256, max_delay: float = 0.005):
+        self.batcher = MicroBatcher(model=model, max_batch_size=max_batch_size, max_delay=max_delay)
+
+    @staticmethod
+    def _response(writer: asyncio.StreamWriter, status: str, content: dict):
+        body = json.dumps(content).encode()
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode() + body)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, _ = (await reader.readline()).decode().split(' ', 2)
+            headers = {}
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                key, value = line.decode().split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            if method == 'GET' and path == '/health':
+                self._response(writer, '200 OK', {'status': 'ok'})
+            elif method == 'POST' and path == '/assign':
+                patients = json.loads(body)['patients']
+                self._response(writer, '200 OK', {'assignments': await self.batcher.assign(patients)})
+            else:
+                self._response(writer, '404 Not Found', {'error': f'{method} {path} not found'})
+        except (ValueError, KeyError, TypeError, AttributeError) as exception:
+            self._response(writer, '400 Bad Request', {'error': f'{type(exception).__name__}: {exception}'})
+        except Exception as exception:
+            logger.exception(f'Request failed: {exception!r}')
+            self._response(writer, '500 Internal Server Error', {'error': f'{type(exception).__name__}: {exception}'})
+        finally:
+            await writer.drain()
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8080):
+        server = await asyncio.start_server(self.handle, host=host, port=port)
+        batcher = asyncio.create_task(self.batcher.run())
+        logger.info(f'Subtype service listening on {host}:{port}.')
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+if __name__ == '__main__':
+    logger.remove()
+    logger.add(stdout, level='INFO', colorize=True,
+               format='<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[data_type]} | <level>{message}</level>')
+    logger.configure(extra={'data_type': 'None'})
+
+    parser = argparse.ArgumentParser(description='Fit or serve the subtype assignment model.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fit_parser = subparsers.add_parser('fit', help='Fit the model on the configured cohort.')
+    fit_parser.add_argument('--model', type=str, default='../models/subtypes')
+    fit_parser.add_argument('--retain-k', type=int, default=100)
+    fit_parser.add_argument('--K', type=int, default=20)
+    fit_parser.add_argument('--t', type=int, default=20)
+    fit_parser.add_argument('--clusters-n', type=int, default=3)
+
+    serve_parser = subparsers.add_parser('serve', help='Serve a fitted model over HTTP.')
+    serve_parser.add_argument('--model', type=str, default='../models/subtypes')
+    serve_parser.add_argument('--host', type=str, default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8080)
+    serve_parser.add_argument('--max-batch-size', type=int, default=256)
+    serve_parser.add_argument('--max-delay-ms', type=float, default=5)
+
+    args = parser.parse_args()
+
+    if args.command == 'fit':
+        proteins_data, mirna_data, mrna_data, _, _ = load_experiment(retain_k=args.retain_k)
+        SubtypeModel.fit([proteins_data, mirna_data, mrna_data], K=args.K, t=args.t,
+                         clusters_n=args.clusters_n).save(args.model)
+    else:
+        service = SubtypeService(model=SubtypeModel.load(args.model), max_batch_size=args.max_batch_size,
+                                 max_delay=args.max_delay_ms / 1000)
+        asyncio.run(service.serve(host=args.host, port=args.port))
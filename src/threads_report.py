@@ -0,0 +1,84 @@
+from experiment import load_experiment, cluster_experiment
+from resources import use_threads, get_available_cores, log_thread_allocation
+from loguru import logger
+from sys import stdout
+import pandas as pd
+import argparse
+import os.path
+import time
+import os
+
+
+def get_threads_report(threads_values: list[int], retain_k: int = 100, K: int = 20, t: int = 20, clusters_n: int = 3,
+                       repeats_n: int = 3) -> pd.DataFrame:
+    """
+    This function measures how the clustering of the experiment (similarity matrices, SNF and clustering methods)
+    scales with the thread budget.
+
+    Parameters
+    ----------
+    threads_values : list[int]
+        The thread budgets to be evaluated.
+    retain_k : int
+        The number of features retained for each modality.
+    K, t : int
+        The SNF parameters.
+    clusters_n : int
+        The number of clusters to be detected.
+    repeats_n : int
+        The number of runs for each budget; the fastest one is reported.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per budget, with the duration of the clustering, the speedup over a single thread and the parallel
+        efficiency (the speedup divided by the number of threads).
+    """
+
+    proteins_data, mirna_data, mrna_data, _, _ = load_experiment(retain_k=retain_k)
+    modalities = [proteins_data, mirna_data, mrna_data]
+
+    records = []
+    for threads in sorted(set(threads_values) | {1}):
+        with use_threads(threads):
+            log_thread_allocation()
+            durations = []
+            for _ in range(repeats_n):
+                start = time.perf_counter()
+                cluster_experiment(modalities, K=K, t=t, clusters_n=clusters_n)
+                durations.append(time.perf_counter() - start)
+
+        records.append({'threads': threads, 'seconds': min(durations)})
+        logger.info(f'{threads} threads: {min(durations):.3f}s')
+
+    report = pd.DataFrame(records)
+    report['speedup'] = report['seconds'].iloc[0] / report['seconds']
+    report['efficiency'] = report['speedup'] / report['threads']
+
+    return report
+
+
+if __name__ == '__main__':
+    logger.remove()
+    logger.add(stdout, level='INFO', colorize=True,
+               format='<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | {extra[data_type]} | <level>{message}</level>')
+    logger.configure(extra={'data_type': 'None'})
+
+    cores = get_available_cores()
+    parser = argparse.ArgumentParser(description='Measure the scaling of the experiment from 1 to N threads.')
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=sorted({2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores} | {cores}))
+    parser.add_argument('--retain-k', type=int, default=100)
+    parser.add_argument('--K', type=int, default=20)
+    parser.add_argument('--t', type=int, default=20)
+    parser.add_argument('--clusters-n', type=int, default=3)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--report', type=str, default='../results/threads.csv')
+    args = parser.parse_args()
+
+    report = get_threads_report(threads_values=args.threads, retain_k=args.retain_k, K=args.K, t=args.t,
+                                clusters_n=args.clusters_n, repeats_n=args.repeats)
+
+    os.makedirs(os.path.dirname(args.report), exist_ok=True)
+    report.to_csv(args.report, index=False)
+    print(report.to_string())
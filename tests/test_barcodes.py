@@ -0,0 +1,23 @@
+from barcodes import BarcodeIndex
+import pandas as pd
+
+
+def test_content_cache_is_bounded():
+    index = BarcodeIndex(max_size=2)
+    first = pd.Index(['TCGA-85-4361-01A-11P-A000-07'])
+    index.parse(first)
+
+    for i in range(3):
+        index.parse(pd.Index([f'TCGA-85-436{i}-11A']))
+
+    assert len(index._barcodes) == 2
+    assert index.get_key(first) not in index._barcodes
+    assert index.parse(first)['sample_type'].tolist() == [1]
+
+
+def test_copies_share_the_parsed_barcodes():
+    index = BarcodeIndex()
+    barcodes = pd.Index(['TCGA-85-4361-01A', 'TCGA-85-4362-11A'])
+
+    assert index.parse(barcodes.copy()) is index.parse(barcodes)
+    assert index.is_primary_tumor(barcodes).tolist() == [True, False]
@@ -0,0 +1,53 @@
+from batch import discover_cohorts
+import pytest
+import os
+
+OMICS = ['mo_{}_RPPAArray-20160128.csv', 'mo_{}_miRNASeqGene-20160128.csv', 'mo_{}_RNASeq2Gene-20160128.csv']
+
+
+def touch(*parts):
+    path = os.path.join(*parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'w').close()
+    return path
+
+
+@pytest.mark.parametrize('root', ['data', 'data/', './data', './data/'])
+def test_flat_layout(tmp_path, monkeypatch, root):
+    monkeypatch.chdir(tmp_path)
+    for name in OMICS:
+        touch('data', name.format('PRAD'))
+    touch('data', 'mo_colData.csv')
+    touch('data', 'subtypes.csv')
+
+    cohorts = discover_cohorts(root)
+
+    assert list(cohorts) == ['PRAD']
+    assert os.path.normpath(cohorts['PRAD']['subtypes']) == os.path.join('data', 'subtypes.csv')
+
+
+@pytest.mark.parametrize('root', ['data', './data/'])
+def test_nested_layout_falls_back_to_root_annotations(tmp_path, monkeypatch, root):
+    monkeypatch.chdir(tmp_path)
+    for cohort in ['BRCA', 'PRAD']:
+        for name in OMICS:
+            touch('data', cohort, name.format(cohort))
+    touch('data', 'mo_colData.csv')
+    touch('data', 'subtypes.csv')
+    touch('data', 'PRAD', 'subtypes.csv')
+
+    cohorts = discover_cohorts(root)
+
+    assert sorted(cohorts) == ['BRCA', 'PRAD']
+    assert cohorts['BRCA']['subtypes'] == os.path.join('data', 'subtypes.csv')
+    assert cohorts['PRAD']['subtypes'] == os.path.join('data', 'PRAD', 'subtypes.csv')
+    assert cohorts['PRAD']['phenotype'] == os.path.join('data', 'mo_colData.csv')
+
+
+def test_incomplete_cohort_is_skipped(tmp_path):
+    for name in OMICS[:2]:
+        touch(str(tmp_path), name.format('LUAD'))
+    touch(str(tmp_path), 'mo_colData.csv')
+    touch(str(tmp_path), 'subtypes.csv')
+
+    assert discover_cohorts(str(tmp_path)) == {}
@@ -0,0 +1,85 @@
+from checkpoints import RunDirectory
+from models import Metrics, RandScore, AdjustedRandScore, NormalizedMutualInfoScore, SilhouetteScore
+import pandas as pd
+import numpy as np
+import pytest
+import json
+
+STAGES = ['datasets', 'similarity', 'fusion']
+DEPENDENCIES = {'datasets': ['precision'], 'similarity': ['K'], 'fusion': ['t']}
+
+
+@pytest.fixture
+def matrix() -> pd.DataFrame:
+    index = pd.Index([f'patient-{i}' for i in range(5)])
+    return pd.DataFrame(np.random.default_rng(0).random((5, 5)), index=index, columns=index)
+
+
+def test_matrices_round_trip_memory_mapped(tmp_path, matrix):
+    RunDirectory(str(tmp_path)).save_matrices('similarity', {'proteins': matrix, 'mrna': matrix * 2})
+
+    loaded = RunDirectory(str(tmp_path)).load_matrices('similarity')
+
+    assert list(loaded) == ['proteins', 'mrna']
+    values = loaded['proteins'].to_numpy()
+    while values is not None and not isinstance(values, np.memmap):
+        values = values.base
+    assert values is not None and values.filename.endswith('proteins.npy')
+    pd.testing.assert_frame_equal(loaded['proteins'], matrix)
+    pd.testing.assert_frame_equal(loaded['mrna'], matrix * 2)
+
+
+def test_interrupted_stage_is_missing(tmp_path, matrix, monkeypatch):
+    run = RunDirectory(str(tmp_path))
+    run.save_frames('datasets', {'proteins': matrix})
+
+    # The second matrix fails to be written, after the first one
+    save = np.save
+    monkeypatch.setattr(np, 'save', lambda path, values: save(path, values) if 'proteins' in str(path) else 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        run.save_matrices('similarity', {'proteins': matrix, 'mrna': matrix})
+
+    assert RunDirectory(str(tmp_path)).first_missing_stage(STAGES) == 'similarity'
+
+
+def test_manifest_is_replaced_atomically(tmp_path, matrix):
+    run = RunDirectory(str(tmp_path))
+    run.save_frames('datasets', {'proteins': matrix})
+
+    # A manifest that cannot be serialized leaves the previous one intact
+    run.manifest['configuration'] = {'unserializable': object()}
+    with pytest.raises(TypeError):
+        run.save_frames('similarity', {'proteins': matrix})
+
+    with open(tmp_path / 'manifest.json') as file:
+        assert list(json.load(file)['stages']) == ['datasets']
+    assert RunDirectory(str(tmp_path)).first_missing_stage(STAGES) == 'similarity'
+
+
+def test_changed_configuration_invalidates_dependent_stages(tmp_path, matrix):
+    run = RunDirectory(str(tmp_path))
+    run.update_configuration({'precision': 'float64', 'K': 20, 't': 20}, DEPENDENCIES)
+    run.save_frames('datasets', {'proteins': matrix})
+    run.save_matrices('similarity', {'proteins': matrix})
+    run.save_matrices('fusion', {'snf': matrix})
+
+    resumed = RunDirectory(str(tmp_path))
+    assert resumed.update_configuration({'precision': 'float64', 'K': 20, 't': 20}, DEPENDENCIES) == []
+    assert resumed.update_configuration({'precision': 'float64', 'K': 30, 't': 20}, DEPENDENCIES) == \
+           ['similarity', 'fusion']
+    assert RunDirectory(str(tmp_path)).first_missing_stage(STAGES) == 'similarity'
+
+
+def test_manifest_without_configuration_is_invalidated(tmp_path, matrix):
+    RunDirectory(str(tmp_path)).save_frames('datasets', {'proteins': matrix})
+
+    assert RunDirectory(str(tmp_path)).update_configuration({'precision': 'float64'}, DEPENDENCIES) == ['datasets']
+
+
+def test_metrics_round_trip(tmp_path):
+    metrics = Metrics(label='SNF', rand_score=RandScore(value=0.9), adjusted_rand_score=AdjustedRandScore(value=0.8),
+                      normalized_mutual_info_score=NormalizedMutualInfoScore(value=0.7),
+                      silhouette_score=SilhouetteScore(value=0.1))
+    RunDirectory(str(tmp_path)).save_metrics('metrics', {'snf': metrics})
+
+    assert RunDirectory(str(tmp_path)).load_metrics('metrics') == {'snf': metrics}
@@ -0,0 +1,53 @@
+from concurrent.futures import ProcessPoolExecutor
+from sklearn.preprocessing import LabelEncoder
+from code_maps import CodeMapIndex
+import pandas as pd
+import numpy as np
+
+
+def test_first_encoding_matches_label_encoder(tmp_path):
+    values = pd.Series(['luminal', 'basal', 'her2', 'basal', 'normal'])
+
+    codes = CodeMapIndex(cache_path=str(tmp_path)).encode('subtype', values)
+
+    np.testing.assert_array_equal(codes, LabelEncoder().fit_transform(values))
+
+
+def test_new_categories_are_appended(tmp_path):
+    index = CodeMapIndex(cache_path=str(tmp_path))
+    index.encode('subtype', pd.Series(['b', 'c']))
+
+    codes = index.encode('subtype', pd.Series(['a', 'c', None]))
+
+    np.testing.assert_array_equal(codes, [2, 1, np.nan])
+    assert list(CodeMapIndex(cache_path=str(tmp_path)).get('subtype')) == ['b', 'c', 'a']
+
+
+def test_stale_index_merges_persisted_categories(tmp_path):
+    first, second = CodeMapIndex(cache_path=str(tmp_path)), CodeMapIndex(cache_path=str(tmp_path))
+    second.get('subtype')
+
+    first_codes = first.encode('subtype', pd.Series(['b', 'a']))
+    second_codes = second.encode('subtype', pd.Series(['c', 'a']))
+
+    np.testing.assert_array_equal(first_codes, [1, 0])
+    np.testing.assert_array_equal(second_codes, [2, 0])
+    assert list(CodeMapIndex(cache_path=str(tmp_path)).get('subtype')) == ['a', 'b', 'c']
+
+
+def encode(cache_path: str, worker: int) -> dict:
+    categories = [f'shared-{i}' for i in range(5)] + [f'worker-{worker}-{i}' for i in range(5)]
+    index = CodeMapIndex(cache_path=cache_path)
+    return {category: index.encode('column', pd.Series([category]))[0] for category in categories}
+
+
+def test_concurrent_processes_assign_consistent_codes(tmp_path):
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        assignments = list(executor.map(encode, [str(tmp_path)] * 8, range(8)))
+
+    code_map = CodeMapIndex(cache_path=str(tmp_path)).get('column')
+
+    assert code_map.is_unique and len(code_map) == 5 + 8 * 5
+    for assignment in assignments:
+        for category, code in assignment.items():
+            assert code_map[code] == category
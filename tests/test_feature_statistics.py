@@ -0,0 +1,83 @@
+from pipeline_steps import ComputeFeatureStatistics, FilterByNanPercentage, FilterByVariance, FilterByMAD
+from feature_statistics import FeatureStatisticsIndex
+from models import ProteinsData
+import feature_statistics
+import pandas as pd
+import numpy as np
+import pytest
+import os
+
+
+@pytest.fixture
+def data() -> ProteinsData:
+    rng = np.random.default_rng(0)
+    values = rng.normal(scale=np.arange(1, 21), size=(50, 20))
+    values[rng.random(values.shape) < 0.1] = np.nan
+
+    return ProteinsData(values, columns=[f'protein-{i}' for i in range(20)])
+
+
+@pytest.fixture
+def fingerprints(monkeypatch) -> list:
+    calls = []
+    fingerprint = feature_statistics.get_data_fingerprint
+    monkeypatch.setattr(feature_statistics, 'get_data_fingerprint', lambda d: calls.append(d) or fingerprint(d))
+
+    return calls
+
+
+def test_statistics_match_pandas(data):
+    statistics = ComputeFeatureStatistics(index=FeatureStatisticsIndex(cache_path=None)).get_statistics(data).features
+
+    np.testing.assert_allclose(statistics['variance'], data.var())
+    np.testing.assert_allclose(statistics['median'], data.median())
+    np.testing.assert_allclose(statistics['mad'], (data - data.median()).abs().median())
+    np.testing.assert_allclose(statistics['min'], data.min())
+    np.testing.assert_allclose(statistics['nan_count'], data.isna().sum())
+
+
+def test_selectors_reuse_statistics_without_hashing(data, fingerprints, tmp_path):
+    index = FeatureStatisticsIndex(cache_path=str(tmp_path))
+    indexed = ComputeFeatureStatistics(index=index)(data=data)
+    assert indexed is data and len(fingerprints) == 1
+
+    for retain_k in [5, 10, 15]:
+        assert list(FilterByVariance(retain_k=retain_k, index=index)(data=data).columns) == \
+               list(data.var().sort_values(ascending=False).index[:retain_k])
+        FilterByMAD(retain_k=retain_k, index=index)(data=data)
+
+    assert len(fingerprints) == 1
+
+
+def test_equal_data_is_loaded_from_disk(data, tmp_path):
+    ComputeFeatureStatistics(index=FeatureStatisticsIndex(cache_path=str(tmp_path)))(data=data)
+
+    index = FeatureStatisticsIndex(cache_path=str(tmp_path))
+    pd.testing.assert_frame_equal(index.get(ProteinsData(data.copy())).features,
+                                  ComputeFeatureStatistics(index=index).get_statistics(data).features)
+
+
+def test_disk_cache_is_bounded(data, tmp_path):
+    index = FeatureStatisticsIndex(cache_path=str(tmp_path), max_files=3)
+
+    for i in range(6):
+        ComputeFeatureStatistics(index=index)(data=ProteinsData(data + i))
+
+    assert len(os.listdir(tmp_path / 'statistics')) == 3
+
+
+def test_nan_filter_indexes_the_filtered_statistics(data, fingerprints, tmp_path):
+    index = FeatureStatisticsIndex(cache_path=str(tmp_path))
+    data[['protein-0', 'protein-1']] = np.nan
+    data.iloc[:10, 2] = np.nan
+
+    filtered = FilterByNanPercentage(threshold=0.15, index=index)(data=data)
+    statistics = index.get(filtered)
+    expected = ComputeFeatureStatistics(index=FeatureStatisticsIndex(cache_path=None)).get_statistics(filtered)
+
+    assert 'protein-0' not in filtered.columns and 'protein-2' not in filtered.columns
+    pd.testing.assert_frame_equal(statistics.features, expected.features)
+    pd.testing.assert_series_equal(statistics.sample_nan_count, expected.sample_nan_count)
+
+    FilterByVariance(retain_k=5, index=index)(data=ComputeFeatureStatistics(index=index)(data=filtered))
+    assert len(fingerprints) == 1
@@ -0,0 +1,37 @@
+from out_of_core_fusion import fuse_out_of_core, get_tile_size
+from low_rank_fusion import fuse_low_rank
+from pipeline_steps import ComputeSNF
+import pandas as pd
+import numpy as np
+import pytest
+import snf
+
+
+@pytest.fixture
+def affinities() -> list[np.ndarray]:
+    rng = np.random.default_rng(0)
+    modalities = [rng.normal(size=(60, p)) for p in [8, 15, 30]]
+
+    return snf.make_affinity(modalities, K=10, mu=0.5)
+
+
+def test_out_of_core_matches_snf(affinities, tmp_path):
+    memory_budget = 3 * 60 * 10 * 16 + 5 * 60 * 8 * 16
+    assert get_tile_size(60, 3, 10, memory_budget, np.float64) < 60
+
+    fused, _ = fuse_out_of_core(affinities, K=10, t=5, memory_budget=memory_budget, scratch_path=str(tmp_path))
+
+    assert np.abs(np.asarray(fused) - snf.snf(affinities, K=10, t=5)).max() < 1e-15
+
+
+def test_out_of_core_step_matches_snf(affinities, tmp_path):
+    step = ComputeSNF(K=10, t=5, memory_budget=64 * 1024, scratch_path=str(tmp_path))
+    fused = step(data=[pd.DataFrame(affinity) for affinity in affinities])
+
+    assert np.abs(fused.to_numpy() - snf.snf(affinities, K=10, t=5)).max() < 1e-15
+
+
+def test_low_rank_with_full_landmarks_matches_snf(affinities):
+    fused = fuse_low_rank(affinities, K=10, t=5, landmarks_n=60)
+
+    np.testing.assert_allclose(fused, snf.snf(affinities, K=10, t=5), atol=1e-10)
@@ -0,0 +1,18 @@
+from sklearn.impute import KNNImputer
+from pipeline_steps import ImputeKNN
+from models import ProteinsData
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize('block_size', [7, 256])
+def test_matches_sklearn_on_overlapping_rows(block_size):
+    rng = np.random.default_rng(0)
+    values = rng.normal(size=(80, 30))
+    values[rng.random(values.shape) < 0.1] = np.nan
+    data = ProteinsData(values, columns=[f'protein-{i}' for i in range(30)])
+
+    imputed = ImputeKNN(K=5, block_size=block_size)(data=data)
+
+    np.testing.assert_allclose(imputed.to_numpy(), KNNImputer(n_neighbors=5).fit_transform(values), atol=1e-12)
+    assert list(imputed.columns) == list(data.columns)
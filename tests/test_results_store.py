@@ -0,0 +1,26 @@
+from models import Metrics, RandScore, AdjustedRandScore, NormalizedMutualInfoScore, SilhouetteScore
+from results_store import ResultsStore
+import results_store
+import pandas as pd
+import os
+
+
+def get_metrics(label: str, value: float) -> Metrics:
+    return Metrics(label=label, rand_score=RandScore(value=value), adjusted_rand_score=AdjustedRandScore(value=value),
+                   normalized_mutual_info_score=NormalizedMutualInfoScore(value=value),
+                   silhouette_score=SilhouetteScore(value=value))
+
+
+def test_partitions_of_both_formats_are_read(tmp_path, monkeypatch):
+    monkeypatch.setattr(results_store, 'PARTITION_FORMAT', 'pickle')
+    store = ResultsStore(str(tmp_path))
+    store.append([get_metrics('SNF', 0.5)], run_id='pickled', parameters={'retain_k': 100, 'K': 20})
+
+    # A partition written by a writer with pyarrow, read here with a stand-in for the parquet reader
+    partition = next(name for name in os.listdir(tmp_path))
+    pd.read_pickle(tmp_path / partition).assign(run_id='parquet').to_pickle(tmp_path / 'z.parquet')
+    monkeypatch.setattr(pd, 'read_parquet', pd.read_pickle)
+
+    records = ResultsStore(str(tmp_path)).query(retain_k=100)
+
+    assert sorted(records['run_id']) == ['parquet', 'pickled']
@@ -0,0 +1,50 @@
+from pipeline_steps import SimilarityMatrices
+from precision import use_precision
+from models import ProteinsData
+from scipy.spatial.distance import cdist
+from scipy import stats
+import numpy as np
+import pytest
+import snf
+
+
+@pytest.fixture
+def data() -> ProteinsData:
+    return ProteinsData(np.random.default_rng(0).normal(size=(80, 12)))
+
+
+def test_kernel_matches_scipy():
+    rng = np.random.default_rng(0)
+    distances = rng.random((50, 50)) * 10
+    distances[3, 4] = np.nan
+    rows_average, columns_average = rng.random((50, 1)), rng.random((1, 50))
+
+    sigma = ((rows_average + np.spacing(1)) + (columns_average + np.spacing(1)) + distances) / 3
+    sigma = sigma * (sigma > np.spacing(1)) + np.spacing(1)
+    expected = stats.norm.pdf(np.nan_to_num(distances), loc=0, scale=0.5 * np.nan_to_num(sigma) + np.isnan(distances))
+    expected[np.isnan(distances)] = np.nan
+
+    np.testing.assert_array_equal(SimilarityMatrices.kernel(distances, rows_average, columns_average), expected)
+
+
+def test_matches_snf_affinity(data):
+    scaled = ((data - data.mean()) / data.std(ddof=0)).to_numpy()
+    expected = snf.compute.affinity_matrix(cdist(scaled, scaled, metric='sqeuclidean'), K=20, mu=0.5)
+
+    np.testing.assert_allclose(SimilarityMatrices()(data=[data])[0], expected, rtol=1e-10)
+
+
+def test_float32_stays_float32(data):
+    with use_precision('float32'):
+        matrix, = SimilarityMatrices()(data=[ProteinsData(data.astype(np.float32))])
+
+    assert (matrix.dtypes == np.float32).all()
+    np.testing.assert_allclose(matrix, SimilarityMatrices()(data=[data])[0], rtol=1e-4)
+
+
+def test_default_K_max_covers_K(data):
+    assert SimilarityMatrices(K=60).K_max == 60
+    assert SimilarityMatrices(K=20).K_max == 50
+
+    with pytest.raises(ValueError):
+        SimilarityMatrices(K=60, K_max=50)
@@ -0,0 +1,48 @@
+from sparse_spectral import get_knn_graph, get_normalized_laplacian, get_spectral_embedding
+from pipeline_steps import ComputeSpectralClustering
+from sklearn.metrics import adjusted_rand_score
+import pandas as pd
+import numpy as np
+import pytest
+import snf
+
+
+@pytest.fixture(scope='module')
+def affinity() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    sizes = [400, 400, 400]
+    centers = np.repeat(np.eye(10)[:3] * 6, sizes, axis=0)
+
+    return pd.DataFrame(snf.make_affinity(rng.normal(size=(sum(sizes), 10)) + centers, K=20))
+
+
+@pytest.mark.parametrize('eigen_solver', ['arpack', 'lobpcg'])
+def test_eigenvalues_match_dense_decomposition(affinity, eigen_solver):
+    graph = get_knn_graph(affinity.to_numpy(), K=20)
+    laplacian, sqrt_degrees = get_normalized_laplacian(graph)
+    expected = np.linalg.eigvalsh(laplacian.toarray())[:3]
+
+    embedding = get_spectral_embedding(graph, components_n=3, eigen_solver=eigen_solver, random_state=0)
+    eigenvectors = embedding * sqrt_degrees[:, None]
+    eigenvectors /= np.linalg.norm(eigenvectors, axis=0)
+    eigenvalues = np.einsum('ij,ij->j', eigenvectors, laplacian @ eigenvectors)
+
+    np.testing.assert_allclose(eigenvalues, expected, atol=1e-6)
+
+
+@pytest.mark.parametrize('eigen_solver', ['arpack', 'lobpcg'])
+def test_sparse_labels_match_dense_backend(affinity, eigen_solver):
+    labels = np.repeat([0, 1, 2], 400)
+    dense = ComputeSpectralClustering(backend='dense', kmeans_random_state=0)(data=affinity, clusters_n=3)
+    sparse = ComputeSpectralClustering(backend='sparse', eigen_solver=eigen_solver, eigen_random_state=0,
+                                       kmeans_random_state=0)(data=affinity, clusters_n=3)
+
+    # The dense backend diffuses over the full affinity and the sparse one over its K nearest neighbors graph, so
+    # only the samples between two clusters may be assigned differently
+    assert adjusted_rand_score(dense, sparse) > 0.99
+    assert adjusted_rand_score(labels, sparse) > 0.99
+
+
+def test_unknown_eigen_solver():
+    with pytest.raises(ValueError):
+        ComputeSpectralClustering(backend='sparse', eigen_solver='amg')
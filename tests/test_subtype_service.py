@@ -0,0 +1,89 @@
+from subtype_service import MicroBatcher, SubtypeService
+from models import ProteinsData, mRNAData
+from subtype_model import SubtypeModel
+import numpy as np
+import pytest
+import asyncio
+import json
+
+
+@pytest.fixture(scope='module')
+def model() -> SubtypeModel:
+    rng = np.random.default_rng(0)
+    patients = [f'patient-{i}' for i in range(60)]
+    centers = np.repeat(np.eye(3), 20, axis=0) * 4
+
+    proteins = ProteinsData(np.hstack([centers, rng.normal(size=(60, 5))]) + rng.normal(size=(60, 8)),
+                            index=patients, columns=[f'protein-{i}' for i in range(8)])
+    mrna = mRNAData(np.hstack([centers, rng.normal(size=(60, 7))]) + rng.normal(size=(60, 10)),
+                    index=patients, columns=[f'gene-{i}' for i in range(10)])
+
+    return SubtypeModel.fit([proteins, mrna], K=10, t=10, clusters_n=3)
+
+
+def get_patients(model: SubtypeModel, seed: int, patients_n: int = 3) -> dict:
+    rng = np.random.default_rng(seed)
+    return {f'new-{seed}-{i}': {modality.name: dict(zip(modality.features, rng.normal(size=len(modality.features))))
+                                for modality in model.modalities}
+            for i in range(patients_n)}
+
+
+def test_invalid_request_only_fails_itself(model):
+    async def run():
+        batcher = MicroBatcher(model=model, max_delay=0.05)
+        task = asyncio.create_task(batcher.run())
+        loop = asyncio.get_running_loop()
+
+        # The invalid request is queued directly, as if it had passed the validation
+        futures = [loop.create_future() for _ in range(3)]
+        requests = [get_patients(model, 0), {'bad': {'unknown': {'x': 1.0}}}, get_patients(model, 1)]
+        for patients, future in zip(requests, futures):
+            await batcher.queue.put((patients, future))
+
+        results = await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), timeout=10)
+        task.cancel()
+        return requests, results
+
+    requests, results = asyncio.run(run())
+
+    assert isinstance(results[1], ValueError)
+    for patients, result in zip([requests[0], requests[2]], [results[0], results[2]]):
+        expected = MicroBatcher(model=model)._assign_batch([patients])[0]
+        assert result.keys() == expected.keys()
+        for patient in patients:
+            assert result[patient]['cluster'] == expected[patient]['cluster']
+            np.testing.assert_allclose(list(result[patient]['scores'].values()),
+                                       list(expected[patient]['scores'].values()))
+
+
+def test_assign_rejects_unknown_modality(model):
+    async def run():
+        await MicroBatcher(model=model).assign({'bad': {'unknown': {'x': 1.0}}})
+
+    with pytest.raises(ValueError, match='Unknown modality'):
+        asyncio.run(run())
+
+
+@pytest.mark.parametrize('body', [b'{"patients": ["a", "b"]}', b'{"patients": {"a": 1}}', b'[1, 2]', b'not json'])
+def test_malformed_payload_gets_a_response(model, body):
+    async def run():
+        service = SubtypeService(model=model)
+        server = await asyncio.start_server(service.handle, host='127.0.0.1', port=0)
+        batcher = asyncio.create_task(service.batcher.run())
+        port = server.sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'POST /assign HTTP/1.1\r\nContent-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout=10)
+        writer.close()
+
+        batcher.cancel()
+        server.close()
+        await server.wait_closed()
+        return response
+
+    status, _, content = asyncio.run(run()).partition(b'\r\n\r\n')
+
+    assert status.startswith(b'HTTP/1.1 400')
+    assert 'error' in json.loads(content)